@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+import re
+import shutil
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from blobstore import BlobStore, hash_chunks
+from generator import VendorTreeGenerator, find_partition_images
+from image import image_size, open_image
+
+_HASH_CHUNK_SIZE = 1 << 20
+
+BatchJob = namedtuple(
+    "BatchJob",
+    [
+        "name", "vendor", "device", "images", "output", "android_version", "patterns", "pin",
+        "dedup",
+    ],
+)
+
+
+class BatchError(ValueError):
+    pass
+
+
+def _hash_image(path) -> Optional[str]:
+    """Digest of an image's contents as ``open_image`` reads them, or None.
+
+    Split parts, compressed siblings and tar bundle members are read in
+    place, so copies of one build stored any of those ways hash the same.
+    """
+    try:
+        with open_image(path) as image:
+            return hash_chunks(iter(lambda: image.read(_HASH_CHUNK_SIZE), b""))
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not hash {path}: {e}")
+        return None
+
+
+def load_jobs(path) -> List[BatchJob]:
+    """Read a job manifest.
+
+    The file is JSON, either a list of jobs or ``{"jobs": [...]}``. Each job
+    needs ``vendor``, ``device``, ``images`` and ``output`` and may set
+    ``android_version``, ``patterns``, ``pin`` and ``dedup``. Relative paths
+    are taken relative to the manifest's directory.
+    """
+    path = Path(path)
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get("jobs", [])
+
+    base = path.parent
+    jobs, names = [], set()
+    for i, spec in enumerate(data):
+        required = ("vendor", "device", "images", "output")
+        missing = [field for field in required if not spec.get(field)]
+        if missing:
+            raise BatchError(f"Job {i} in {path} is missing {', '.join(missing)}")
+        name = re.sub(r"[^A-Za-z0-9._-]", "_", f"{spec['vendor']}_{spec['device']}")
+        if name in names:
+            name = f"{name}-{i}"
+        names.add(name)
+        patterns = spec.get("patterns")
+        jobs.append(BatchJob(
+            name=name,
+            vendor=spec["vendor"],
+            device=spec["device"],
+            images=base / spec["images"],
+            output=base / spec["output"],
+            android_version=str(spec.get("android_version", "13")),
+            patterns=str(base / patterns) if patterns else None,
+            pin=bool(spec.get("pin", False)),
+            dedup=bool(spec.get("dedup", False)),
+        ))
+    return jobs
+
+
+class BatchRunner:
+    """Generate vendor trees for many devices under one worker budget.
+
+    Every job gets its own work directory below ``work_dir``. Partition
+    images are first grouped by content, so an image shared by several
+    device variants (same partition name, same patterns, same bytes) is
+    extracted once and linked into each job's work directory. Extraction
+    runs on one pool of ``budget`` workers; tree generation then runs
+    several jobs at a time, splitting the same budget between them.
+    """
+
+    def __init__(
+        self,
+        jobs: List[BatchJob],
+        work_dir,
+        budget: Optional[int] = None,
+        materialize: str = "auto",
+        blob_store=None,
+        blob_store_max_bytes: Optional[int] = None,
+        verbose: bool = False,
+    ):
+        self.jobs = jobs
+        self.work_dir = Path(work_dir)
+        self.budget = max(1, budget or os.cpu_count() or 1)
+        self.materialize = materialize
+        self.verbose = verbose
+        self.blob_store = BlobStore(blob_store, blob_store_max_bytes) if blob_store else None
+
+    def _generator(self, job: BatchJob, jobs: int, work_dir: Path) -> VendorTreeGenerator:
+        return VendorTreeGenerator(
+            vendor_name=job.vendor,
+            device_name=job.device,
+            android_version=job.android_version,
+            verbose=self.verbose,
+            patterns_path=job.patterns,
+            jobs=jobs,
+            materialize=self.materialize,
+            blob_store=self.blob_store,
+            pin_sha1=job.pin,
+            dedup=job.dedup,
+            work_dir=work_dir,
+        )
+
+    def _group_images(self) -> Dict[tuple, List[tuple]]:
+        """Map one key per distinct image to the ``(job, path)`` pairs using it.
+
+        Only images that share a partition name and size with another one
+        are hashed; the rest are distinct without reading them.
+        """
+        candidates = []
+        for job in self.jobs:
+            for image_path in find_partition_images(job.images):
+                real = os.path.realpath(image_path)
+                candidates.append((job, image_path, (image_path.stem, job.patterns, real)))
+
+        by_size: Dict[tuple, set] = {}
+        for _, image_path, (stem, patterns, real) in candidates:
+            by_size.setdefault((stem, patterns, image_size(real)), set()).add(real)
+        to_hash = sorted({real for reals in by_size.values() if len(reals) > 1 for real in reals})
+        with ThreadPoolExecutor(max_workers=self.budget, thread_name_prefix="batch-hash") as pool:
+            digests = dict(zip(to_hash, pool.map(_hash_image, to_hash)))
+
+        groups: Dict[tuple, List[tuple]] = {}
+        for job, image_path, (stem, patterns, real) in candidates:
+            identity = digests.get(real) or real
+            groups.setdefault((stem, patterns, identity), []).append((job, image_path))
+        return groups
+
+    def _extract(self, index: int, users: List[tuple]) -> bool:
+        job, image_path = users[0]
+        shared_dir = self.work_dir / "images" / str(index)
+        if shared_dir.exists():
+            shutil.rmtree(shared_dir)
+        generator = self._generator(job, 1, shared_dir)
+        if not generator.extract_image(image_path):
+            return False
+        for user_job, user_path in users:
+            link = self.work_dir / "jobs" / user_job.name / user_path.stem
+            link.parent.mkdir(parents=True, exist_ok=True)
+            if link.is_symlink():
+                link.unlink()
+            link.symlink_to(os.path.relpath(shared_dir / user_path.stem, link.parent))
+        return True
+
+    def _generate(self, job: BatchJob, jobs: int) -> bool:
+        job_dir = self.work_dir / "jobs" / job.name
+        if not job_dir.is_dir():
+            logging.error(f"[{job.name}] nothing was extracted")
+            return False
+        generator = self._generator(job, jobs, job_dir)
+        return generator.generate_tree(str(job_dir), str(job.output))
+
+    def run(self) -> Dict[str, bool]:
+        """Run every job; returns ``{job name: success}`` in manifest order."""
+        groups = self._group_images()
+        shared = sum(len(users) - 1 for users in groups.values())
+        logging.info(
+            f"Batch: {len(self.jobs)} jobs, {len(groups)} distinct images "
+            f"({shared} shared), worker budget {self.budget}"
+        )
+
+        for job in self.jobs:
+            shutil.rmtree(self.work_dir / "jobs" / job.name, ignore_errors=True)
+
+        failed_jobs = set()
+        with ThreadPoolExecutor(
+            max_workers=self.budget, thread_name_prefix="batch-extract"
+        ) as pool:
+            futures = [
+                (users, pool.submit(self._extract, index, users))
+                for index, users in enumerate(groups.values())
+            ]
+            for users, future in futures:
+                try:
+                    ok = future.result()
+                except Exception as e:
+                    logging.error(f"Extraction of {users[0][1]} failed: {e}")
+                    ok = False
+                if not ok:
+                    failed_jobs.update(job.name for job, _ in users)
+                    logging.warning(
+                        f"Failed to extract {users[0][1]} for "
+                        f"{', '.join(job.name for job, _ in users)}"
+                    )
+
+        concurrent = max(1, min(len(self.jobs), self.budget))
+        per_job = max(1, self.budget // concurrent)
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrent, thread_name_prefix="batch-job") as pool:
+            futures = [(job, pool.submit(self._generate, job, per_job)) for job in self.jobs]
+            for job, future in futures:
+                try:
+                    results[job.name] = bool(future.result())
+                except Exception as e:
+                    logging.error(f"[{job.name}] generation failed: {e}")
+                    results[job.name] = False
+                if job.name in failed_jobs:
+                    logging.error(
+                        f"[{job.name}] tree is missing partitions that failed to extract"
+                    )
+                    results[job.name] = False
+        return results
@@ -0,0 +1,455 @@
+#!/usr/bin/env python3
+
+"""Synthetic partition images for the benchmarks and tests.
+
+Everything here runs offline and without root: partition trees are
+generated with a seeded RNG, ext4 images are built with ``mke2fs -d``,
+EROFS images with ``mkfs.erofs`` when it is installed (or the small
+pure-Python ``write_erofs``), and the sparse and super.img containers are
+written in pure Python.
+"""
+
+import hashlib
+import os
+import random
+import shutil
+import stat
+import struct
+import subprocess
+from collections import namedtuple
+from typing import List, Optional, Tuple
+
+from sparse import (
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    CHUNK_TYPE_RAW,
+    SPARSE_HEADER_MAGIC,
+)
+
+TreeSpec = namedtuple("TreeSpec", ["files", "depth", "blob_size", "seed"])
+
+_TOP_DIRS = ("lib64", "bin", "etc", "firmware")
+
+
+# ELF
+
+
+def fake_elf(soname: Optional[str], needed: List[str], size: int, rng: random.Random,
+             executable: bool = False) -> bytes:
+    """A minimal aarch64 ELF64 image with a dynamic segment, padded to ``size``.
+
+    It carries just enough structure (program headers, DT_SONAME,
+    DT_NEEDED, PT_INTERP for executables) for ``elf.parse_elf``; the rest is
+    compressible filler.
+    """
+    strtab = bytearray(b"\0")
+    interp_offset = None
+    if executable:
+        interp_offset = len(strtab)
+        strtab += b"/system/bin/linker64\0"
+    dyn = []
+    for name in needed:
+        dyn.append((1, len(strtab)))
+        strtab += name.encode() + b"\0"
+    if soname:
+        dyn.append((14, len(strtab)))
+        strtab += soname.encode() + b"\0"
+
+    phnum = 3 if executable else 2
+    strtab_offset = 64 + 56 * phnum
+    dynamic_offset = (strtab_offset + len(strtab) + 7) & ~7
+    dyn += [(5, strtab_offset), (10, len(strtab)), (0, 0)]
+    dynamic = b"".join(struct.pack("<qQ", tag, value) for tag, value in dyn)
+    header_end = dynamic_offset + len(dynamic)
+    total = max(size, header_end)
+
+    ehdr = b"\x7fELF" + bytes([2, 1, 1]) + bytes(9)
+    ehdr += struct.pack("<HHIQQQIHHHHHH", 3, 183, 1, 0, 64, 0, 0, 64, 56, phnum, 64, 0, 0)
+    phdrs = struct.pack("<IIQQQQQQ", 1, 5, 0, 0, 0, total, total, 0x1000)
+    phdrs += struct.pack("<IIQQQQQQ", 2, 6, dynamic_offset, dynamic_offset, dynamic_offset,
+                         len(dynamic), len(dynamic), 8)
+    if executable:
+        at = strtab_offset + interp_offset
+        phdrs += struct.pack("<IIQQQQQQ", 3, 4, at, at, at, 21, 21, 1)
+
+    image = bytearray(ehdr + phdrs + strtab)
+    image += bytes(dynamic_offset - len(image)) + dynamic
+    image += _filler(total - len(image), rng)
+    return bytes(image)
+
+
+def _filler(length: int, rng: random.Random) -> bytes:
+    """Roughly 4:1 compressible data, like typical code and firmware blobs."""
+    if length <= 0:
+        return b""
+    n = min(length, 1024)
+    unit = rng.getrandbits(8 * n).to_bytes(n, "little")
+    return (unit * (length // len(unit) + 1))[:length]
+
+
+# Trees
+
+
+def make_tree(root: str, spec: TreeSpec) -> List[Tuple[str, int]]:
+    """Populate ``root`` with ``spec.files`` files; returns ``[(rel_path, size)]``.
+
+    Files are spread over the selected top-level directories and nested
+    up to ``spec.depth`` levels. ``lib64`` holds shared libraries that
+    depend on each other, ``bin`` executables linking against them.
+    """
+    rng = random.Random(spec.seed)
+    created = []
+    libraries = []
+    for i in range(spec.files):
+        top = _TOP_DIRS[i % len(_TOP_DIRS)]
+        parts = [top] + [f"d{rng.randrange(4)}" for _ in range(rng.randrange(spec.depth))]
+        size = max(64, int(rng.expovariate(1 / spec.blob_size)))
+        if top == "lib64":
+            name = f"libbench{i}.so"
+            data = fake_elf(name, rng.sample(libraries, min(3, len(libraries))), size, rng)
+            libraries.append(name)
+        elif top == "bin":
+            name = f"bench{i}"
+            data = fake_elf(None, rng.sample(libraries, min(3, len(libraries))) + ["liblog.so"],
+                            size, rng, executable=True)
+        elif top == "etc":
+            name = f"bench{i}.rc"
+            data = _filler(size, rng)
+        else:
+            name = f"bench{i}.bin"
+            data = _filler(size, rng)
+        rel_path = "/".join(parts + [name])
+        path = os.path.join(root, rel_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        created.append((rel_path, len(data)))
+    return created
+
+
+def tree_size(files: List[Tuple[str, int]]) -> int:
+    return sum(size for _, size in files)
+
+
+# Filesystem images
+
+
+def have_mke2fs() -> bool:
+    return shutil.which("mke2fs") is not None
+
+
+def have_mkfs_erofs() -> bool:
+    return shutil.which("mkfs.erofs") is not None
+
+
+def build_ext4(src_dir: str, image_path: str, data_bytes: int, block_size: int = 4096,
+               features: Optional[str] = None):
+    """Build an ext4 image of ``src_dir`` without root via ``mke2fs -d``.
+
+    ``features`` is passed to ``-O``, e.g. ``^extent`` for block-mapped
+    files or ``inline_data``.
+    """
+    size_kb = (data_bytes * 3 // 2 + (16 << 20)) // 1024
+    options = ["-O", features] if features else []
+    subprocess.run(
+        ["mke2fs", "-q", "-F", "-t", "ext4", "-b", str(block_size), *options, "-d", src_dir,
+         image_path, f"{size_kb}K"],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        env={**os.environ, "E2FSPROGS_FAKE_TIME": "1230768000"},
+    )
+
+
+def build_erofs(src_dir: str, image_path: str, compression: Optional[str] = "lz4"):
+    """Build an EROFS image with ``mkfs.erofs``."""
+    cmd = ["mkfs.erofs", "-T1230768000"]
+    if compression:
+        cmd.append(f"-z{compression}")
+    subprocess.run(cmd + [image_path, src_dir], check=True, stdout=subprocess.DEVNULL)
+
+
+def lz4_compress_block(data: bytes) -> bytes:
+    """Greedy LZ4 block encoder, enough to produce real matches for fixtures."""
+    out = bytearray()
+
+    def length_bytes(value: int):
+        while value >= 255:
+            out.append(255)
+            value -= 255
+        out.append(value)
+
+    def sequence(literals: bytes, offset: int = 0, match_len: int = 0):
+        extra = match_len - 4 if offset else 0
+        out.append((min(len(literals), 15) << 4) | min(extra, 15))
+        if len(literals) >= 15:
+            length_bytes(len(literals) - 15)
+        out.extend(literals)
+        if offset:
+            out.extend(struct.pack("<H", offset))
+            if extra >= 15:
+                length_bytes(extra - 15)
+
+    table, anchor, i, n = {}, 0, 0, len(data)
+    # LZ4 needs the last match to start 12 bytes and end 5 bytes before the end.
+    while i + 12 <= n:
+        key = data[i:i + 4]
+        ref = table.get(key)
+        table[key] = i
+        if ref is None or i - ref > 0xFFFF:
+            i += 1
+            continue
+        length = 4
+        while i + length < n - 5 and data[ref + length] == data[i + length]:
+            length += 1
+        sequence(data[anchor:i], i - ref, length)
+        i += length
+        anchor = i
+    sequence(data[anchor:])
+    return bytes(out)
+
+
+_EROFS_BLOCK = 4096
+
+
+def _erofs_type(entry: dict) -> int:
+    """EROFS_FT_* file type of a directory entry."""
+    if stat.S_ISDIR(entry["mode"]):
+        return 2
+    return 7 if stat.S_ISLNK(entry["mode"]) else 1
+
+
+def write_erofs(src_dir: str, image_path: str, compress: bool = False,
+                build_time: int = 1230768000):
+    """Write an EROFS image of ``src_dir`` in pure Python, for hosts without mkfs.erofs.
+
+    Inodes are compact. Files smaller than a block and symlinks are stored
+    inline, larger ones as plain blocks with an inline tail; with
+    ``compress`` every non-empty file uses full lcluster indexes and is LZ4
+    compressed per block (stored plain where that does not help).
+    """
+    bs = _EROFS_BLOCK
+    entries = []
+
+    def collect(path, rel):
+        st = os.lstat(path)
+        entry = {"path": path, "rel": rel, "mode": st.st_mode, "children": []}
+        entries.append(entry)
+        if os.path.isdir(path) and not os.path.islink(path):
+            for name in sorted(os.listdir(path)):
+                entry["children"].append(
+                    (name, collect(os.path.join(path, name), f"{rel}/{name}"))
+                )
+        elif os.path.islink(path):
+            entry["data"] = os.readlink(path).encode()
+        else:
+            with open(path, "rb") as f:
+                entry["data"] = f.read()
+        return entry
+
+    root = collect(src_dir, "")
+
+    # Metadata: inodes at 32-byte slots, inline data right behind them.
+    meta = bytearray()
+    for entry in entries:
+        data = entry.get("data", b"")
+        if stat.S_ISDIR(entry["mode"]):
+            entry["layout"], extra = 0, 0
+        elif compress and data and not os.path.islink(entry["path"]):
+            entry["layout"] = 1
+            entry["lclusters"] = -(-len(data) // bs)
+            extra = 16 + 8 * entry["lclusters"]
+        else:
+            entry["layout"] = 2 if len(data) % bs else 0
+            extra = len(data) % bs
+        start = (len(meta) + 31) // 32 * 32
+        if start // bs != (start + 32 + extra - 1) // bs:
+            start = (start // bs + 1) * bs
+        meta.extend(bytes(start - len(meta) + 32 + extra))
+        entry["nid"] = start // 32
+    meta_blocks = -(-len(meta) // bs)
+    data_blocks = bytearray()
+    first_data = 1 + meta_blocks
+
+    for entry in entries:
+        if stat.S_ISDIR(entry["mode"]):
+            names = [(b".", entry), (b"..", entry)] + [
+                (name.encode(), child) for name, child in entry["children"]
+            ]
+            names.sort(key=lambda item: item[0])
+            dirents, block = [], []
+            for item in names:
+                used = sum(12 + len(name) for name, _ in block)
+                if block and used + 12 + len(item[0]) > bs:
+                    dirents.append(block)
+                    block = []
+                block.append(item)
+            dirents.append(block)
+            data = b""
+            for block in dirents:
+                nameoff = 12 * len(block)
+                raw = b""
+                for name, child in block:
+                    raw += struct.pack("<QHBB", child["nid"], nameoff, _erofs_type(child), 0)
+                    nameoff += len(name)
+                raw += b"".join(name for name, _ in block)
+                data += raw if block is dirents[-1] else raw.ljust(bs, b"\0")
+            entry["data"] = data
+
+    for entry in entries:
+        data = entry["data"]
+        pos = entry["nid"] * 32
+        i_u = first_data + len(data_blocks) // bs
+        tail = b""
+        if entry["layout"] == 1:
+            index = bytearray()
+            blocks = 0
+            for lcn in range(entry["lclusters"]):
+                chunk = data[lcn * bs:(lcn + 1) * bs]
+                packed = lz4_compress_block(chunk)
+                blkaddr = first_data + len(data_blocks) // bs
+                if len(packed) < len(chunk):
+                    data_blocks.extend(packed.rjust(bs, b"\0"))
+                    index += struct.pack("<HHI", 1, 0, blkaddr)
+                else:
+                    data_blocks.extend(chunk.ljust(bs, b"\0"))
+                    index += struct.pack("<HHI", 0, 0, blkaddr)
+                blocks += 1
+            i_u = blocks
+            header_pos = (pos + 32 + 7) // 8 * 8
+            meta[header_pos:header_pos + 8] = struct.pack("<HHHBB", 0, 0, 0, 0, 0)
+            meta[header_pos + 16:header_pos + 16 + len(index)] = index
+        else:
+            full = len(data) // bs * bs if entry["layout"] == 2 else len(data)
+            data_blocks.extend(data[:full])
+            data_blocks.extend(bytes(-len(data_blocks) % bs))
+            tail = data[full:]
+        nlink = 2 if stat.S_ISDIR(entry["mode"]) else 1
+        meta[pos:pos + 32] = struct.pack(
+            "<HHHHIIIIHHI", entry["layout"] << 1, 0, entry["mode"], nlink, len(data), 0, i_u,
+            entry["nid"], 0, 0, 0,
+        )
+        meta[pos + 32:pos + 32 + len(tail)] = tail
+
+    sb = struct.pack(
+        "<IIIBBHQQIIII", 0xE0F5E1E2, 0, 0, 12, 0, root["nid"], len(entries), build_time, 0,
+        first_data + len(data_blocks) // bs, 1, 0,
+    )
+    sb = sb.ljust(80, b"\0") + struct.pack("<I", 1 if compress else 0)
+    with open(image_path, "wb") as f:
+        f.write(bytes(1024) + sb.ljust(bs - 1024, b"\0"))
+        f.write(bytes(meta).ljust(meta_blocks * bs, b"\0"))
+        f.write(data_blocks)
+
+
+# Sparse images
+
+
+def write_sparse(raw_path: str, sparse_path: str, block_size: int = 4096):
+    """Convert a raw image to Android sparse format, like ``img2simg``.
+
+    Runs of zero blocks become DONT_CARE chunks, blocks repeating one
+    32-bit word become FILL chunks and everything else RAW chunks.
+    """
+    total_blocks = (os.path.getsize(raw_path) + block_size - 1) // block_size
+    zero = bytes(block_size)
+    chunks = 0
+
+    def kind(block: bytes):
+        if block == zero:
+            return CHUNK_TYPE_DONT_CARE
+        if block[:4] * (block_size // 4) == block:
+            return CHUNK_TYPE_FILL
+        return CHUNK_TYPE_RAW
+
+    with open(raw_path, "rb") as src, open(sparse_path, "wb") as dst:
+        dst.write(bytes(28))
+        pending_type, pending = None, []
+
+        def flush():
+            nonlocal chunks
+            if pending_type is None:
+                return
+            count = len(pending)
+            if pending_type == CHUNK_TYPE_RAW:
+                data = b"".join(pending)
+                dst.write(struct.pack("<HHII", CHUNK_TYPE_RAW, 0, count, 12 + len(data)))
+                dst.write(data)
+            elif pending_type == CHUNK_TYPE_FILL:
+                dst.write(struct.pack("<HHII", CHUNK_TYPE_FILL, 0, count, 16) + pending[0][:4])
+            else:
+                dst.write(struct.pack("<HHII", CHUNK_TYPE_DONT_CARE, 0, count, 12))
+            chunks += 1
+
+        for _ in range(total_blocks):
+            block = src.read(block_size).ljust(block_size, b"\0")
+            block_type = kind(block)
+            same_fill = block_type != CHUNK_TYPE_FILL or (pending and pending[0][:4] == block[:4])
+            if block_type == pending_type and same_fill and len(pending) < 4096:
+                pending.append(block)
+                continue
+            flush()
+            pending_type, pending = block_type, [block]
+        flush()
+
+        dst.seek(0)
+        dst.write(struct.pack("<IHHHHIIII", SPARSE_HEADER_MAGIC, 1, 0, 28, 12, block_size,
+                              total_blocks, chunks, 0))
+
+
+# super.img
+
+
+def build_super(partitions: List[Tuple[str, str]], super_path: str, slots: int = 2,
+                metadata_max_size: int = 65536):
+    """Write a liblp super.img holding ``[(name, image_path)]``.
+
+    Every partition gets one linear extent in the ``default`` group; the
+    primary and backup geometry and metadata copies are all written.
+    """
+    sector = 512
+    align = 1 << 20
+    first_sector = -(-(4096 + 2 * 4096 + 2 * slots * metadata_max_size) // align) * align // sector
+
+    layout = []
+    cursor = first_sector
+    partition_rows, extent_rows = [], []
+    for name, image_path in partitions:
+        sectors = -(-os.path.getsize(image_path) // sector)
+        partition_rows.append(
+            struct.pack("<36sIIII", name.encode(), 1, len(extent_rows), 1, 0)
+        )
+        extent_rows.append(struct.pack("<QIQI", sectors, 0, cursor, 0))
+        layout.append((cursor * sector, image_path))
+        cursor += -(-sectors * sector // align) * align // sector
+
+    groups = struct.pack("<36sIQ", b"default", 0, 0)
+    devices = struct.pack("<QIIQ36sI", first_sector, 0, 0, cursor * sector, b"super", 0)
+    tables = b"".join(partition_rows) + b"".join(extent_rows) + groups + devices
+
+    descriptors, offset = b"", 0
+    for rows, entry_size in ((partition_rows, 52), (extent_rows, 24), ([groups], 48),
+                             ([devices], 64)):
+        descriptors += struct.pack("<III", offset, len(rows), entry_size)
+        offset += len(rows) * entry_size
+    header = struct.pack("<IHHI32sI32s", 0x414C5030, 10, 0, 128, bytes(32), len(tables),
+                         hashlib.sha256(tables).digest()) + descriptors
+    header = header[:12] + hashlib.sha256(header).digest() + header[44:]
+    metadata = header + tables
+
+    geometry = struct.pack("<II32sIII", 0x616C4467, 52, bytes(32), metadata_max_size, slots, 4096)
+    geometry = geometry[:8] + hashlib.sha256(geometry).digest() + geometry[40:]
+
+    with open(super_path, "wb") as f:
+        f.truncate(cursor * sector)
+        f.seek(4096)
+        f.write(geometry)
+        f.seek(8192)
+        f.write(geometry)
+        base = 4096 + 2 * 4096
+        for copy in range(2 * slots):
+            f.seek(base + copy * metadata_max_size)
+            f.write(metadata)
+        for offset, image_path in layout:
+            f.seek(offset)
+            with open(image_path, "rb") as src:
+                shutil.copyfileobj(src, f, 1 << 20)
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""Benchmark the extraction pipeline on synthetic partition images.
+
+    python3 benchmarks/run.py                      # run and compare to baselines.json
+    python3 benchmarks/run.py --files 20000 -r 5   # bigger tree, best of five
+    python3 benchmarks/run.py --update-baseline    # record this machine's numbers
+
+Fixtures are generated under a temporary directory (see fixtures.py);
+nothing needs network access or root. Each stage reports its best time
+over ``--repeat`` runs and a throughput, which is compared against the
+stored baseline for the same fixture configuration. The exit status is 1
+if any stage is slower than the baseline by more than ``--tolerance``.
+"""
+
+import argparse
+import json
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import fixtures  # noqa: E402
+from elf import classify_files  # noqa: E402
+from filesystem import open_filesystem  # noqa: E402
+from generator import VendorTreeGenerator  # noqa: E402
+from image import open_image  # noqa: E402
+from lpmetadata import SuperImage  # noqa: E402
+from materialize import Materializer  # noqa: E402
+from patterns import PatternMatcher  # noqa: E402
+from scanner import scan_partitions  # noqa: E402
+from sparse import SparseImage  # noqa: E402
+
+DEFAULT_BASELINE = Path(__file__).resolve().parent / "baselines.json"
+MB = 1 << 20
+
+
+class Bench:
+    """Runs stages, keeping the best wall time of each."""
+
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results = {}
+
+    def run(self, name: str, func, setup=None):
+        """Time ``func``; it returns ``(files, bytes)`` processed."""
+        best = None
+        for _ in range(self.repeat):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            files, size = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        if size:
+            metric, value = "MB/s", size / MB / best
+        else:
+            metric, value = "files/s", files / best
+        self.results[name] = {
+            "seconds": round(best, 4),
+            "files": files,
+            "bytes": size,
+            "metric": metric,
+            "value": round(value, 2),
+        }
+        print(f"  {name:<16} {best * 1000:9.1f} ms  {value:11.1f} {metric}")
+
+    def skip(self, name: str, reason: str):
+        print(f"  {name:<16} skipped ({reason})")
+
+
+def _reset(path: Path):
+    def setup():
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+    return setup
+
+
+def build_fixtures(work: Path, spec: fixtures.TreeSpec) -> dict:
+    print(f"Generating fixtures in {work} ({spec.files} files, depth {spec.depth}, "
+          f"~{spec.blob_size} byte blobs)")
+    start = time.perf_counter()
+    src = work / "src" / "vendor"
+    files = fixtures.make_tree(str(src), spec)
+    data_bytes = fixtures.tree_size(files)
+    out = {"files": files, "bytes": data_bytes}
+
+    if fixtures.have_mke2fs():
+        raw = work / "vendor.raw.img"
+        fixtures.build_ext4(str(src), str(raw), data_bytes)
+        fixtures.write_sparse(str(raw), str(work / "vendor.img"))
+        fixtures.build_super([("vendor", str(raw))], str(work / "super.img"))
+        out["ext4"] = raw
+    if fixtures.have_mkfs_erofs():
+        fixtures.build_erofs(str(src), str(work / "vendor.erofs.img"))
+        out["erofs"] = work / "vendor.erofs.img"
+    print(f"Fixtures ready in {time.perf_counter() - start:.1f}s "
+          f"({data_bytes / MB:.1f} MiB of blobs)\n")
+    return out
+
+
+def run_stages(work: Path, fx: dict, bench: Bench):
+    matcher = PatternMatcher.from_file()
+    tree_bytes = fx["bytes"]
+    extracted = work / "extracted"
+
+    if "ext4" in fx:
+        sparse_path = work / "vendor.img"
+
+        def sparse_decode():
+            with SparseImage(sparse_path) as image:
+                image.copy_to(work / "decoded.img")
+                return 0, image.size
+
+        def super_read():
+            with SuperImage(work / "super.img") as sup:
+                view = sup.open_partition("vendor")
+                view.copy_to(work / "super-vendor.img")
+                return 0, view.size
+
+        def extract_ext4():
+            with open_image(sparse_path) as image:
+                count = open_filesystem(image).extract_tree(str(extracted / "vendor"))
+            return count, tree_bytes
+
+        bench.run("sparse_decode", sparse_decode)
+        bench.run("super_read", super_read)
+        bench.run("extract_ext4", extract_ext4, setup=_reset(extracted))
+    else:
+        for name in ("sparse_decode", "super_read", "extract_ext4"):
+            bench.skip(name, "mke2fs not installed")
+        shutil.copytree(work / "src", extracted)
+
+    if "erofs" in fx:
+        erofs_out = work / "extracted-erofs"
+
+        def extract_erofs():
+            with open_image(fx["erofs"]) as image:
+                count = open_filesystem(image).extract_tree(str(erofs_out / "vendor"))
+            return count, tree_bytes
+
+        bench.run("extract_erofs", extract_erofs, setup=_reset(erofs_out))
+    else:
+        bench.skip("extract_erofs", "mkfs.erofs not installed")
+
+    entries = []
+
+    def scan():
+        entries[:] = list(scan_partitions(extracted, matcher))
+        return len(entries), 0
+
+    bench.run("scan", scan)
+    paths = [str(extracted / e.partition / e.rel_path) for e in entries]
+
+    def classify():
+        return len([info for info in classify_files(paths) if info]), 0
+
+    bench.run("classify", classify)
+
+    copy_out = work / "copy"
+    materializer = Materializer("copy")
+    pairs = [(path, str(copy_out / e.rel_path)) for path, e in zip(paths, entries)]
+
+    def copy():
+        materializer.materialize_many(pairs)
+        return len(pairs), sum(e.size for e in entries)
+
+    bench.run("copy", copy, setup=_reset(copy_out))
+
+    generator = VendorTreeGenerator("bench", "device", work_dir=str(extracted))
+    for e in entries:
+        generator.catalog.add(e.partition, e.rel_path, e.size)
+    render_out = work / "render"
+    render_out.mkdir()
+    generator.build_elf_index(render_out)
+
+    def render():
+        generator.write_android_bp(render_out)
+        generator.write_device_mk(render_out)
+        generator.write_proprietary_files_txt(render_out)
+        return len(entries), 0
+
+    bench.run("render", render, setup=_reset(render_out))
+
+
+def compare(results: dict, config: dict, baseline_path: Path, tolerance: float) -> bool:
+    """Print the comparison with the stored baseline; False on regression."""
+    if not baseline_path.exists():
+        print(f"\nNo baseline at {baseline_path}; run with --update-baseline to record one.")
+        return True
+    with baseline_path.open("r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(f"\nBaseline was recorded for {baseline.get('config')}, not {config}; "
+              "skipping comparison.")
+        return True
+
+    ok = True
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for name, result in results.items():
+        reference = baseline.get("stages", {}).get(name)
+        if not reference or reference["metric"] != result["metric"]:
+            continue
+        ratio = result["value"] / reference["value"] if reference["value"] else 1.0
+        regressed = ratio < 1 - tolerance
+        ok = ok and not regressed
+        flag = "REGRESSION" if regressed else "ok"
+        print(f"  {name:<16} {ratio:6.2f}x of {reference['value']} {reference['metric']}  {flag}")
+    return ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--files", type=int, default=2000, help="Files in the synthetic tree")
+    parser.add_argument("--depth", type=int, default=4, help="Maximum directory nesting")
+    parser.add_argument("--blob-size", type=int, default=32768, help="Mean blob size in bytes")
+    parser.add_argument("--seed", type=int, default=1, help="Fixture RNG seed")
+    parser.add_argument("--repeat", "-r", type=int, default=3, help="Runs per stage (best kept)")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="Allowed slowdown before a stage counts as a regression")
+    parser.add_argument("--json", type=Path, default=None, help="Also write results here")
+    parser.add_argument("--work-dir", type=Path, default=None,
+                        help="Keep fixtures and outputs here instead of a temporary directory")
+    args = parser.parse_args(argv)
+
+    spec = fixtures.TreeSpec(args.files, args.depth, args.blob_size, args.seed)
+    config = dict(spec._asdict())
+    work = args.work_dir or Path(tempfile.mkdtemp(prefix="vendor_tree_bench_"))
+    work.mkdir(parents=True, exist_ok=True)
+    bench = Bench(max(1, args.repeat))
+    try:
+        fx = build_fixtures(work, spec)
+        run_stages(work, fx, bench)
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work, ignore_errors=True)
+
+    report = {"config": config, "stages": bench.results}
+    if args.json:
+        args.json.write_text(json.dumps(report, indent=2) + "\n")
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return 0
+    return 0 if compare(bench.results, config, args.baseline, args.tolerance) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
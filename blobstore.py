@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+
+import hashlib
+import logging
+import mmap
+import os
+import re
+import sqlite3
+import stat
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import warmcache
+from manifest import stamp_of
+from materialize import Materializer
+
+DIGEST_SIZE = 20
+_HASH_BUFFER_SIZE = 1 << 20
+
+_SCHEMA = """
+DROP TABLE IF EXISTS files;
+CREATE TABLE IF NOT EXISTS sources (
+    source TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS objects_last_used ON objects (last_used);
+"""
+
+_SIZE_UNITS = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parse_size(text: str) -> int:
+    """Parse ``512M`` / ``20G`` / ``1048576`` into a byte count."""
+    match = re.fullmatch(r"\s*(\d+)\s*([KMGT]?)i?B?\s*", text, re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid size: {text}")
+    return int(match.group(1)) * _SIZE_UNITS[match.group(2).upper()]
+
+
+def hash_file(path: str) -> str:
+    """BLAKE2b digest of a file's contents, as hex."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    buf = bytearray(_HASH_BUFFER_SIZE)
+    view = memoryview(buf)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            n = f.readinto(buf)
+            if not n:
+                break
+            h.update(view[:n])
+    return h.hexdigest()
+
+
+def hash_chunks(chunks: Iterable[bytes]) -> str:
+    """Same digest as ``hash_file`` for content supplied in chunks."""
+    h = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    for chunk in chunks:
+        h.update(chunk)
+    return h.hexdigest()
+
+
+def sha1_file(path: str) -> str:
+    """SHA-1 of a file, as used for ``path|sha1`` pins in proprietary-files.txt.
+
+    The file is memory-mapped and hashed in one call, which lets hashlib
+    drop the GIL for the whole file.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return hashlib.sha1().hexdigest()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            return hashlib.sha1(buf).hexdigest()
+
+
+def hash_files(
+    paths: Iterable[str], jobs: Optional[int] = None, hasher=hash_file
+) -> List[Optional[str]]:
+    """Hash many files concurrently with ``hasher``; unreadable files give None.
+
+    With warm caching on, digests are remembered per path and stamp, so
+    a later run only hashes files that were rewritten in between.
+    """
+    cache = warmcache.get_cache("digests")
+
+    def hash_one(path):
+        try:
+            if cache is None:
+                return hasher(path)
+            key, stamp = (hasher.__name__, path), stamp_of(os.stat(path))
+            digest = cache.get_current(key, stamp)
+            if digest is None:
+                digest = hasher(path)
+                # Only remember it if the file did not change while hashing.
+                if stamp_of(os.stat(path)) == stamp:
+                    cache.put_current(key, stamp, digest, len(path) + len(digest) + 200)
+            return digest
+        except OSError as e:
+            logging.warning(f"Could not hash {path}: {e}")
+            return None
+
+    paths = list(paths)
+    if not paths:
+        return []
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash") as pool:
+        return list(pool.map(hash_one, paths))
+
+
+class BlobStore:
+    """Content-addressed store of blob contents shared across runs.
+
+    Objects live under ``root/objects/<aa>/<digest>`` and are written once,
+    read-only, so identical files from different partitions or firmware
+    builds are stored a single time. An SQLite index maps each source
+    file's real path plus its size, mtime, ctime and inode to its digest,
+    so files that have not changed on disk since the last run are not
+    re-hashed, even when several trees or batch jobs share the store.
+    ``max_bytes`` caps the store size; least recently used objects are
+    evicted first.
+    """
+
+    def __init__(self, root, max_bytes: Optional[int] = None):
+        self.root = os.fspath(root)
+        self.max_bytes = max_bytes
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        # Never hardlink into the store: the source may be rewritten in place
+        # by a later extraction.
+        self._ingest = Materializer("auto")
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(
+            os.path.join(self.root, "index.sqlite"), check_same_thread=False
+        )
+        self._db.executescript(_SCHEMA)
+        self._session_start = time.time()
+
+    def close(self):
+        if self._db is not None:
+            self._db.commit()
+            self._db.close()
+            self._db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def _lookup(self, source: str, st: os.stat_result) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT digest FROM sources WHERE source = ? AND size = ? AND mtime_ns = ? "
+                "AND ctime_ns = ? AND inode = ?",
+                (source, st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino),
+            ).fetchone()
+        return row[0] if row else None
+
+    def _store_object(self, path: str, digest: str, mode: int) -> str:
+        obj = self.object_path(digest)
+        if os.path.exists(obj):
+            return obj
+        os.makedirs(os.path.dirname(obj), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        os.close(fd)
+        try:
+            self._ingest.materialize(path, tmp_path)
+            os.chmod(tmp_path, stat.S_IMODE(mode) & ~0o222)
+            os.replace(tmp_path, obj)
+        finally:
+            if os.path.lexists(tmp_path):
+                os.unlink(tmp_path)
+        return obj
+
+    def add(self, partition: str, rel_path: str, path: str) -> Tuple[str, str]:
+        """Store one regular file; returns ``(digest, object_path)``."""
+        source = os.path.realpath(path)
+        st = os.stat(source)
+        digest = self._lookup(source, st)
+        if digest is None or not os.path.exists(self.object_path(digest)):
+            digest = hash_file(source)
+        obj = self._store_object(source, digest, st.st_mode)
+
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?, ?, ?, ?)",
+                (source, st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino, digest),
+            )
+            self._db.execute(
+                "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)",
+                (digest, st.st_size, time.time()),
+            )
+        return digest, obj
+
+    def add_many(
+        self, files: Iterable[Tuple[str, str, str]], jobs: Optional[int] = None
+    ) -> List[Optional[Tuple[str, str]]]:
+        """Store ``(partition, rel_path, path)`` files concurrently.
+
+        Results line up with ``files``; symlinks and unreadable files give
+        None so the caller can fall back to the original path.
+        """
+        files = list(files)
+
+        def add_one(item):
+            partition, rel_path, path = item
+            if os.path.islink(path):
+                return None
+            try:
+                return self.add(partition, rel_path, path)
+            except OSError as e:
+                logging.warning(f"Could not store {partition}/{rel_path}: {e}")
+                return None
+
+        if not files:
+            return []
+        workers = max(1, min(jobs or os.cpu_count() or 1, len(files)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="blobstore") as pool:
+            results = list(pool.map(add_one, files))
+        with self._lock:
+            self._db.commit()
+        return results
+
+    def touch(self, digests: Iterable[str]):
+        """Mark objects as used now so eviction keeps them."""
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "UPDATE objects SET last_used = ? WHERE digest = ?",
+                [(now, digest) for digest in digests],
+            )
+            self._db.commit()
+
+    def total_size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+
+    def evict(self, max_bytes: Optional[int] = None) -> Tuple[int, int]:
+        """Drop least recently used objects until the store fits ``max_bytes``.
+
+        Objects used since this store was opened are never evicted. Returns
+        ``(objects_removed, bytes_freed)``.
+        """
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        if limit is None:
+            return 0, 0
+
+        excess = self.total_size() - limit
+        removed = freed = 0
+        if excess <= 0:
+            return 0, 0
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT digest, size FROM objects WHERE last_used < ? ORDER BY last_used",
+                (self._session_start,),
+            ).fetchall()
+            for digest, size in rows:
+                if freed >= excess:
+                    break
+                try:
+                    os.unlink(self.object_path(digest))
+                except FileNotFoundError:
+                    pass
+                self._db.execute("DELETE FROM objects WHERE digest = ?", (digest,))
+                self._db.execute("DELETE FROM sources WHERE digest = ?", (digest,))
+                removed += 1
+                freed += size
+            self._db.commit()
+        if removed:
+            logging.info(f"Evicted {removed} blobs ({freed} bytes) from {self.root}")
+        return removed, freed
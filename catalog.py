@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import sys
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from elf import ElfInfo
+
+# Module kind of a row, filled in once the blob has been classified.
+KIND_UNCLASSIFIED = 0
+KIND_OTHER = 1
+KIND_EXECUTABLE = 2
+KIND_SHARED_LIBRARY = 3
+KIND_SYMLINK = 4
+
+
+class _Interner:
+    """Two-way mapping between strings and small integer ids."""
+
+    __slots__ = ("values", "ids")
+
+    def __init__(self, *initial: str):
+        self.values: List[str] = []
+        self.ids: Dict[str, int] = {}
+        for value in initial:
+            self.intern(value)
+
+    def intern(self, value: str) -> int:
+        value_id = self.ids.get(value)
+        if value_id is None:
+            value_id = self.ids[value] = len(self.values)
+            self.values.append(sys.intern(value))
+        return value_id
+
+
+class BlobCatalog:
+    """Columnar table of the selected proprietary blobs.
+
+    Every blob is a row number; its fields live in parallel ``array``
+    columns (or lists for the few string columns), so a 100k-row system
+    partition costs a few bytes per field instead of a tuple and dict per
+    file. Partitions, directories, machines and SONAMEs are interned, and
+    rows are indexed by basename as they are added. SONAME resolution is
+    left to ``ElfIndex``, which also serves manifests without a catalog.
+
+    Iterating yields ``(partition, rel_path)`` pairs in insertion order.
+    """
+
+    __slots__ = (
+        "_partitions", "_dirs", "_machines", "_sonames",
+        "partition", "directory", "name", "size", "mode", "digest", "sha1",
+        "elf_class", "machine", "kind", "soname", "shared_libs",
+        "_by_name",
+    )
+
+    def __init__(self):
+        self._partitions = _Interner()
+        self._dirs = _Interner("")
+        self._machines = _Interner("")
+        self._sonames = _Interner("")
+        self.partition = array("H")
+        self.directory = array("I")
+        self.name: List[str] = []
+        self.size = array("q")
+        self.mode = array("I")
+        self.digest: List[Optional[str]] = []
+        self.sha1: List[Optional[str]] = []
+        self.elf_class = array("B")
+        self.machine = array("B")
+        self.kind = array("B")
+        self.soname = array("I")
+        self.shared_libs: List[Optional[Tuple[str, ...]]] = []
+        # Most basenames are unique, so a lone row is stored without a list.
+        self._by_name: Dict[str, Union[int, List[int]]] = {}
+
+    def __len__(self) -> int:
+        return len(self.name)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        for row in range(len(self.name)):
+            yield self.partition_of(row), self.rel_path(row)
+
+    def add(self, partition: str, rel_path: str, size: int = 0, mode: int = 0) -> int:
+        """Append a blob and return its row number."""
+        directory, _, name = rel_path.rpartition("/")
+        row = len(self.name)
+        dir_id = self._dirs.intern(directory)
+        name = sys.intern(name)
+        self.partition.append(self._partitions.intern(partition))
+        self.directory.append(dir_id)
+        self.name.append(name)
+        self.size.append(size)
+        self.mode.append(mode)
+        self.digest.append(None)
+        self.sha1.append(None)
+        self.elf_class.append(0)
+        self.machine.append(0)
+        self.kind.append(KIND_UNCLASSIFIED)
+        self.soname.append(0)
+        self.shared_libs.append(None)
+        rows = self._by_name.setdefault(name, row)
+        if isinstance(rows, list):
+            rows.append(row)
+        elif rows != row:
+            self._by_name[name] = [rows, row]
+        return row
+
+    def partition_of(self, row: int) -> str:
+        return self._partitions.values[self.partition[row]]
+
+    def dir_of(self, row: int) -> str:
+        return self._dirs.values[self.directory[row]]
+
+    def rel_path(self, row: int) -> str:
+        directory = self._dirs.values[self.directory[row]]
+        return f"{directory}/{self.name[row]}" if directory else self.name[row]
+
+    def key(self, row: int) -> str:
+        """Blob key used by the ELF index and manifest: ``partition/rel_path``."""
+        return f"{self.partition_of(row)}/{self.rel_path(row)}"
+
+    def arch(self, row: int) -> Optional[str]:
+        """ELF machine of a row (``aarch64``, ``arm``, ...), if classified as ELF."""
+        return self._machines.values[self.machine[row]] or None
+
+    def soname_of(self, row: int) -> Optional[str]:
+        return self._sonames.values[self.soname[row]] or None
+
+    def rows_named(self, name: str) -> List[int]:
+        rows = self._by_name.get(name, [])
+        return rows if isinstance(rows, list) else [rows]
+
+    def names(self) -> Iterator[str]:
+        """Distinct basenames in the catalog."""
+        return iter(self._by_name)
+
+    def set_stat(self, row: int, size: int, mode: int):
+        self.size[row] = size
+        self.mode[row] = mode
+
+    def set_digest(self, row: int, digest: Optional[str], sha1: Optional[str] = None):
+        self.digest[row] = digest
+        self.sha1[row] = sha1
+
+    def set_kind(self, row: int, kind: int):
+        self.kind[row] = kind
+
+    def set_elf(self, row: int, info: Optional[ElfInfo], shared_libs=()):
+        """Record the ELF classification of a row (``None``: not an ELF file)."""
+        if info is None:
+            self.kind[row] = KIND_OTHER
+            self.elf_class[row] = self.machine[row] = self.soname[row] = 0
+            self.shared_libs[row] = None
+            return
+        if info.is_shared_library:
+            self.kind[row] = KIND_SHARED_LIBRARY
+        elif info.is_executable:
+            self.kind[row] = KIND_EXECUTABLE
+        else:
+            self.kind[row] = KIND_OTHER
+        self.elf_class[row] = info.elf_class
+        self.machine[row] = self._machines.intern(info.machine or "")
+        self.soname[row] = self._sonames.intern(info.soname or "")
+        self.shared_libs[row] = tuple(shared_libs) or None
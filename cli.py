@@ -1,11 +1,291 @@
 import argparse
+import json
 import logging
+import signal
 import sys
 from pathlib import Path
 
-from generator import VendorTreeGenerator  # ✅ FIXED
+import profiling
+import tools
+from blobstore import parse_size
+from generator import VendorTreeGenerator, find_partition_images, write_if_changed  # ✅ FIXED
+from materialize import MATERIALIZE_MODES
+
+def _add_profile_argument(parser):
+    parser.add_argument(
+        "--profile",
+        default=None,
+        metavar="TRACE_JSON",
+        help="Record per-stage timing, CPU, I/O and memory and write a Chrome trace here",
+    )
+
+
+# Run when the current command ends, however it ends.
+_finishers = []
+
+
+def _setup_logging(verbose):
+    logging.basicConfig(format="[%(levelname)s] %(message)s")
+    logging.getLogger().setLevel(logging.DEBUG if verbose else logging.INFO)
+
+
+def _enable_profile(path):
+    """Record stages for this command and write the trace when it ends."""
+    if not path:
+        return
+    profiler = profiling.enable()
+
+    def write():
+        profiling.disable()
+        profiler.write(path)
+        logging.info(f"Wrote profile to {path}")
+
+    _finishers.append(write)
+
+
+def _handle_interrupts():
+    """Kill running tools on Ctrl-C or SIGTERM so workers wind down and cleanup runs."""
+    runner = tools.get_runner()
+
+    def interrupt(signum, frame):
+        runner.interrupt()
+        if signum == signal.SIGINT:
+            raise KeyboardInterrupt
+        sys.exit(128 + signum)
+
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, interrupt)
+
+
+def run_diff(argv):
+    """``diff OLD NEW``: compare two firmware builds without generating a tree."""
+    from fwdiff import diff_sources, open_source, render_proprietary_files
+    from patterns import PatternMatcher
+
+    parser = argparse.ArgumentParser(
+        prog="vendor_tree_generator diff",
+        description="Compare the proprietary blobs of two firmware builds. Each side is "
+        "a directory of partition images, a generated vendor tree or its manifest.sqlite.",
+    )
+    parser.add_argument("old", help="Previous firmware: image directory, tree or manifest")
+    parser.add_argument("new", help="New firmware: image directory, tree or manifest")
+    parser.add_argument(
+        "--changelog", default="-", help="Write the JSON changelog here (default: stdout)"
+    )
+    parser.add_argument(
+        "--proprietary-files",
+        default=None,
+        help="Write an updated proprietary-files.txt for the new side to this path",
+    )
+    parser.add_argument(
+        "--patterns",
+        default=None,
+        help="Path to proprietary patterns JSON (default: config/proprietary_patterns.json)",
+    )
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=None, help="Number of parallel hashing workers"
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Enable verbose debug output"
+    )
+    _add_profile_argument(parser)
+    args = parser.parse_args(argv)
+
+    _setup_logging(args.verbose)
+    _enable_profile(args.profile)
+
+    matcher = PatternMatcher.from_file(args.patterns)
+    old = open_source(args.old, matcher)
+    try:
+        new = open_source(args.new, matcher)
+    except BaseException:
+        old.close()
+        raise
+    try:
+        changelog = diff_sources(old, new, jobs=args.jobs)
+        if args.proprietary_files and new.unreadable:
+            logging.error(
+                f"Not writing {args.proprietary_files}: the new side is missing "
+                f"{', '.join(new.unreadable)}"
+            )
+        elif args.proprietary_files:
+            write_if_changed(Path(args.proprietary_files), render_proprietary_files(new))
+    finally:
+        old.close()
+        new.close()
+
+    text = json.dumps(changelog, indent=2) + "\n"
+    if args.changelog == "-":
+        sys.stdout.write(text)
+    else:
+        write_if_changed(Path(args.changelog), text)
+    summary = changelog["summary"]
+    logging.info(
+        f"{summary['added']} added, {summary['removed']} removed, "
+        f"{summary['modified']} modified, {len(changelog['soname_changes'])} SONAME changes"
+    )
+    skipped = changelog["incomplete"] + changelog["unreadable"]
+    if skipped:
+        logging.error(f"Diff is incomplete, could not compare {', '.join(skipped)}")
+        sys.exit(1)
+
+
+def run_batch(argv):
+    """``batch JOBS.json``: generate trees for many devices in one process."""
+    from batch import BatchRunner, load_jobs
 
-def run_cli():
+    parser = argparse.ArgumentParser(
+        prog="vendor_tree_generator batch",
+        description="Generate vendor trees for every job in a JSON job manifest, "
+        "extracting partition images shared between jobs only once.",
+    )
+    parser.add_argument("manifest", help="JSON list of jobs (vendor, device, images, output)")
+    parser.add_argument(
+        "--work-dir",
+        default="batch-work",
+        help="Root of the per-job and shared extraction directories (default: batch-work)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Global worker budget shared by all jobs (default: CPU count)",
+    )
+    parser.add_argument(
+        "--materialize",
+        choices=MATERIALIZE_MODES,
+        default="auto",
+        help="How blobs are placed in the output trees (default: auto)",
+    )
+    parser.add_argument(
+        "--blob-store",
+        default=None,
+        help="Directory of a content-addressed blob cache shared by all jobs",
+    )
+    parser.add_argument(
+        "--blob-store-max-size",
+        type=parse_size,
+        default=None,
+        help="Evict least recently used blobs beyond this size (e.g. 20G)",
+    )
+    parser.add_argument(
+        "--verbose", action="store_true", help="Enable verbose debug output"
+    )
+    _add_profile_argument(parser)
+    args = parser.parse_args(argv)
+
+    _setup_logging(args.verbose)
+    _enable_profile(args.profile)
+
+    try:
+        jobs = load_jobs(args.manifest)
+    except (OSError, ValueError) as e:
+        logging.error(f"Cannot load job manifest: {e}")
+        sys.exit(1)
+
+    runner = BatchRunner(
+        jobs,
+        args.work_dir,
+        budget=args.jobs,
+        materialize=args.materialize,
+        blob_store=args.blob_store,
+        blob_store_max_bytes=args.blob_store_max_size,
+        verbose=args.verbose,
+    )
+    results = runner.run()
+    failed = [name for name, ok in results.items() if not ok]
+    for name, ok in results.items():
+        logging.info(f"{name}: {'ok' if ok else 'FAILED'}")
+    if failed:
+        sys.exit(1)
+
+
+def run_serve(argv):
+    """``serve``: keep a process with warm caches running behind a Unix socket."""
+    from client import ServiceUnavailable, control, default_socket_path
+    from service import ServiceError, VendorTreeService
+
+    parser = argparse.ArgumentParser(
+        prog="vendor_tree_generator serve",
+        description="Run a long-lived service that executes commands sent by the client "
+        "(set VENDOR_TREE_SOCKET for main.py to use it), keeping indexes, the "
+        "pattern matcher and blob digests in memory between runs.",
+    )
+    parser.add_argument(
+        "--socket",
+        default=None,
+        help="Unix socket to listen on (default: $VENDOR_TREE_SOCKET or a per-user path)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=parse_size,
+        default="1G",
+        help="Memory budget of the warm caches, least recently used entries are "
+        "evicted beyond it (default: 1G)",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=None,
+        help="Exit after this many seconds without a request",
+    )
+    parser.add_argument(
+        "--status", action="store_true", help="Print the running service's cache statistics"
+    )
+    parser.add_argument("--stop", action="store_true", help="Stop the running service")
+    parser.add_argument(
+        "--verbose", action="store_true", help="Enable verbose debug output"
+    )
+    args = parser.parse_args(argv)
+    _setup_logging(args.verbose)
+    try:
+        socket_path = args.socket or default_socket_path()
+    except ServiceUnavailable as e:
+        logging.error(str(e))
+        sys.exit(1)
+
+    if args.status or args.stop:
+        try:
+            reply = control(socket_path, "stop" if args.stop else "status")
+        except ServiceUnavailable as e:
+            logging.error(str(e))
+            sys.exit(1)
+        if args.status:
+            sys.stdout.write(json.dumps(reply, indent=2, sort_keys=True) + "\n")
+        return
+
+    service = VendorTreeService(socket_path, args.cache_size, idle_timeout=args.idle_timeout)
+    try:
+        service.serve()
+    except (OSError, ServiceError) as e:
+        logging.error(f"Cannot start the service: {e}")
+        sys.exit(1)
+
+
+def run_command(argv):
+    """Run one command line (``diff``, ``batch``, ``serve`` or a tree generation)."""
+    try:
+        if argv and argv[0] == "diff":
+            return run_diff(argv[1:])
+        if argv and argv[0] == "batch":
+            return run_batch(argv[1:])
+        if argv and argv[0] == "serve":
+            return run_serve(argv[1:])
+        return run_generate(argv)
+    finally:
+        while _finishers:
+            _finishers.pop()()
+
+
+def run_cli(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    _handle_interrupts()
+    return run_command(argv)
+
+
+def run_generate(argv):
+    """Generate one vendor tree from a directory of partition images."""
     parser = argparse.ArgumentParser(
         description="Generate a vendor tree from extracted Android partition images."
     )
@@ -20,27 +300,69 @@ def run_cli():
     parser.add_argument(
         "--android-version", default="13", help="Android version (default: 13)"
     )
+    parser.add_argument(
+        "--work-dir",
+        default="extracted",
+        help="Directory partitions are extracted into (default: extracted)",
+    )
+    parser.add_argument(
+        "--no-staging",
+        action="store_true",
+        help="Stream matching files from the images straight into the output "
+        "instead of extracting them into --work-dir first",
+    )
+    parser.add_argument(
+        "--patterns",
+        default=None,
+        help="Path to proprietary patterns JSON (default: config/proprietary_patterns.json)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of parallel extraction/scan workers (default: CPU count)",
+    )
+    parser.add_argument(
+        "--materialize",
+        choices=MATERIALIZE_MODES,
+        default="auto",
+        help="How blobs are placed in the output tree: hardlink, reflink, "
+        "copy_file_range or copy, falling back when unsupported "
+        "(default: auto = reflink, then copy_file_range, then copy)",
+    )
+    parser.add_argument(
+        "--blob-store",
+        default=None,
+        help="Directory of a content-addressed blob cache shared across runs",
+    )
+    parser.add_argument(
+        "--blob-store-max-size",
+        type=parse_size,
+        default=None,
+        help="Evict least recently used blobs beyond this size (e.g. 20G)",
+    )
+    parser.add_argument(
+        "--pin",
+        action="store_true",
+        help="Write proprietary-files.txt entries as path|sha1 pins",
+    )
+    parser.add_argument(
+        "--dedup",
+        action="store_true",
+        help="Store blobs with identical content once and symlink the other copies to it",
+    )
     parser.add_argument(
         "--verbose", action="store_true", help="Enable verbose debug output"
     )
+    _add_profile_argument(parser)
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
-    logging.basicConfig(
-        level=logging.DEBUG if args.verbose else logging.INFO,
-        format="[%(levelname)s] %(message)s",
-    )
+    _setup_logging(args.verbose)
+    _enable_profile(args.profile)
 
-    image_dir = Path(args.images)
-    partitions = [
-        "vendor.img",
-        "system.img",
-        "product.img",
-        "odm.img",
-        "system_ext.img",
-        "vendor_dlkm.img",
-    ]
-    image_paths = [image_dir / img for img in partitions if (image_dir / img).exists()]
+    image_paths = find_partition_images(args.images)
 
     if not image_paths:
         logging.error("No valid *.img files found in the provided images directory.")
@@ -51,12 +373,25 @@ def run_cli():
         device_name=args.device,
         android_version=args.android_version,
         verbose=args.verbose,
+        patterns_path=args.patterns,
+        jobs=args.jobs,
+        materialize=args.materialize,
+        blob_store=args.blob_store,
+        blob_store_max_bytes=args.blob_store_max_size,
+        pin_sha1=args.pin,
+        work_dir=args.work_dir,
+        dedup=args.dedup,
     )
 
-    for image_path in image_paths:
-        generator.extract_image(image_path)
+    if args.no_staging:
+        success = generator.generate_tree_from_images(image_paths, args.output)
+    else:
+        results = generator.extract_images(image_paths)
+        failed = [name for name, ok in results.items() if not ok]
+        if failed:
+            logging.warning("Failed to extract: %s", ", ".join(failed))
 
-    success = generator.generate_tree("extracted", args.output)
+        success = generator.generate_tree(args.work_dir, args.output)
     if success:
         logging.info("Vendor tree generated at: %s", args.output)
     else:
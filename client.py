@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+from typing import Iterator, List, Optional
+
+# Only the standard library is imported here: the client should start in
+# the time it takes Python to, and leave the heavy lifting to the service.
+
+SOCKET_ENV = "VENDOR_TREE_SOCKET"
+
+
+class ServiceUnavailable(OSError):
+    """Nothing is listening on the service socket."""
+
+
+def private_dir(path: str) -> str:
+    """Create ``path`` as a directory only this user can access, or check it is one."""
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise ServiceUnavailable(f"{path} is not a directory private to uid {os.getuid()}")
+    return path
+
+
+def default_socket_path() -> str:
+    """``$VENDOR_TREE_SOCKET``, else a socket in a directory private to this user.
+
+    That is ``$XDG_RUNTIME_DIR``, or a 0700 directory of ours in the
+    temporary directory: another user must not be able to bind it first.
+    """
+    path = os.environ.get(SOCKET_ENV)
+    if path:
+        return path
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if not runtime_dir:
+        runtime_dir = private_dir(
+            os.path.join(tempfile.gettempdir(), f"vendor_tree_generator-{os.getuid()}")
+        )
+    return os.path.join(runtime_dir, "vendor_tree_generator.sock")
+
+
+def peer_uid(sock: socket.socket) -> Optional[int]:
+    """User id of the process at the other end of a Unix socket, where the OS says."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", creds)[1]
+
+
+def connect(socket_path: str) -> socket.socket:
+    """Connect to the service, which must run as the same user as we do."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError as e:
+        sock.close()
+        raise ServiceUnavailable(f"No service at {socket_path}: {e.strerror or e}") from e
+    uid = peer_uid(sock)
+    if uid is not None and uid != os.getuid():
+        sock.close()
+        raise ServiceUnavailable(f"Refusing the service at {socket_path}: it runs as uid {uid}")
+    return sock
+
+
+def send_message(sock: socket.socket, message: dict):
+    sock.sendall(json.dumps(message).encode() + b"\n")
+
+
+def iter_messages(sock: socket.socket) -> Iterator[dict]:
+    """JSON messages read from ``sock``, one per line, until it is closed."""
+    with sock.makefile("rb") as stream:
+        for line in stream:
+            yield json.loads(line)
+
+
+def control(socket_path: str, command: str) -> dict:
+    """Send a ``status`` or ``stop`` request and return the reply."""
+    with connect(socket_path) as sock:
+        send_message(sock, {"control": command})
+        for message in iter_messages(sock):
+            return message
+    return {}
+
+
+def run_client(argv: List[str], socket_path: Optional[str] = None) -> int:
+    """Run a command line in the service, relaying its output; returns its exit status.
+
+    Raises ``ServiceUnavailable`` when no service is running, so the caller
+    can run the command in process instead. Ctrl-C closes the connection,
+    which stops the command's tools in the service.
+    """
+    sock = connect(socket_path or default_socket_path())
+    try:
+        send_message(sock, {"argv": list(argv), "cwd": os.getcwd()})
+        for message in iter_messages(sock):
+            if "exit" in message:
+                return message["exit"]
+            for name, stream in (("stdout", sys.stdout), ("stderr", sys.stderr)):
+                if name in message:
+                    stream.write(message[name])
+                    stream.flush()
+    except KeyboardInterrupt:
+        return 130
+    finally:
+        sock.close()
+    sys.stderr.write("[ERROR] The service closed the connection before the command finished\n")
+    return 1
@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+
+import bisect
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+from typing import List, Optional
+
+import warmcache
+from compression import DecompressionError, StreamDecompressor, detect_codec
+from image import ImageFile
+
+INDEX_SUFFIX = ".seekidx"
+INDEX_VERSION = 1
+
+# Decoded bytes per spilled chunk, and the largest independently decodable
+# unit (gzip member, xz stream, zstd/LZ4 frame) that is re-decoded whole on
+# a read instead of being spilled.
+CHUNK_SIZE = 1 << 20
+MAX_UNIT_SIZE = 4 << 20
+READ_SIZE = 1 << 20
+CACHE_BYTES = 32 << 20
+
+# Seek point kinds. Each point covers the decoded bytes up to the next one.
+POINT_ZERO = 0   # all zeroes, nothing stored
+POINT_UNIT = 1   # a unit decoded from (offset, length) of the compressed input
+POINT_CHUNK = 2  # zlib data at (offset, length) of the index data file
+
+_ZEROS = bytes(CHUNK_SIZE)
+
+
+class CompressedImage(ImageFile):
+    """Random-access view of a gzip, xz, LZ4 or zstd compressed image.
+
+    The first open decodes the input once and records a seek index: inputs
+    made of small independent units (bgzip files, multi-frame zstd or LZ4)
+    are indexed in place, long single streams are spilled as 1 MiB zlib
+    chunks and zero runs are stored as holes, so the cache stays close to
+    the compressed size. The index is written next to
+    the input as ``<name>.seekidx`` (under the temporary directory if that
+    is read-only) and reused while the input's size and mtime match.
+    A read then decodes at most one chunk or unit, with the most recently
+    used ones kept in memory (in the shared ``warmcache`` when it is on,
+    so they outlive the image object).
+
+    ``source`` holds the compressed bytes; the image takes ownership of it.
+    """
+
+    def __init__(self, source: ImageFile, codec: str, stamp: List[int],
+                 name: Optional[str] = None):
+        super().__init__()
+        self.path = getattr(source, "path", "<image>")
+        self.codec = codec
+        self._source = source
+        self._stamp = list(stamp)
+        self._data_fd = -1
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()
+        self._cached = 0
+        name = name or self.path
+        fallback = os.path.join(tempfile.gettempdir(), "vendor_tree_seekidx")
+        digest = hashlib.sha1(os.path.abspath(name).encode()).hexdigest()[:16]
+        self._index_paths = [
+            name + INDEX_SUFFIX,
+            os.path.join(fallback, f"{os.path.basename(name)}.{digest}{INDEX_SUFFIX}"),
+        ]
+        try:
+            if not any(self._load_index(path) for path in self._index_paths):
+                self._build_index()
+        except Exception:
+            self.close()
+            raise
+
+    def _read_index(self, index_path: str) -> dict:
+        cache = warmcache.get_cache("image-index")
+        if cache is None:
+            with open(index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        st = os.stat(index_path)
+        key = ("seekidx", os.path.abspath(index_path))
+        stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+        index = cache.get_current(key, stamp)
+        if index is None:
+            with open(index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            cache.put_current(key, stamp, index, st.st_size * warmcache.JSON_EXPANSION)
+        return index
+
+    def _load_index(self, index_path: str) -> bool:
+        try:
+            index = self._read_index(index_path)
+        except (OSError, ValueError):
+            return False
+        if (index.get("version") != INDEX_VERSION or index.get("codec") != self.codec
+                or index.get("stamp") != self._stamp):
+            return False
+        if index["data_size"]:
+            try:
+                fd = os.open(index_path + ".data", os.O_RDONLY)
+            except OSError:
+                return False
+            if os.fstat(fd).st_size != index["data_size"]:
+                os.close(fd)
+                return False
+            self._data_fd = fd
+        self._set_points(index["points"], index["size"])
+        return True
+
+    def _build_index(self):
+        for index_path in self._index_paths:
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(index_path)), exist_ok=True)
+                tmp = f"{index_path}.{os.getpid()}.tmp"
+                data = open(tmp + ".data", "w+b")
+                break
+            except OSError as e:
+                logging.warning(f"Cannot write seek index {index_path}: {e}")
+        else:
+            raise DecompressionError(f"{self.path}: no writable location for the seek index")
+
+        logging.info(f"Indexing {os.path.basename(self.path)} ({self.codec}) for random access")
+        try:
+            with data:
+                points, size = self._scan(data)
+                data_size = data.tell()
+            index = {
+                "version": INDEX_VERSION,
+                "codec": self.codec,
+                "stamp": self._stamp,
+                "size": size,
+                "data_size": data_size,
+                "points": points,
+            }
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(index, f, separators=(",", ":"))
+            if data_size:
+                os.replace(tmp + ".data", index_path + ".data")
+            else:
+                os.unlink(tmp + ".data")
+            os.replace(tmp, index_path)
+        except BaseException:
+            for path in (tmp, tmp + ".data"):
+                if os.path.exists(path):
+                    os.unlink(path)
+            raise
+        if data_size:
+            self._data_fd = os.open(index_path + ".data", os.O_RDONLY)
+        self._set_points(points, size)
+
+    def _scan(self, data) -> tuple:
+        """Decode the whole input once; returns the seek points and decoded size."""
+        points = []
+        offset = 0
+        position = 0
+        while position < self._source.size:
+            if detect_codec(self._source.pread(position, 8)) != self.codec:
+                if position == 0:
+                    raise DecompressionError(f"{self.path}: not a {self.codec} stream")
+                logging.debug(f"Ignoring {self._source.size - position} trailing bytes "
+                              f"of {self.path}")
+                break
+            unit_offset, unit_points, unit_data = offset, len(points), data.tell()
+            decoder = StreamDecompressor(self.codec)
+            pending = bytearray()
+            read_pos = position
+            while not decoder.eof:
+                chunk = self._source.pread(read_pos, READ_SIZE)
+                if not chunk:
+                    raise DecompressionError(f"{self.path}: truncated {self.codec} stream")
+                read_pos += len(chunk)
+                for piece in decoder.decompress(chunk):
+                    pending += piece
+                    while len(pending) >= CHUNK_SIZE:
+                        offset = _spill(points, data, pending[:CHUNK_SIZE], offset)
+                        del pending[:CHUNK_SIZE]
+            if pending:
+                offset = _spill(points, data, pending, offset)
+            end = read_pos - len(decoder.unused_data)
+            if offset - unit_offset <= MAX_UNIT_SIZE:
+                # Small enough to decode whole on demand; drop its spill.
+                del points[unit_points:]
+                data.seek(unit_data)
+                data.truncate()
+                if offset > unit_offset:
+                    points.append([unit_offset, POINT_UNIT, position, end - position])
+            position = end
+        return points, offset
+
+    def _set_points(self, points: list, size: int):
+        self._points = points
+        self._offsets = [point[0] for point in points]
+        self.size = size
+
+    def _block(self, index: int) -> bytes:
+        shared = warmcache.get_cache("image-blocks")
+        if shared is not None:
+            key = (self._index_paths[0], self.codec, tuple(self._stamp), index)
+            block = shared.get(key)
+            if block is None:
+                block = self._decode_block(index)
+                shared.put(key, block, len(block))
+            return block
+        with self._lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+                return block
+        block = self._decode_block(index)
+        with self._lock:
+            if index not in self._cache:
+                self._cache[index] = block
+                self._cached += len(block)
+            while self._cached > CACHE_BYTES and len(self._cache) > 1:
+                self._cached -= len(self._cache.popitem(last=False)[1])
+        return block
+
+    def _decode_block(self, index: int) -> bytes:
+        _, kind, location, length = self._points[index]
+        if kind == POINT_CHUNK:
+            return zlib.decompress(os.pread(self._data_fd, length, location))
+        decoder = StreamDecompressor(self.codec)
+        return b"".join(decoder.decompress(self._source.pread(location, length)))
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+        chunks = []
+        index = bisect.bisect_right(self._offsets, offset) - 1
+        while length > 0:
+            start = self._offsets[index]
+            end = self._offsets[index + 1] if index + 1 < len(self._offsets) else self.size
+            n = min(end - offset, length)
+            if self._points[index][1] == POINT_ZERO:
+                chunks.append(bytes(n))
+            else:
+                block = self._block(index)
+                chunks.append(block[offset - start:offset - start + n])
+            offset += n
+            length -= n
+            index += 1
+        return b"".join(chunks)
+
+    def close(self):
+        if getattr(self, "_data_fd", -1) >= 0:
+            os.close(self._data_fd)
+            self._data_fd = -1
+        if getattr(self, "_source", None) is not None:
+            self._source.close()
+            self._source = None
+        super().close()
+
+
+def _spill(points: list, data, chunk: bytes, offset: int) -> int:
+    """Record one decoded chunk at ``offset``; returns the offset after it."""
+    if chunk == _ZEROS[:len(chunk)]:
+        if not points or points[-1][1] != POINT_ZERO:
+            points.append([offset, POINT_ZERO, 0, 0])
+    else:
+        stored = zlib.compress(chunk, 1)
+        points.append([offset, POINT_CHUNK, data.tell(), len(stored)])
+        data.write(stored)
+    return offset + len(chunk)
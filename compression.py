@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+
+import lzma
+import struct
+import zlib
+from typing import Iterator, Optional
+
+try:
+    import lz4.block as _lz4_block
+except ImportError:
+    _lz4_block = None
+
+try:
+    import lz4.frame as _lz4_frame
+except ImportError:
+    _lz4_frame = None
+
+try:
+    import zstandard as _zstd
+except ImportError:
+    _zstd = None
+
+
+class DecompressionError(ValueError):
+    """Raised when compressed data is corrupt or its codec is unavailable."""
+
+
+def lz4_block_decompress(src: bytes, out_size: int) -> bytes:
+    """Decode an LZ4 block until ``out_size`` bytes have been produced.
+
+    Trailing bytes after the last needed sequence are ignored, which is what
+    EROFS pclusters without zero padding require. The ``lz4`` package is
+    used when installed; the pure-Python decoder is the fallback.
+    """
+    if _lz4_block is not None:
+        try:
+            out = _lz4_block.decompress(src, uncompressed_size=out_size)
+            if len(out) == out_size:
+                return out
+        except Exception:
+            pass
+
+    dst = bytearray()
+    _lz4_decode_into(src, dst, out_size)
+    if len(dst) < out_size:
+        raise DecompressionError(f"LZ4 block produced {len(dst)} of {out_size} bytes")
+    return bytes(dst[:out_size])
+
+
+def _lz4_decode_into(src: bytes, dst: bytearray, limit: Optional[int] = None):
+    """Append the decoded LZ4 block ``src`` to ``dst``.
+
+    Matches may reach back into whatever ``dst`` already holds, which is how
+    linked blocks of an LZ4 frame see their predecessor. Decoding stops
+    once ``dst`` reaches ``limit`` bytes, or at the end of ``src``.
+    """
+    i = 0
+    n = len(src)
+    while i < n:
+        token = src[i]
+        i += 1
+
+        literals = token >> 4
+        if literals == 15:
+            while True:
+                if i >= n:
+                    raise DecompressionError("truncated LZ4 literal length")
+                b = src[i]
+                i += 1
+                literals += b
+                if b != 255:
+                    break
+        dst += src[i:i + literals]
+        i += literals
+        if (limit is not None and len(dst) >= limit) or i >= n:
+            break
+
+        if i + 2 > n:
+            raise DecompressionError("truncated LZ4 match offset")
+        offset = src[i] | (src[i + 1] << 8)
+        i += 2
+        if offset == 0 or offset > len(dst):
+            raise DecompressionError(f"invalid LZ4 match offset {offset}")
+
+        match_len = token & 15
+        if match_len == 15:
+            while True:
+                if i >= n:
+                    raise DecompressionError("truncated LZ4 match length")
+                b = src[i]
+                i += 1
+                match_len += b
+                if b != 255:
+                    break
+        match_len += 4
+
+        start = len(dst) - offset
+        if match_len <= offset:
+            dst += dst[start:start + match_len]
+        else:
+            pattern = bytes(dst[start:])
+            dst += (pattern * (match_len // offset + 1))[:match_len]
+
+
+def deflate_decompress(src: bytes, out_size: int) -> bytes:
+    """Decode a raw DEFLATE stream, stopping after ``out_size`` bytes."""
+    try:
+        out = zlib.decompressobj(-15).decompress(src, out_size)
+    except zlib.error as e:
+        raise DecompressionError(f"DEFLATE: {e}") from e
+    if len(out) < out_size:
+        raise DecompressionError(f"DEFLATE produced {len(out)} of {out_size} bytes")
+    return out
+
+
+def zstd_decompress(src: bytes, out_size: int) -> bytes:
+    """Decode a single zstd frame; needs the optional ``zstandard`` package."""
+    if _zstd is None:
+        raise DecompressionError("zstd support requires the 'zstandard' package")
+    try:
+        out = _zstd.ZstdDecompressor().decompressobj().decompress(src)
+    except _zstd.ZstdError as e:
+        raise DecompressionError(f"zstd: {e}") from e
+    if len(out) < out_size:
+        raise DecompressionError(f"zstd produced {len(out)} of {out_size} bytes")
+    return out[:out_size]
+
+
+# Compressed streams
+
+CODEC_MAGIC = (
+    (b"\x1f\x8b", "gzip"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x04\x22\x4d\x18", "lz4"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+
+# Upper bound on a single piece of decoded output, so highly compressible
+# input (long zero runs) does not balloon into one huge buffer.
+_PIECE_SIZE = 1 << 20
+
+_LZ4_BLOCK_SIZES = {4: 64 << 10, 5: 256 << 10, 6: 1 << 20, 7: 4 << 20}
+
+
+def detect_codec(header: bytes) -> Optional[str]:
+    """Name of the stream codec whose magic starts ``header``, if any."""
+    for magic, codec in CODEC_MAGIC:
+        if header.startswith(magic):
+            return codec
+    return None
+
+
+class StreamDecompressor:
+    """Incremental decoder for one gzip member, xz stream, LZ4 frame or zstd frame.
+
+    ``decompress`` yields the output of each input piece as it is fed.
+    Decoding stops at the end of the unit: ``eof`` is then set and
+    ``unused_data`` holds the input that followed it. LZ4 uses the ``lz4``
+    package when installed and a pure-Python decoder otherwise; zstd needs
+    the optional ``zstandard`` package.
+    """
+
+    def __init__(self, codec: str):
+        self.codec = codec
+        self._tail = b""
+        if codec == "gzip":
+            self._obj = zlib.decompressobj(31)
+        elif codec == "xz":
+            self._obj = lzma.LZMADecompressor(lzma.FORMAT_XZ)
+        elif codec == "lz4":
+            self._obj = _lz4_frame.LZ4FrameDecompressor() if _lz4_frame else _Lz4FrameDecoder()
+        elif codec == "zstd":
+            if _zstd is None:
+                raise DecompressionError("zstd support requires the 'zstandard' package")
+            self._obj = _zstd.ZstdDecompressor().decompressobj()
+        else:
+            raise DecompressionError(f"unsupported codec {codec!r}")
+
+    @property
+    def eof(self) -> bool:
+        return self._obj.eof
+
+    @property
+    def unused_data(self) -> bytes:
+        return self._obj.unused_data + self._tail
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        try:
+            if self.codec == "gzip":
+                yield from self._decompress_zlib(data)
+            elif self.codec == "zstd":
+                yield from self._decompress_zstd(data)
+            elif isinstance(self._obj, _Lz4FrameDecoder):
+                yield from self._obj.decompress(data)
+            else:
+                yield from self._decompress_bounded(data)
+        except (zlib.error, lzma.LZMAError, RuntimeError) as e:
+            raise DecompressionError(f"{self.codec}: {e}") from e
+
+    def _decompress_zlib(self, data: bytes) -> Iterator[bytes]:
+        while True:
+            out = self._obj.decompress(data, _PIECE_SIZE)
+            if out:
+                yield out
+            data = self._obj.unconsumed_tail
+            if self._obj.eof or (not data and len(out) < _PIECE_SIZE):
+                return
+
+    def _decompress_bounded(self, data: bytes) -> Iterator[bytes]:
+        # lzma and lz4.frame share the max_length/needs_input protocol.
+        out = self._obj.decompress(data, _PIECE_SIZE)
+        while True:
+            if out:
+                yield out
+            if self._obj.eof or self._obj.needs_input:
+                return
+            out = self._obj.decompress(b"", _PIECE_SIZE)
+
+    def _decompress_zstd(self, data: bytes) -> Iterator[bytes]:
+        # zstandard has no output limit; small input steps bound each piece.
+        step = 1 << 14
+        for start in range(0, len(data), step):
+            if self._obj.eof:
+                self._tail += data[start:]
+                return
+            try:
+                out = self._obj.decompress(data[start:start + step])
+            except _zstd.ZstdError as e:
+                raise DecompressionError(f"zstd: {e}") from e
+            if out:
+                yield out
+
+
+class _Lz4FrameDecoder:
+    """Pure-Python decoder for one LZ4 frame (the ``lz4`` command's format).
+
+    Linked blocks decode against the previous 64 KiB of output. Checksums
+    are not verified.
+    """
+
+    def __init__(self):
+        self.eof = False
+        self.unused_data = b""
+        self._buffer = bytearray()
+        self._flags = None
+        self._window = b""
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        if self.eof:
+            self.unused_data += data
+            return
+        self._buffer += data
+        if self._flags is None and not self._read_header():
+            return
+        buffer = self._buffer
+        block_checksum = 4 if self._flags & 0x10 else 0
+        linked = not self._flags & 0x20
+        while len(buffer) >= 4:
+            (size,) = struct.unpack_from("<I", buffer)
+            if size == 0:
+                end = 4 + (4 if self._flags & 0x04 else 0)
+                if len(buffer) < end:
+                    return
+                self.eof = True
+                self.unused_data = bytes(buffer[end:])
+                buffer.clear()
+                return
+            stored = size & 0x80000000
+            size &= 0x7FFFFFFF
+            end = 4 + size + block_checksum
+            if len(buffer) < end:
+                return
+            block = bytes(buffer[4:4 + size])
+            del buffer[:end]
+            if stored:
+                out = block
+            else:
+                dst = bytearray(self._window if linked else b"")
+                prefix = len(dst)
+                _lz4_decode_into(block, dst, prefix + self._max_block)
+                out = bytes(dst[prefix:])
+            if linked:
+                self._window = (self._window + out)[-65536:]
+            yield out
+
+    def _read_header(self) -> bool:
+        buffer = self._buffer
+        if len(buffer) < 7:
+            return False
+        magic, flags, bd = struct.unpack_from("<IBB", buffer)
+        if magic != 0x184D2204 or flags >> 6 != 1:
+            raise DecompressionError("not an LZ4 frame")
+        if flags & 0x01:
+            raise DecompressionError("LZ4 frames with a dictionary are not supported")
+        header_size = 7 + (8 if flags & 0x08 else 0)
+        if len(buffer) < header_size:
+            return False
+        self._max_block = _LZ4_BLOCK_SIZES.get((bd >> 4) & 7, 4 << 20)
+        self._flags = flags
+        del buffer[:header_size]
+        return True
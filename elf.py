@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import mmap
+import os
+import struct
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional
+
+ELF_MAGIC = b"\x7fELF"
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+
+ET_REL = 1
+ET_EXEC = 2
+ET_DYN = 3
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+
+MACHINES = {
+    3: "x86",
+    40: "arm",
+    62: "x86_64",
+    183: "aarch64",
+    243: "riscv",
+}
+
+_TYPES = {ET_REL: "REL", ET_EXEC: "EXEC", ET_DYN: "DYN", 4: "CORE"}
+
+# Upper bound on the dynamic segment we are willing to read; real ones are
+# a few hundred bytes.
+_MAX_DYNAMIC_SIZE = 1 << 16
+
+
+class ElfInfo(
+    namedtuple(
+        "ElfInfo",
+        ["path", "elf_type", "elf_class", "machine", "soname", "has_interp", "needed"],
+    )
+):
+    """Identification of one ELF file: type, class, machine, SONAME and DT_NEEDED."""
+
+    __slots__ = ()
+
+    @property
+    def is_executable(self) -> bool:
+        return self.elf_type == "EXEC" or (self.elf_type == "DYN" and self.has_interp)
+
+    @property
+    def is_shared_library(self) -> bool:
+        return self.elf_type == "DYN" and not self.has_interp
+
+
+class _Layout:
+    """Struct formats for one ELF class/byte-order combination."""
+
+    def __init__(self, elf_class: int, little_endian: bool):
+        order = "<" if little_endian else ">"
+        if elf_class == ELFCLASS64:
+            self.header = struct.Struct(order + "HHIQQQIHHHHHH")
+            self.phdr = struct.Struct(order + "IIQQQQQQ")
+            self.dyn = struct.Struct(order + "qQ")
+        else:
+            self.header = struct.Struct(order + "HHIIIIIHHHHHH")
+            self.phdr = struct.Struct(order + "IIIIIIII")
+            self.dyn = struct.Struct(order + "iI")
+        self.is64 = elf_class == ELFCLASS64
+
+    def segment(self, raw: bytes, offset: int):
+        """Return (p_type, p_offset, p_vaddr, p_filesz) for one program header."""
+        fields = self.phdr.unpack_from(raw, offset)
+        if self.is64:
+            p_type, _flags, p_offset, p_vaddr, _paddr, p_filesz = fields[:6]
+        else:
+            p_type, p_offset, p_vaddr, _paddr, p_filesz = fields[:5]
+        return p_type, p_offset, p_vaddr, p_filesz
+
+
+def _slice(buf, offset: int, length: int) -> bytes:
+    if offset < 0 or offset + length > len(buf):
+        raise ValueError("truncated ELF file")
+    return buf[offset:offset + length]
+
+
+def _read_dynamic(buf, layout: _Layout, segments):
+    """Return the dynamic entries as (tag, value) pairs plus a string reader."""
+    dynamic = next((s for s in segments if s[0] == PT_DYNAMIC), None)
+    if dynamic is None:
+        return [], None
+
+    raw = _slice(buf, dynamic[1], min(dynamic[3], _MAX_DYNAMIC_SIZE))
+    entries = []
+    for pos in range(0, len(raw) - layout.dyn.size + 1, layout.dyn.size):
+        tag, value = layout.dyn.unpack_from(raw, pos)
+        if tag == DT_NULL:
+            break
+        entries.append((tag, value))
+
+    tags = dict(entries)
+    strtab = tags.get(DT_STRTAB)
+    strsz = tags.get(DT_STRSZ, 0)
+    if strtab is None:
+        return entries, None
+
+    strtab_offset = None
+    for p_type, p_offset, p_vaddr, p_filesz in segments:
+        if p_type == PT_LOAD and p_vaddr <= strtab < p_vaddr + p_filesz:
+            strtab_offset = p_offset + (strtab - p_vaddr)
+            break
+    if strtab_offset is None:
+        return entries, None
+
+    strings = buf[strtab_offset:strtab_offset + strsz]
+
+    def string_at(index: int) -> Optional[str]:
+        if index >= len(strings):
+            return None
+        end = strings.find(b"\0", index)
+        return strings[index:end if end >= 0 else len(strings)].decode("utf-8", "replace")
+
+    return entries, string_at
+
+
+def parse_elf(buf, path="") -> Optional[ElfInfo]:
+    """Parse an ELF image held in a bytes-like or mmap object.
+
+    Only the identification/header bytes, the program headers and the
+    dynamic segment are touched, so with an mmap just those pages are read
+    from disk.
+    """
+    try:
+        if len(buf) < 52 or buf[:4] != ELF_MAGIC:
+            return None
+        elf_class, data = buf[4], buf[5]
+        if elf_class not in (ELFCLASS32, ELFCLASS64):
+            return None
+
+        layout = _Layout(elf_class, data == ELFDATA2LSB)
+        fields = layout.header.unpack_from(buf, 16)
+        e_type, e_machine = fields[0], fields[1]
+        e_phoff = fields[4]
+        e_phentsize, e_phnum = fields[8], fields[9]
+
+        segments = []
+        if e_phoff and e_phnum and e_phentsize >= layout.phdr.size:
+            raw = _slice(buf, e_phoff, e_phentsize * e_phnum)
+            segments = [layout.segment(raw, i * e_phentsize) for i in range(e_phnum)]
+
+        soname = None
+        needed = []
+        entries, string_at = _read_dynamic(buf, layout, segments)
+        if string_at is not None:
+            for tag, value in entries:
+                if tag == DT_SONAME:
+                    soname = string_at(value)
+                elif tag == DT_NEEDED:
+                    name = string_at(value)
+                    if name:
+                        needed.append(name)
+
+        return ElfInfo(
+            path=os.fspath(path),
+            elf_type=_TYPES.get(e_type, str(e_type)),
+            elf_class=64 if elf_class == ELFCLASS64 else 32,
+            machine=MACHINES.get(e_machine, str(e_machine)),
+            soname=soname,
+            has_interp=any(s[0] == PT_INTERP for s in segments),
+            needed=tuple(needed),
+        )
+    except (ValueError, struct.error):
+        return None
+
+
+def read_elf_info(path) -> Optional[ElfInfo]:
+    """Memory-map ``path`` and parse it; returns None for non-ELF files."""
+    try:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < 52:
+                return None
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_elf(buf, path)
+    except (OSError, ValueError):
+        return None
+
+
+def classify_files(paths: Iterable, jobs: Optional[int] = None) -> List[Optional[ElfInfo]]:
+    """Classify many files at once; results line up with ``paths``."""
+    paths = list(paths)
+    if not paths:
+        return []
+    workers = max(1, min(jobs or os.cpu_count() or 1, len(paths)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="elf") as pool:
+        return list(pool.map(read_elf_info, paths))
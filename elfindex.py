@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+import warmcache
+from elf import ElfInfo, classify_files
+from manifest import stamp_of
+
+INDEX_VERSION = 2
+
+# Libraries every Android build provides; depending on them is never a
+# missing dependency, and they are referenced by their platform module name.
+PLATFORM_LIBRARIES = frozenset(
+    [
+        "ld-android.so",
+        "libandroid_net.so",
+        "libbase.so",
+        "libbinder.so",
+        "libbinder_ndk.so",
+        "libc++.so",
+        "libc.so",
+        "libcutils.so",
+        "libdl.so",
+        "libfmq.so",
+        "libhardware.so",
+        "libhidlbase.so",
+        "libion.so",
+        "liblog.so",
+        "libm.so",
+        "libsync.so",
+        "libui.so",
+        "libutils.so",
+        "libvndksupport.so",
+        "libz.so",
+    ]
+)
+
+
+def module_name_for_soname(soname: str) -> str:
+    """Soong module name of a platform library (``liblog.so`` -> ``liblog``)."""
+    return soname[:-3] if soname.endswith(".so") else soname
+
+
+class ElfIndex:
+    """SONAME -> blob dependency graph over the selected proprietary files.
+
+    ``blobs`` maps a blob key (``partition/rel_path``) to its ``ElfInfo``.
+    Parsed records are persisted to ``cache_path`` keyed by content digest
+    (or size, mtime, ctime and inode), so only new or changed files are
+    re-parsed on the next run.
+    """
+
+    def __init__(self, cache_path: Optional[str] = None):
+        self.cache_path = cache_path
+        self.blobs: Dict[str, ElfInfo] = {}
+        self._by_soname: Dict[str, List[str]] = {}
+
+    def _warm_stamp(self):
+        st = os.stat(self.cache_path)
+        return st.st_size, st.st_mtime_ns, st.st_ino
+
+    def _load_cache(self) -> dict:
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return {}
+        warm = warmcache.get_cache("elf-index")
+        if warm is not None:
+            key, stamp = os.path.abspath(self.cache_path), self._warm_stamp()
+            entries = warm.get_current(key, stamp)
+            if entries is not None:
+                return entries
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable ELF index {self.cache_path}: {e}")
+            return {}
+        if data.get("version") != INDEX_VERSION:
+            return {}
+        entries = data.get("entries", {})
+        if warm is not None:
+            warm.put_current(key, stamp, entries, stamp[0] * warmcache.JSON_EXPANSION)
+        return entries
+
+    def _save_cache(self, entries: dict):
+        if not self.cache_path:
+            return
+        os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+        tmp_path = f"{self.cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": INDEX_VERSION, "entries": entries}, f, separators=(",", ":"))
+            size = f.tell()
+        os.replace(tmp_path, self.cache_path)
+        warm = warmcache.get_cache("elf-index")
+        if warm is not None:
+            warm.put_current(
+                os.path.abspath(self.cache_path), self._warm_stamp(), entries,
+                size * warmcache.JSON_EXPANSION,
+            )
+
+    def build(self, files: Dict[str, str], jobs: Optional[int] = None,
+              digests: Optional[Dict[str, str]] = None) -> "ElfIndex":
+        """Index ``{blob_key: filesystem_path}``, reusing cached records.
+
+        A record is reused while the blob's digest in ``digests`` matches,
+        or for blobs without one while ``manifest.stamp_of`` does. Size and
+        mtime alone are not enough: firmware is built with fixed timestamps.
+        """
+        cached = self._load_cache()
+        entries = {}
+        stale = []
+
+        for key, path in files.items():
+            stamp = digests.get(key) if digests else None
+            if stamp is None:
+                try:
+                    stamp = list(stamp_of(os.stat(path)))
+                except OSError:
+                    continue
+            record = cached.get(key)
+            if record is not None and record["stamp"] == stamp:
+                entries[key] = record
+            else:
+                stale.append((key, path, stamp))
+
+        for (key, _path, stamp), info in zip(
+            stale, classify_files([path for _, path, _ in stale], jobs=jobs)
+        ):
+            entries[key] = {"stamp": stamp, "elf": list(info) if info else None}
+
+        reused = len(entries) - len(stale)
+        logging.debug(f"ELF index: {len(stale)} parsed, {reused} reused from cache")
+        self._save_cache(entries)
+        self._set_records(files, entries)
+        return self
+
+    def load(self) -> "ElfIndex":
+        """Populate the index from the cache alone, without checking files."""
+        entries = self._load_cache()
+        self._set_records(entries, entries)
+        return self
+
+    def _set_records(self, keys, entries: dict):
+        self.blobs = {}
+        self._by_soname = {}
+        for key in keys:
+            record = entries.get(key)
+            if not record or not record["elf"]:
+                continue
+            fields = record["elf"]
+            info = ElfInfo(*fields[:6], tuple(fields[6]))
+            self.blobs[key] = info
+            provided = info.soname or key.rsplit("/", 1)[-1]
+            self._by_soname.setdefault(provided, []).append(key)
+
+    def resolve(self, key: str, soname: str) -> Optional[str]:
+        """Find the blob providing ``soname`` for the ABI of blob ``key``.
+
+        A provider in the same partition as ``key`` is preferred over
+        same-named libraries of other partitions.
+        """
+        info = self.blobs[key]
+        partition = key.split("/", 1)[0] + "/"
+        found = None
+        for candidate in self._by_soname.get(soname, []):
+            other = self.blobs[candidate]
+            if other.elf_class == info.elf_class and other.machine == info.machine:
+                if candidate.startswith(partition):
+                    return candidate
+                if found is None:
+                    found = candidate
+        return found
+
+    def dependencies(self, key: str):
+        """Split DT_NEEDED of ``key`` into (blob keys, platform libs, missing)."""
+        blobs, platform, missing = [], [], []
+        for soname in self.blobs[key].needed:
+            provider = self.resolve(key, soname)
+            if provider is not None:
+                blobs.append(provider)
+            elif soname in PLATFORM_LIBRARIES:
+                platform.append(soname)
+            else:
+                missing.append(soname)
+        return blobs, platform, missing
+
+    def shared_libs(self, key: str) -> List[str]:
+        """Module names for the ``shared_libs`` list of blob ``key``."""
+        blobs, platform, _ = self.dependencies(key)
+        names = {provider.rsplit("/", 1)[-1] for provider in blobs}
+        names.update(module_name_for_soname(soname) for soname in platform)
+        return sorted(names)
+
+    def missing_report(self) -> Dict[str, List[str]]:
+        """``{blob_key: [unresolved sonames]}`` for blobs with missing deps."""
+        report = {}
+        for key in sorted(self.blobs):
+            _, _, missing = self.dependencies(key)
+            if missing:
+                report[key] = missing
+        return report
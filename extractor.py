@@ -5,20 +5,146 @@ import subprocess
 import tempfile
 import shutil
 import logging
-from pathlib import Path
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import zip_longest
+from typing import Callable, Dict, Optional
+
+import profiling
+from compression import DecompressionError
+from filesystem import FilesystemError, open_filesystem
+from image import RawImage, image_partition_name, open_image
+from lpmetadata import (
+    LpMetadataError,
+    LpPartition,
+    SuperImage,
+    base_partition_name,
+)
+from tools import get_runner
+
+# Paths per ``cp`` invocation when copying selected files from a mount.
+_COPY_BATCH = 512
 
 
 class ImageExtractor:
-    """Handles extraction of super.img and partition images."""
+    """Handles extraction of super.img and partition images.
 
-    def __init__(self, verbose: bool = False):
+    With a ``matcher`` (a ``PatternMatcher``) only the files it selects are
+    extracted; otherwise every file is. External tools run through the
+    shared ``ToolRunner``, and ``cleanup`` (also run on ``with`` exit and
+    at interpreter exit) unmounts and removes whatever is left.
+    """
+
+    def __init__(self, verbose: bool = False, jobs: Optional[int] = None, matcher=None):
         self.verbose = verbose
+        self.jobs = jobs
+        self.matcher = matcher
         self.logger = logging.getLogger(__name__)
         self.temp_dirs = []
         self.mounted_dirs = []
+        self.temp_files = []
+        self.tools = get_runner()
+        self._release_cleanup = self.tools.defer(self.cleanup)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # Runs cleanup and drops its registration with the runner.
+        self._release_cleanup()
+        return False
 
     def extract_super_img(self, super_img_path: str) -> Optional[str]:
+        """Extract the logical partitions of a super.img."""
+        try:
+            super_image = SuperImage(super_img_path)
+        except LpMetadataError as e:
+            self.logger.warning(f"Falling back to lpunpack: {e}")
+            return self._extract_super_with_lpunpack(super_img_path)
+        except Exception as e:
+            self.logger.error(f"Error extracting super.img: {e}")
+            return None
+
+        try:
+            with super_image:
+                partitions = super_image.select_slot()
+                if not partitions:
+                    self.logger.error("No logical partitions found in super.img")
+                    return None
+
+                self.logger.info(
+                    "Found partitions: "
+                    + ", ".join(partition.name for partition in partitions.values())
+                )
+
+                extracted_dir = tempfile.mkdtemp(prefix="vendor_tree_extracted_")
+                self.temp_dirs.append(extracted_dir)
+
+                tasks = {
+                    name: partial(
+                        self._extract_logical_partition,
+                        super_image,
+                        partition,
+                        extracted_dir,
+                        name,
+                    )
+                    for name, partition in partitions.items()
+                }
+                with profiling.stage("extract_super", partitions=len(tasks)):
+                    self._run_parallel(tasks)
+
+            return extracted_dir
+
+        except Exception as e:
+            self.logger.error(f"Error extracting super.img: {e}")
+            return None
+
+    def _run_parallel(self, tasks: Dict[str, Callable[[], bool]]) -> Dict[str, bool]:
+        """Run per-partition extraction tasks on a bounded worker pool.
+
+        A task that raises is logged and recorded as failed without
+        affecting the others; results keep the order of ``tasks``.
+        """
+        if not tasks:
+            return {}
+        jobs = max(1, min(self.jobs or os.cpu_count() or 1, len(tasks)))
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="extract") as pool:
+            futures = {name: pool.submit(task) for name, task in tasks.items()}
+            for name, future in futures.items():
+                try:
+                    results[name] = bool(future.result())
+                except Exception as e:
+                    self.logger.error(f"Error extracting partition {name}: {e}")
+                    results[name] = False
+
+        failed = [name for name, ok in results.items() if not ok]
+        if failed:
+            self.logger.warning(f"Failed partitions: {', '.join(failed)}")
+        return results
+
+    def _extract_logical_partition(
+        self,
+        super_image: SuperImage,
+        partition: LpPartition,
+        output_dir: str,
+        partition_name: str,
+    ) -> bool:
+        """Extract one logical partition straight out of super.img."""
+        view = super_image.open_partition(partition.name)
+        if self._read_partition(view, output_dir, partition_name):
+            return True
+
+        fd, temp_raw = tempfile.mkstemp(suffix=f".{partition_name}.img")
+        os.close(fd)
+        self.temp_files.append(temp_raw)
+        with profiling.stage("super.copy", partition=partition_name) as span:
+            view.copy_to(temp_raw)
+            span.count(bytes=view.size)
+        return self._mount_partition(temp_raw, output_dir, partition_name)
+
+    def _extract_super_with_lpunpack(self, super_img_path: str) -> Optional[str]:
         """Extract super.img using lpunpack."""
         try:
             temp_dir = tempfile.mkdtemp(prefix="vendor_tree_super_")
@@ -26,29 +152,19 @@ class ImageExtractor:
 
             self.logger.info(f"Extracting super.img to {temp_dir}")
             cmd = ["lpunpack", super_img_path, temp_dir]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            with profiling.stage("lpunpack"):
+                result = self.tools.run(cmd)
 
             if result.returncode != 0:
                 self.logger.error(f"lpunpack failed: {result.stderr}")
                 return None
 
-            expected_partitions = [
-                "vendor.img",
-                "system.img",
-                "product.img",
-                "odm.img",
-                "vendor_dlkm.img",
-                "system_ext.img",
-            ]
-            found_partitions = []
-
-            for partition in expected_partitions:
-                partition_path = os.path.join(temp_dir, partition)
-                if os.path.exists(partition_path):
-                    found_partitions.append(partition)
+            found_partitions = sorted(
+                name for name in os.listdir(temp_dir) if name.endswith(".img")
+            )
 
             if not found_partitions:
-                self.logger.error("No expected partitions found in super.img")
+                self.logger.error("No partitions found in super.img")
                 return None
 
             self.logger.info(f"Found partitions: {', '.join(found_partitions)}")
@@ -56,11 +172,17 @@ class ImageExtractor:
             extracted_dir = tempfile.mkdtemp(prefix="vendor_tree_extracted_")
             self.temp_dirs.append(extracted_dir)
 
-            for partition in found_partitions:
-                partition_path = os.path.join(temp_dir, partition)
-                self._extract_partition(
-                    partition_path, extracted_dir, partition.replace(".img", "")
-                )
+            self._run_parallel(
+                {
+                    partition: partial(
+                        self._extract_partition,
+                        os.path.join(temp_dir, partition),
+                        extracted_dir,
+                        base_partition_name(partition.replace(".img", "")),
+                    )
+                    for partition in found_partitions
+                }
+            )
 
             return extracted_dir
 
@@ -74,7 +196,7 @@ class ImageExtractor:
             extracted_dir = tempfile.mkdtemp(prefix="vendor_tree_partition_")
             self.temp_dirs.append(extracted_dir)
 
-            partition_name = Path(partition_img_path).stem
+            partition_name = image_partition_name(partition_img_path)
             self.logger.info(f"Extracting partition: {partition_name}")
 
             success = self._extract_partition(
@@ -91,6 +213,19 @@ class ImageExtractor:
         self, img_path: str, output_dir: str, partition_name: str
     ) -> bool:
         """Extract a single partition image file."""
+        try:
+            with open_image(img_path) as image:
+                if self._read_partition(image, output_dir, partition_name):
+                    return True
+        except Exception as e:
+            self.logger.warning(f"Could not open {partition_name} image: {e}")
+
+        return self._mount_partition(img_path, output_dir, partition_name)
+
+    def _mount_partition(
+        self, img_path: str, output_dir: str, partition_name: str
+    ) -> bool:
+        """Loop-mount a partition image and copy its files out."""
         try:
             converted_img = self._convert_sparse_image(img_path)
             if not converted_img:
@@ -100,20 +235,29 @@ class ImageExtractor:
             self.mounted_dirs.append(mount_point)
 
             cmd = ["sudo", "mount", "-o", "loop,ro", converted_img, mount_point]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+            with profiling.stage("mount", partition=partition_name):
+                result = self.tools.run(cmd)
 
             if result.returncode != 0:
                 self.logger.warning(f"Failed to mount {partition_name}: {result.stderr}")
                 return False
 
-            partition_output = os.path.join(output_dir, partition_name)
-            os.makedirs(partition_output, exist_ok=True)
-
-            self.logger.info(f"Copying {partition_name} files...")
-            cmd = ["sudo", "cp", "-r", f"{mount_point}/.", partition_output]
-            result = subprocess.run(cmd, capture_output=True, text=True)
-
-            subprocess.run(["sudo", "umount", mount_point], capture_output=True)
+            unmount = self.tools.defer(partial(self._unmount, mount_point))
+            try:
+                partition_output = os.path.join(output_dir, partition_name)
+                os.makedirs(partition_output, exist_ok=True)
+
+                self.logger.info(f"Copying {partition_name} files...")
+                with profiling.stage("extract.cp", partition=partition_name):
+                    if self.matcher is None:
+                        cmd = ["sudo", "cp", "-r", f"{mount_point}/.", partition_output]
+                        result = self.tools.run(cmd)
+                    else:
+                        result = self._copy_selected(
+                            mount_point, partition_output, partition_name
+                        )
+            finally:
+                unmount()
 
             if result.returncode == 0:
                 self.logger.info(f"Successfully extracted {partition_name}")
@@ -126,24 +270,102 @@ class ImageExtractor:
             self.logger.error(f"Error extracting partition {partition_name}: {e}")
             return False
 
+    def _copy_selected(self, mount_point: str, partition_output: str, partition_name: str):
+        """Copy only the files the matcher selects out of a mounted partition."""
+        selected = []
+        for dirpath, dirnames, filenames in os.walk(mount_point):
+            rel_dir = os.path.relpath(dirpath, mount_point)
+            prefix = "" if rel_dir == "." else f"{rel_dir}/"
+            # Symlinks to directories are listed in dirnames but copied as links.
+            links = [name for name in dirnames if os.path.islink(os.path.join(dirpath, name))]
+            dirnames[:] = [
+                name
+                for name in dirnames
+                if name not in links and self.matcher.should_descend(prefix + name, partition_name)
+            ]
+            selected += [
+                prefix + name
+                for name in filenames + links
+                if self.matcher.matches(prefix + name, partition_name)
+            ]
+
+        self.logger.info(f"Selected {len(selected)} files from {partition_name}")
+
+        # Batches under different top-level directories share no parents, so
+        # they copy concurrently; batches within one run in turn so that
+        # ``cp --parents`` never races to create the same directory.
+        groups = {}
+        for rel_path in selected:
+            top = rel_path.split("/", 1)[0] if "/" in rel_path else ""
+            groups.setdefault(top, []).append(rel_path)
+        batches = [
+            [paths[start:start + _COPY_BATCH] for start in range(0, len(paths), _COPY_BATCH)]
+            for paths in groups.values()
+        ]
+        cmd = ["sudo", "cp", "-P", "--preserve=mode,timestamps", "--parents"]
+        for round_batches in zip_longest(*batches):
+            commands = [cmd + batch + [partition_output] for batch in round_batches if batch]
+            results = self.tools.run_many(commands, cwd=mount_point)
+            failed = [result for result in results if result.returncode != 0]
+            if failed:
+                return failed[0]
+        return subprocess.CompletedProcess([], 0, "", "")
+
+    def _unmount(self, mount_point: str):
+        """Unmount a partition mounted by ``_mount_partition`` and drop its mount point."""
+        result = self.tools.run(["sudo", "umount", mount_point], cleanup=True)
+        if result.returncode != 0:
+            self.logger.warning(f"Failed to unmount {mount_point}: {result.stderr}")
+            return
+        if mount_point in self.mounted_dirs:
+            self.mounted_dirs.remove(mount_point)
+        try:
+            os.rmdir(mount_point)
+        except OSError:
+            pass
+
+    def _read_partition(self, image, output_dir: str, partition_name: str) -> bool:
+        """Extract a partition with the userspace ext4/EROFS reader."""
+        partition_output = os.path.join(output_dir, partition_name)
+        try:
+            with profiling.stage("extract.read", partition=partition_name) as span:
+                fs = open_filesystem(image)
+                if self.matcher is None:
+                    count = fs.extract_tree(partition_output)
+                else:
+                    count = fs.extract_tree(
+                        partition_output,
+                        select=lambda path: self.matcher.matches(path, partition_name),
+                        prune=lambda path: not self.matcher.should_descend(path, partition_name),
+                    )
+                span.count(files=count)
+            self.logger.info(
+                f"Successfully extracted {partition_name} ({count} files, {fs.fs_type})"
+            )
+            return True
+        except (FilesystemError, DecompressionError) as e:
+            self.logger.warning(
+                f"In-process reader failed for {partition_name}, falling back to mount: {e}"
+            )
+            return False
+
     def _convert_sparse_image(self, img_path: str) -> Optional[str]:
-        """Convert sparse image to raw image using simg2img."""
+        """Decode a sparse, split or compressed image to a raw image for loop mounting."""
         try:
-            with open(img_path, "rb") as f:
-                magic = f.read(4)
-                if magic != b"\x3a\xff\x26\xed":
+            with open_image(img_path) as image:
+                if isinstance(image, RawImage):
                     return None
 
-            temp_raw = tempfile.mktemp(suffix=".raw.img")
-            cmd = ["simg2img", img_path, temp_raw]
-            result = subprocess.run(cmd, capture_output=True, text=True)
+                fd, temp_raw = tempfile.mkstemp(suffix=".raw.img")
+                os.close(fd)
+                self.temp_files.append(temp_raw)
 
-            if result.returncode == 0:
-                self.logger.info(f"Converted sparse image: {os.path.basename(img_path)}")
-                return temp_raw
-            else:
-                self.logger.warning(f"Failed to convert sparse image: {result.stderr}")
-                return None
+                with profiling.stage("sparse_decode", image=os.path.basename(img_path)) as span:
+                    image.copy_to(temp_raw)
+                    span.count(bytes=image.size)
+
+            self.logger.info(f"Converted sparse image: {os.path.basename(img_path)}")
+            return temp_raw
 
         except Exception as e:
             self.logger.error(f"Error converting sparse image: {e}")
@@ -151,11 +373,16 @@ class ImageExtractor:
 
     def cleanup(self):
         """Clean up temporary directories and unmount any mounted filesystems."""
+        try:
+            self.tools.run_many(
+                [["sudo", "umount", mount_point] for mount_point in self.mounted_dirs],
+                timeout=10,
+                cleanup=True,
+            )
+        except Exception:
+            pass
         for mount_point in self.mounted_dirs:
             try:
-                subprocess.run(
-                    ["sudo", "umount", mount_point], capture_output=True, timeout=10
-                )
                 if os.path.exists(mount_point):
                     os.rmdir(mount_point)
             except Exception:
@@ -168,5 +395,13 @@ class ImageExtractor:
             except Exception:
                 pass
 
+        for temp_file in self.temp_files:
+            try:
+                if os.path.exists(temp_file):
+                    os.remove(temp_file)
+            except Exception:
+                pass
+
         self.temp_dirs.clear()
         self.mounted_dirs.clear()
+        self.temp_files.clear()
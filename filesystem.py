@@ -0,0 +1,804 @@
+#!/usr/bin/env python3
+
+import os
+import shutil
+import stat
+import struct
+from collections import namedtuple
+
+from compression import deflate_decompress, lz4_block_decompress, zstd_decompress
+
+DEFAULT_CHUNK_SIZE = 1 << 20
+
+
+class FilesystemError(ValueError):
+    """Raised when an image holds no supported filesystem or is corrupt."""
+
+
+class UnsupportedLayoutError(FilesystemError):
+    """Raised for on-disk features the in-process readers do not decode."""
+
+
+class FsEntry(namedtuple("FsEntry", ["path", "inode", "mode", "size", "mtime"])):
+    """A file, directory or symlink found inside a filesystem image."""
+
+    __slots__ = ()
+
+    @property
+    def name(self) -> str:
+        return self.path.rsplit("/", 1)[-1]
+
+    @property
+    def is_dir(self) -> bool:
+        return stat.S_ISDIR(self.mode)
+
+    @property
+    def is_file(self) -> bool:
+        return stat.S_ISREG(self.mode)
+
+    @property
+    def is_symlink(self) -> bool:
+        return stat.S_ISLNK(self.mode)
+
+
+def _decode_name(name: bytes) -> str:
+    return name.decode("utf-8", "surrogateescape")
+
+
+def _zeros(length: int, chunk_size: int):
+    while length > 0:
+        n = min(length, chunk_size)
+        yield bytes(n)
+        length -= n
+
+
+def _remove(path: str):
+    """Remove whatever is at ``path`` without following links."""
+    try:
+        st = os.lstat(path)
+    except FileNotFoundError:
+        return
+    if stat.S_ISDIR(st.st_mode):
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def make_parent_dirs(root: str, rel_path: str):
+    """Create the directories of ``rel_path`` under ``root`` as real directories.
+
+    Symlinks or files an earlier extraction left in their place are removed
+    rather than followed, so firmware paths cannot lead writes out of ``root``.
+    """
+    os.makedirs(root, exist_ok=True)
+    path = root
+    for part in filter(None, rel_path.split("/")[:-1]):
+        path = os.path.join(path, part)
+        try:
+            if stat.S_ISDIR(os.lstat(path).st_mode):
+                continue
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            # Created concurrently; fine as long as it is a real directory.
+            if not stat.S_ISDIR(os.lstat(path).st_mode):
+                raise
+
+
+class FilesystemReader:
+    """Walks and extracts files from a filesystem image without mounting it.
+
+    Subclasses decode the on-disk format through ``_inode``, ``_listdir``
+    and ``_iter_data``; everything path-based lives here. ``image`` is any
+    object with ``pread(offset, length)`` such as those from
+    ``image.open_image``.
+    """
+
+    fs_type = None
+
+    def __init__(self, image):
+        self.image = image
+
+    def _inode(self, ino):
+        raise NotImplementedError
+
+    def _listdir(self, inode):
+        raise NotImplementedError
+
+    def _iter_data(self, inode, chunk_size):
+        raise NotImplementedError
+
+    def _readlink(self, inode) -> bytes:
+        return b"".join(self._iter_data(inode, DEFAULT_CHUNK_SIZE))
+
+    def _entry(self, path: str, ino) -> FsEntry:
+        inode = self._inode(ino)
+        return FsEntry(path, ino, inode.mode, inode.size, inode.mtime)
+
+    def root(self) -> FsEntry:
+        return self._entry("", self.root_ino)
+
+    def listdir(self, entry: FsEntry):
+        """Yield the children of a directory entry."""
+        prefix = f"{entry.path}/" if entry.path else ""
+        for name, ino in self._listdir(self._inode(entry.inode)):
+            yield self._entry(prefix + _decode_name(name), ino)
+
+    def walk(self, top: str = "", prune=None):
+        """Yield every entry below ``top`` in depth-first order.
+
+        ``prune(path)`` is called for each directory; returning True skips
+        the directory and everything beneath it.
+        """
+        stack = [self.lookup(top)]
+        while stack:
+            directory = stack.pop()
+            for entry in self.listdir(directory):
+                if entry.is_dir:
+                    if prune is not None and prune(entry.path):
+                        continue
+                    stack.append(entry)
+                yield entry
+
+    def lookup(self, path: str) -> FsEntry:
+        """Resolve a slash-separated path relative to the filesystem root."""
+        entry = self.root()
+        for part in filter(None, path.split("/")):
+            if not entry.is_dir:
+                raise FileNotFoundError(path)
+            for child in self.listdir(entry):
+                if child.name == part:
+                    entry = child
+                    break
+            else:
+                raise FileNotFoundError(path)
+        return entry
+
+    def iter_content(self, entry: FsEntry, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """Stream the contents of a regular file in chunks."""
+        return self._iter_data(self._inode(entry.inode), chunk_size)
+
+    def read_file(self, entry: FsEntry) -> bytes:
+        return b"".join(self.iter_content(entry))
+
+    def readlink(self, entry: FsEntry) -> str:
+        return _decode_name(self._readlink(self._inode(entry.inode)))
+
+    def extract(self, entry: FsEntry, dest_path: str):
+        """Write a single file or symlink to ``dest_path``.
+
+        Whatever is already at ``dest_path`` is replaced, never written
+        through, so links left by a previous run or by ``--materialize
+        hardlink`` are not followed. Use ``make_parent_dirs`` first when the
+        parent directories may hold such links too.
+        """
+        parent = os.path.dirname(dest_path)
+        if parent:
+            os.makedirs(parent, exist_ok=True)
+
+        if entry.is_dir:
+            if os.path.islink(dest_path):
+                os.unlink(dest_path)
+            os.makedirs(dest_path, exist_ok=True)
+        elif entry.is_symlink or entry.is_file:
+            _remove(dest_path)
+            if entry.is_symlink:
+                os.symlink(self.readlink(entry), dest_path)
+                return
+            # O_EXCL: fail rather than follow anything recreated in the meantime.
+            fd = os.open(dest_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                for chunk in self.iter_content(entry):
+                    f.write(chunk)
+        else:
+            return
+
+        os.chmod(dest_path, stat.S_IMODE(entry.mode) | stat.S_IRUSR | stat.S_IWUSR)
+        os.utime(dest_path, (entry.mtime, entry.mtime))
+
+    def extract_tree(self, dest_dir: str, select=None, prune=None) -> int:
+        """Extract files and symlinks into ``dest_dir``.
+
+        ``select(path)`` filters which non-directory entries are written and
+        ``prune`` is passed through to ``walk``. Returns the number of
+        entries extracted.
+        """
+        count = 0
+        for entry in self.walk(prune=prune):
+            if entry.is_dir:
+                continue
+            if select is not None and not select(entry.path):
+                continue
+            make_parent_dirs(dest_dir, entry.path)
+            self.extract(entry, os.path.join(dest_dir, entry.path))
+            count += 1
+        return count
+
+
+# ext4
+
+EXT4_SUPER_MAGIC = 0xEF53
+
+_EXT4_INCOMPAT_COMPRESSION = 0x1
+_EXT4_INCOMPAT_FILETYPE = 0x2
+_EXT4_INCOMPAT_META_BG = 0x10
+_EXT4_INCOMPAT_64BIT = 0x80
+_EXT4_INCOMPAT_ENCRYPT = 0x10000
+
+_EXT4_EXTENTS_FL = 0x80000
+_EXT4_INLINE_DATA_FL = 0x10000000
+_EXT4_EXTENT_MAGIC = 0xF30A
+_EXT4_XATTR_MAGIC = 0xEA020000
+_EXT4_XATTR_INDEX_SYSTEM = 7
+
+_Ext4Inode = namedtuple(
+    "_Ext4Inode", ["ino", "mode", "size", "mtime", "flags", "i_block", "raw"]
+)
+
+
+class Ext4Reader(FilesystemReader):
+    """Read-only ext2/3/4 reader supporting extents, block maps and inline data."""
+
+    fs_type = "ext4"
+    root_ino = 2
+
+    def __init__(self, image):
+        super().__init__(image)
+        sb = image.pread(1024, 1024)
+        if len(sb) < 1024 or struct.unpack_from("<H", sb, 56)[0] != EXT4_SUPER_MAGIC:
+            raise FilesystemError("not an ext4 filesystem")
+
+        blocks_lo, = struct.unpack_from("<I", sb, 4)
+        first_data_block, log_block_size = struct.unpack_from("<II", sb, 20)
+        blocks_per_group, = struct.unpack_from("<I", sb, 32)
+        self.inodes_per_group, = struct.unpack_from("<I", sb, 40)
+        rev_level, = struct.unpack_from("<I", sb, 76)
+        inode_size, = struct.unpack_from("<H", sb, 88)
+        self.feature_incompat, = struct.unpack_from("<I", sb, 96)
+        desc_size, = struct.unpack_from("<H", sb, 254)
+        blocks_hi, = struct.unpack_from("<I", sb, 336)
+
+        for flag, feature in (
+            (_EXT4_INCOMPAT_COMPRESSION, "compression"),
+            (_EXT4_INCOMPAT_META_BG, "meta_bg"),
+            (_EXT4_INCOMPAT_ENCRYPT, "encrypt"),
+        ):
+            if self.feature_incompat & flag:
+                raise UnsupportedLayoutError(f"ext4 feature '{feature}' is not supported")
+
+        self.block_size = 1024 << log_block_size
+        self.inode_size = inode_size if rev_level >= 1 else 128
+        self._filetype = bool(self.feature_incompat & _EXT4_INCOMPAT_FILETYPE)
+
+        is_64bit = bool(self.feature_incompat & _EXT4_INCOMPAT_64BIT)
+        blocks_count = blocks_lo | (blocks_hi << 32 if is_64bit else 0)
+        if not is_64bit or desc_size < 32:
+            desc_size = 32
+
+        group_count = -(-(blocks_count - first_data_block) // blocks_per_group)
+        gdt = image.pread((first_data_block + 1) * self.block_size, group_count * desc_size)
+        self._inode_tables = []
+        for group in range(group_count):
+            base = group * desc_size
+            table, = struct.unpack_from("<I", gdt, base + 8)
+            if desc_size >= 64:
+                table |= struct.unpack_from("<I", gdt, base + 0x28)[0] << 32
+            self._inode_tables.append(table)
+
+    def _inode(self, ino) -> _Ext4Inode:
+        group, index = divmod(ino - 1, self.inodes_per_group)
+        offset = self._inode_tables[group] * self.block_size + index * self.inode_size
+        raw = self.image.pread(offset, self.inode_size)
+
+        mode, = struct.unpack_from("<H", raw, 0)
+        size_lo, = struct.unpack_from("<I", raw, 4)
+        mtime, = struct.unpack_from("<I", raw, 16)
+        flags, = struct.unpack_from("<I", raw, 32)
+        size_hi, = struct.unpack_from("<I", raw, 108)
+        return _Ext4Inode(
+            ino, mode, size_lo | (size_hi << 32), mtime, flags, raw[40:100], raw
+        )
+
+    def _inline_data(self, inode: _Ext4Inode) -> bytes:
+        """Return i_block followed by the in-inode ``system.data`` xattr."""
+        data = inode.i_block
+        raw = inode.raw
+        if len(raw) <= 132:
+            return data
+
+        extra_isize, = struct.unpack_from("<H", raw, 128)
+        base = 128 + extra_isize
+        if len(raw) < base + 4 or struct.unpack_from("<I", raw, base)[0] != _EXT4_XATTR_MAGIC:
+            return data
+
+        first = base + 4
+        pos = first
+        while pos + 16 <= len(raw) and raw[pos:pos + 4] != b"\0\0\0\0":
+            name_len, name_index, value_offs, _inum, value_size = struct.unpack_from(
+                "<BBHII", raw, pos
+            )
+            name = raw[pos + 16:pos + 16 + name_len]
+            if name_index == _EXT4_XATTR_INDEX_SYSTEM and name == b"data":
+                return data + raw[first + value_offs:first + value_offs + value_size]
+            pos += (16 + name_len + 3) & ~3
+        return data
+
+    def _extents(self, node: bytes):
+        magic, entries, _max, depth = struct.unpack_from("<HHHH", node, 0)
+        if magic != _EXT4_EXTENT_MAGIC:
+            raise FilesystemError("corrupt ext4 extent header")
+        for i in range(entries):
+            if depth == 0:
+                lblk, length, start_hi, start_lo = struct.unpack_from("<IHHI", node, 12 + 12 * i)
+                uninit = length > 32768
+                if uninit:
+                    length -= 32768
+                yield lblk, (start_hi << 32) | start_lo, length, uninit
+            else:
+                _lblk, leaf_lo, leaf_hi = struct.unpack_from("<IIH", node, 12 + 12 * i)
+                child = self.image.pread(((leaf_hi << 32) | leaf_lo) * self.block_size,
+                                         self.block_size)
+                yield from self._extents(child)
+
+    def _indirect(self, block: int, depth: int, lblk: int, limit: int):
+        per_block = self.block_size // 4
+        span = per_block ** (depth - 1)
+        raw = self.image.pread(block * self.block_size, self.block_size)
+        for i, ptr in enumerate(struct.unpack(f"<{per_block}I", raw)):
+            start = lblk + i * span
+            if start >= limit:
+                return
+            if ptr == 0:
+                continue
+            if depth == 1:
+                yield start, ptr
+            else:
+                yield from self._indirect(ptr, depth - 1, start, limit)
+
+    def _block_map(self, inode: _Ext4Inode):
+        limit = -(-inode.size // self.block_size)
+        ptrs = struct.unpack("<15I", inode.i_block)
+        per_block = self.block_size // 4
+
+        def blocks():
+            for i in range(min(12, limit)):
+                if ptrs[i]:
+                    yield i, ptrs[i]
+            lblk = 12
+            for depth in (1, 2, 3):
+                if ptrs[11 + depth] and lblk < limit:
+                    yield from self._indirect(ptrs[11 + depth], depth, lblk, limit)
+                lblk += per_block ** depth
+
+        run = None
+        for lblk, pblk in blocks():
+            if run and run[0] + run[2] == lblk and run[1] + run[2] == pblk:
+                run[2] += 1
+                continue
+            if run:
+                yield tuple(run) + (False,)
+            run = [lblk, pblk, 1]
+        if run:
+            yield tuple(run) + (False,)
+
+    def _iter_data(self, inode: _Ext4Inode, chunk_size):
+        size = inode.size
+        if inode.flags & _EXT4_INLINE_DATA_FL:
+            yield self._inline_data(inode)[:size]
+            return
+
+        if inode.flags & _EXT4_EXTENTS_FL:
+            runs = sorted(self._extents(inode.i_block))
+        else:
+            runs = self._block_map(inode)
+
+        bs = self.block_size
+        pos = 0
+        for lblk, pblk, count, uninit in runs:
+            start = lblk * bs
+            end = min(start + count * bs, size)
+            if end <= pos:
+                continue
+            if start > pos:
+                yield from _zeros(start - pos, chunk_size)
+                pos = start
+            while pos < end:
+                n = min(chunk_size, end - pos)
+                if uninit:
+                    yield bytes(n)
+                else:
+                    yield self.image.pread(pblk * bs + (pos - start), n)
+                pos += n
+            if pos >= size:
+                return
+        yield from _zeros(size - pos, chunk_size)
+
+    def _parse_dirents(self, data: bytes):
+        pos = 0
+        while pos + 8 <= len(data):
+            ino, rec_len, name_len, file_type = struct.unpack_from("<IHBB", data, pos)
+            if rec_len < 8:
+                break
+            if not self._filetype:
+                name_len |= file_type << 8
+            if ino and name_len:
+                name = data[pos + 8:pos + 8 + name_len]
+                if name not in (b".", b".."):
+                    yield name, ino
+            pos += rec_len
+
+    def _listdir(self, inode: _Ext4Inode):
+        if inode.flags & _EXT4_INLINE_DATA_FL:
+            data = self._inline_data(inode)
+            yield from self._parse_dirents(data[4:60])
+            yield from self._parse_dirents(data[60:])
+            return
+        data = b"".join(self._iter_data(inode, DEFAULT_CHUNK_SIZE))
+        yield from self._parse_dirents(data)
+
+    def _readlink(self, inode: _Ext4Inode) -> bytes:
+        if inode.size < 60 and not inode.flags & (_EXT4_EXTENTS_FL | _EXT4_INLINE_DATA_FL):
+            return inode.i_block[:inode.size]
+        return super()._readlink(inode)
+
+
+# EROFS
+
+EROFS_SUPER_MAGIC = 0xE0F5E1E2
+
+_EROFS_FEATURE_INCOMPAT_ZERO_PADDING = 0x1
+_EROFS_FEATURE_INCOMPAT_DEVICE_TABLE = 0x8
+
+_EROFS_INODE_FLAT_PLAIN = 0
+_EROFS_INODE_COMPRESSED_FULL = 1
+_EROFS_INODE_FLAT_INLINE = 2
+_EROFS_INODE_COMPRESSED_COMPACT = 3
+_EROFS_INODE_CHUNK_BASED = 4
+
+_EROFS_CHUNK_FORMAT_BLKBITS_MASK = 0x1F
+_EROFS_CHUNK_FORMAT_INDEXES = 0x20
+_EROFS_NULL_ADDR = 0xFFFFFFFF
+
+_Z_EROFS_ADVISE_COMPACTED_2B = 0x1
+_Z_EROFS_ADVISE_BIG_PCLUSTER_1 = 0x2
+_Z_EROFS_ADVISE_BIG_PCLUSTER_2 = 0x4
+_Z_EROFS_ADVISE_INLINE_PCLUSTER = 0x8
+_Z_EROFS_ADVISE_INTERLACED_PCLUSTER = 0x10
+_Z_EROFS_ADVISE_FRAGMENT_PCLUSTER = 0x20
+_Z_EROFS_FRAGMENT_INODE_BIT = 0x80
+
+_Z_EROFS_LCLUSTER_TYPE_PLAIN = 0
+_Z_EROFS_LCLUSTER_TYPE_HEAD1 = 1
+_Z_EROFS_LCLUSTER_TYPE_NONHEAD = 2
+_Z_EROFS_LCLUSTER_TYPE_HEAD2 = 3
+_Z_EROFS_LI_D0_CBLKCNT = 1 << 11
+
+_Z_EROFS_COMPRESSION_LZ4 = 0
+_Z_EROFS_COMPRESSION_DEFLATE = 2
+_Z_EROFS_COMPRESSION_ZSTD = 3
+
+_EROFS_DECOMPRESSORS = {
+    _Z_EROFS_COMPRESSION_LZ4: lz4_block_decompress,
+    _Z_EROFS_COMPRESSION_DEFLATE: deflate_decompress,
+    _Z_EROFS_COMPRESSION_ZSTD: zstd_decompress,
+}
+
+_ErofsInode = namedtuple(
+    "_ErofsInode",
+    ["nid", "mode", "size", "mtime", "layout", "i_u", "pos", "isize", "xattr_isize"],
+)
+
+# One logical cluster index. ``value`` is the cluster offset for HEAD/PLAIN
+# lclusters and delta[0] for NONHEAD ones; ``pblk`` is only set for heads.
+_Lcluster = namedtuple("_Lcluster", ["type", "value", "pblk"])
+
+
+def _align(value: int, alignment: int) -> int:
+    return (value + alignment - 1) & ~(alignment - 1)
+
+
+class ErofsReader(FilesystemReader):
+    """Read-only EROFS reader.
+
+    Plain, inline and chunk-based files are read directly. Compressed files
+    are decoded per pcluster for LZ4 (always), DEFLATE and zstd (when the
+    codec is available); packed fragments and MicroLZMA raise
+    ``UnsupportedLayoutError``.
+    """
+
+    fs_type = "erofs"
+
+    def __init__(self, image):
+        super().__init__(image)
+        sb = image.pread(1024, 128)
+        if len(sb) < 128 or struct.unpack_from("<I", sb, 0)[0] != EROFS_SUPER_MAGIC:
+            raise FilesystemError("not an EROFS filesystem")
+
+        (blkszbits, _extslots, self.root_ino, _inos, self.build_time,
+         _nsec, _blocks, meta_blkaddr) = struct.unpack_from("<BBHQQIII", sb, 12)
+        self.feature_incompat, = struct.unpack_from("<I", sb, 80)
+
+        self.blkszbits = blkszbits
+        self.block_size = 1 << blkszbits
+        self.meta_base = meta_blkaddr * self.block_size
+        self._zero_padding = bool(self.feature_incompat & _EROFS_FEATURE_INCOMPAT_ZERO_PADDING)
+
+    def _inode(self, nid) -> _ErofsInode:
+        pos = self.meta_base + nid * 32
+        raw = self.image.pread(pos, 64)
+        i_format, xattr_icount, mode = struct.unpack_from("<HHH", raw, 0)
+        layout = (i_format >> 1) & 0x7
+
+        if i_format & 1:
+            size, i_u = struct.unpack_from("<QI", raw, 8)
+            mtime, = struct.unpack_from("<Q", raw, 32)
+            isize = 64
+        else:
+            size, = struct.unpack_from("<I", raw, 8)
+            i_u, = struct.unpack_from("<I", raw, 16)
+            mtime = self.build_time
+            isize = 32
+
+        xattr_isize = 12 + 4 * (xattr_icount - 1) if xattr_icount else 0
+        return _ErofsInode(nid, mode, size, mtime, layout, i_u, pos, isize, xattr_isize)
+
+    def _read_range(self, offset: int, length: int, chunk_size: int):
+        done = 0
+        while done < length:
+            n = min(chunk_size, length - done)
+            yield self.image.pread(offset + done, n)
+            done += n
+
+    def _iter_data(self, inode: _ErofsInode, chunk_size):
+        size = inode.size
+        bs = self.block_size
+        if size == 0:
+            return
+
+        if inode.layout == _EROFS_INODE_FLAT_PLAIN:
+            yield from self._read_range(inode.i_u * bs, size, chunk_size)
+
+        elif inode.layout == _EROFS_INODE_FLAT_INLINE:
+            tail_start = (-(-size // bs) - 1) * bs
+            yield from self._read_range(inode.i_u * bs, tail_start, chunk_size)
+            yield self.image.pread(
+                inode.pos + inode.isize + inode.xattr_isize, size - tail_start
+            )
+
+        elif inode.layout == _EROFS_INODE_CHUNK_BASED:
+            yield from self._iter_chunked(inode, chunk_size)
+
+        elif inode.layout in (_EROFS_INODE_COMPRESSED_FULL, _EROFS_INODE_COMPRESSED_COMPACT):
+            yield from self._iter_compressed(inode)
+
+        else:
+            raise UnsupportedLayoutError(f"EROFS data layout {inode.layout} is not supported")
+
+    def _iter_chunked(self, inode: _ErofsInode, chunk_size):
+        fmt = inode.i_u & 0xFFFF
+        chunk_bytes = self.block_size << (fmt & _EROFS_CHUNK_FORMAT_BLKBITS_MASK)
+        indexes = bool(fmt & _EROFS_CHUNK_FORMAT_INDEXES)
+        unit = 8 if indexes else 4
+        base = _align(inode.pos + inode.isize + inode.xattr_isize, unit)
+        nchunks = -(-inode.size // chunk_bytes)
+        table = self.image.pread(base, nchunks * unit)
+
+        for i in range(nchunks):
+            if indexes:
+                _advise, device_id, blkaddr = struct.unpack_from("<HHI", table, i * 8)
+                if device_id:
+                    raise UnsupportedLayoutError("EROFS multi-device images are not supported")
+            else:
+                blkaddr, = struct.unpack_from("<I", table, i * 4)
+            n = min(chunk_bytes, inode.size - i * chunk_bytes)
+            if blkaddr == _EROFS_NULL_ADDR:
+                yield from _zeros(n, chunk_size)
+            else:
+                yield from self._read_range(blkaddr * self.block_size, n, chunk_size)
+
+    def _full_lclusters(self, index_base: int, total: int):
+        raw = self.image.pread(index_base, total * 8)
+        lclusters = []
+        for lcn in range(total):
+            advise, clusterofs, u = struct.unpack_from("<HHI", raw, lcn * 8)
+            kind = advise & 3
+            if kind == _Z_EROFS_LCLUSTER_TYPE_NONHEAD:
+                lclusters.append(_Lcluster(kind, u & 0xFFFF, None))
+            else:
+                lclusters.append(_Lcluster(kind, clusterofs, u))
+        return lclusters, index_base + total * 8
+
+    def _compact_lclusters(self, index_base: int, total: int, advise: int, lclusterbits: int):
+        """Decode compacted 2B/4B lcluster packs the same way the kernel does."""
+        initial = ((32 - index_base % 32) // 4) & 7
+        compacted_2b = 0
+        if advise & _Z_EROFS_ADVISE_COMPACTED_2B and initial < total:
+            compacted_2b = (total - initial) // 16 * 16
+        big_pcluster = bool(advise & _Z_EROFS_ADVISE_BIG_PCLUSTER_1)
+        lobits = max(lclusterbits, 12)
+
+        def locate(lcn):
+            pos, shift = index_base, 2
+            if lcn >= initial:
+                pos += initial * 4
+                lcn -= initial
+                if lcn < compacted_2b:
+                    shift = 1
+                else:
+                    pos += compacted_2b * 2
+                    lcn -= compacted_2b
+            return pos + (lcn << shift), shift
+
+        last_pos, last_shift = locate(total - 1)
+        last_pack = (2 if last_shift == 2 else 16) << last_shift
+        end = last_pos - last_pos % last_pack + last_pack
+        area = self.image.pread(index_base, end - index_base)
+
+        lclusters = []
+        for lcn in range(total):
+            pos, shift = locate(lcn)
+            vcnt = 2 if shift == 2 else 16
+            pack_size = vcnt << shift
+            start = pos - pos % pack_size - index_base
+            pack = area[start:start + pack_size]
+            i = (pos % pack_size) >> shift
+            encodebits = (pack_size - 4) * 8 // vcnt
+
+            def decode(j):
+                bit = encodebits * j
+                v = int.from_bytes(pack[bit // 8:bit // 8 + 4], "little") >> (bit & 7)
+                return (v >> lobits) & 3, v & ((1 << lobits) - 1)
+
+            kind, lo = decode(i)
+            if kind == _Z_EROFS_LCLUSTER_TYPE_NONHEAD:
+                if not lo & _Z_EROFS_LI_D0_CBLKCNT and i + 1 == vcnt:
+                    prev_kind, prev_lo = decode(i - 1)
+                    if prev_kind != _Z_EROFS_LCLUSTER_TYPE_NONHEAD:
+                        prev_lo = 0
+                    elif prev_lo & _Z_EROFS_LI_D0_CBLKCNT:
+                        prev_lo = 1
+                    lo = prev_lo + 1
+                lclusters.append(_Lcluster(kind, lo, None))
+                continue
+
+            if not big_pcluster:
+                nblk = 1
+                j = i
+                while j > 0:
+                    j -= 1
+                    prev_kind, prev_lo = decode(j)
+                    if prev_kind == _Z_EROFS_LCLUSTER_TYPE_NONHEAD:
+                        j -= prev_lo
+                    if j >= 0:
+                        nblk += 1
+            else:
+                nblk = 0
+                j = i
+                while j > 0:
+                    j -= 1
+                    prev_kind, prev_lo = decode(j)
+                    if prev_kind == _Z_EROFS_LCLUSTER_TYPE_NONHEAD:
+                        if prev_lo & _Z_EROFS_LI_D0_CBLKCNT:
+                            j -= 1
+                            nblk += prev_lo & ~_Z_EROFS_LI_D0_CBLKCNT
+                            continue
+                        if prev_lo <= 1:
+                            raise FilesystemError("corrupt EROFS compacted index")
+                        j -= prev_lo - 2
+                        continue
+                    nblk += 1
+
+            base_blkaddr, = struct.unpack_from("<I", pack, pack_size - 4)
+            lclusters.append(_Lcluster(kind, lo, base_blkaddr + nblk))
+
+        return lclusters, end
+
+    def _iter_compressed(self, inode: _ErofsInode):
+        header_pos = _align(inode.pos + inode.isize + inode.xattr_isize, 8)
+        _reserved, idata_size, advise, algorithms, clusterbits = struct.unpack(
+            "<HHHBB", self.image.pread(header_pos, 8)
+        )
+        if advise & _Z_EROFS_ADVISE_FRAGMENT_PCLUSTER or clusterbits & _Z_EROFS_FRAGMENT_INODE_BIT:
+            raise UnsupportedLayoutError("EROFS packed fragments are not supported")
+
+        bs = self.block_size
+        lclusterbits = self.blkszbits + (clusterbits & 7)
+        lcluster_size = 1 << lclusterbits
+        total = -(-inode.size // lcluster_size)
+
+        if inode.layout == _EROFS_INODE_COMPRESSED_FULL:
+            lclusters, index_end = self._full_lclusters(header_pos + 16, total)
+        else:
+            if lclusterbits != self.blkszbits:
+                raise UnsupportedLayoutError("EROFS compacted indexes need 1-block lclusters")
+            lclusters, index_end = self._compact_lclusters(
+                header_pos + 8, total, advise, lclusterbits
+            )
+
+        heads = [
+            (lcn * lcluster_size + lc.value, lcn, lc)
+            for lcn, lc in enumerate(lclusters)
+            if lc.type != _Z_EROFS_LCLUSTER_TYPE_NONHEAD
+        ]
+        tail_packed = bool(advise & _Z_EROFS_ADVISE_INLINE_PCLUSTER)
+
+        for index, (start, lcn, head) in enumerate(heads):
+            end = heads[index + 1][0] if index + 1 < len(heads) else inode.size
+            length = min(end, inode.size) - start
+            if length <= 0:
+                continue
+
+            if tail_packed and index == len(heads) - 1:
+                src = self.image.pread(index_end, idata_size)
+            else:
+                big = advise & (
+                    _Z_EROFS_ADVISE_BIG_PCLUSTER_1
+                    if head.type == _Z_EROFS_LCLUSTER_TYPE_HEAD1
+                    else _Z_EROFS_ADVISE_BIG_PCLUSTER_2
+                )
+                blocks = 1
+                if big and lcn + 1 < total:
+                    nxt = lclusters[lcn + 1]
+                    if (nxt.type == _Z_EROFS_LCLUSTER_TYPE_NONHEAD
+                            and nxt.value & _Z_EROFS_LI_D0_CBLKCNT):
+                        blocks = (nxt.value & ~_Z_EROFS_LI_D0_CBLKCNT) or 1
+                src = self.image.pread(head.pblk * bs, blocks * bs)
+
+            if head.type == _Z_EROFS_LCLUSTER_TYPE_PLAIN:
+                if advise & _Z_EROFS_ADVISE_INTERLACED_PCLUSTER and not (
+                    tail_packed and index == len(heads) - 1
+                ):
+                    shift = start % len(src)
+                    src = src[shift:] + src[:shift]
+                yield src[:length]
+                continue
+
+            algorithm = (
+                algorithms & 0xF
+                if head.type == _Z_EROFS_LCLUSTER_TYPE_HEAD1
+                else algorithms >> 4
+            )
+            decompress = _EROFS_DECOMPRESSORS.get(algorithm)
+            if decompress is None:
+                raise UnsupportedLayoutError(
+                    f"EROFS compression algorithm {algorithm} is not supported"
+                )
+            if self._zero_padding or algorithm != _Z_EROFS_COMPRESSION_LZ4:
+                src = src.lstrip(b"\0")
+            yield decompress(src, length)
+
+    def _listdir(self, inode: _ErofsInode):
+        data = b"".join(self._iter_data(inode, DEFAULT_CHUNK_SIZE))
+        bs = self.block_size
+        for block_start in range(0, len(data), bs):
+            block = data[block_start:block_start + bs]
+            if len(block) < 12:
+                break
+            count = struct.unpack_from("<H", block, 8)[0] // 12
+            for i in range(count):
+                nid, nameoff = struct.unpack_from("<QH", block, i * 12)
+                if i + 1 < count:
+                    name_end = struct.unpack_from("<H", block, (i + 1) * 12 + 8)[0]
+                    name = block[nameoff:name_end]
+                else:
+                    name = block[nameoff:].split(b"\0", 1)[0]
+                if name not in (b".", b".."):
+                    yield name, nid
+
+
+_READERS = (Ext4Reader, ErofsReader)
+
+
+def open_filesystem(image) -> FilesystemReader:
+    """Detect and open the filesystem stored in ``image``."""
+    for reader in _READERS:
+        try:
+            return reader(image)
+        except UnsupportedLayoutError:
+            raise
+        except FilesystemError:
+            continue
+    raise FilesystemError("no supported filesystem (ext4, EROFS) found in image")
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from blobstore import hash_chunks
+from compression import DecompressionError
+from elf import ELF_MAGIC, ElfInfo, parse_elf
+from elfindex import ElfIndex
+from filesystem import FilesystemError, open_filesystem
+from generator import STATE_DIR, find_partition_images
+from image import open_image
+from lpmetadata import LpMetadataError
+from manifest import Manifest, link_digest
+from sparse import SparseImageError
+
+HEADER_SIZE = 4096
+
+# What opening, walking or (lazily, for EROFS) decoding an image can raise.
+READ_ERRORS = (OSError, FilesystemError, DecompressionError, SparseImageError, LpMetadataError)
+
+Key = Tuple[str, str]
+
+
+class ImageSource:
+    """Blobs selected from a directory of partition images, read in place.
+
+    Nothing is extracted: sizes come from the inode metadata, and file
+    contents are only streamed when a header or digest is asked for.
+    Partitions whose image cannot be opened or walked are listed in
+    ``unreadable``; the diff leaves them out rather than reporting their
+    blobs as added or removed. Contents are decoded lazily, so a blob can
+    still fail to read later (``READ_ERRORS``); ``diff_sources`` handles
+    that per blob.
+    """
+
+    def __init__(self, image_dir, matcher):
+        self.label = os.fspath(image_dir)
+        self.blobs: Dict[Key, tuple] = {}
+        self.unreadable: List[str] = []
+        self._images = []
+        for image_path in sorted(find_partition_images(image_dir), key=lambda p: p.stem):
+            partition = image_path.stem
+            image = None
+            try:
+                image = open_image(image_path)
+                fs = open_filesystem(image)
+                prune = lambda path, partition=partition: not matcher.should_descend(
+                    path, partition
+                )
+                blobs = {
+                    (partition, entry.path): (fs, entry)
+                    for entry in fs.walk(prune=prune)
+                    if not entry.is_dir and matcher.matches(entry.path, partition)
+                }
+            except READ_ERRORS as e:
+                logging.error(f"Cannot read {image_path.name} in place: {e}")
+                if image is not None:
+                    image.close()
+                self.unreadable.append(partition)
+                continue
+            self._images.append(image)
+            self.blobs.update(blobs)
+
+    def close(self):
+        for image in self._images:
+            image.close()
+        self._images = []
+
+    def size(self, key: Key) -> int:
+        return self.blobs[key][1].size
+
+    def header(self, key: Key) -> Optional[bytes]:
+        fs, entry = self.blobs[key]
+        if entry.is_symlink:
+            return None
+        return next(iter(fs.iter_content(entry, HEADER_SIZE)), b"")
+
+    def digest(self, key: Key) -> str:
+        fs, entry = self.blobs[key]
+        if entry.is_symlink:
+            return link_digest(fs.readlink(entry))
+        return hash_chunks(fs.iter_content(entry))
+
+    def sha1(self, key: Key) -> Optional[str]:
+        return None
+
+    def elf(self, key: Key) -> Optional[ElfInfo]:
+        fs, entry = self.blobs[key]
+        if entry.is_symlink or self.header(key)[:4] != ELF_MAGIC:
+            return None
+        return parse_elf(fs.read_file(entry), entry.path)
+
+
+class ManifestSource:
+    """Blobs recorded by a previous run in ``.vendor_tree/manifest.sqlite``.
+
+    ``path`` may be the manifest itself or a generated tree containing it.
+    Only sizes and digests are known, so there is no header comparison;
+    ELF records come from the ``elf-index.json`` cached alongside.
+    """
+
+    def __init__(self, path):
+        path = Path(path)
+        if path.is_dir():
+            path = path / STATE_DIR / "manifest.sqlite"
+        self.label = str(path)
+        self.blobs = Manifest(path).load()
+        self.unreadable: List[str] = []
+        self._elf = ElfIndex(str(path.parent / "elf-index.json")).load().blobs
+
+    def close(self):
+        pass
+
+    def size(self, key: Key) -> int:
+        return self.blobs[key].size
+
+    def header(self, key: Key) -> Optional[bytes]:
+        return None
+
+    def digest(self, key: Key) -> str:
+        return self.blobs[key].digest
+
+    def sha1(self, key: Key) -> Optional[str]:
+        return self.blobs[key].sha1
+
+    def elf(self, key: Key) -> Optional[ElfInfo]:
+        return self._elf.get("/".join(key))
+
+
+def open_source(path, matcher):
+    """A manifest file, a generated tree, or a directory of images."""
+    path = Path(path)
+    if path.is_file() or (path / STATE_DIR / "manifest.sqlite").exists():
+        return ManifestSource(path)
+    return ImageSource(path, matcher)
+
+
+def _compare(old, new, key: Key) -> Optional[str]:
+    """Why ``key`` differs between the two sides, or None if it does not.
+
+    Cheap checks run first: sizes, then the first block of each file, and
+    only then full digests.
+    """
+    if old.size(key) != new.size(key):
+        return "size"
+    old_header, new_header = old.header(key), new.header(key)
+    if old_header is not None and new_header is not None and old_header != new_header:
+        return "header"
+    if old.digest(key) != new.digest(key):
+        return "content"
+    return None
+
+
+def _elf_fields(info: Optional[ElfInfo]) -> dict:
+    if info is None:
+        return {}
+    return {"soname": info.soname, "machine": info.machine}
+
+
+def diff_sources(old, new, jobs: Optional[int] = None) -> dict:
+    """Build a changelog of added, removed and modified blobs.
+
+    Partitions either side could not read are listed under ``incomplete``
+    and left out of the comparison, as are blobs whose contents failed to
+    decode, which are listed under ``unreadable``.
+    """
+    incomplete = sorted(set(old.unreadable) | set(new.unreadable))
+    added = [key for key in new.blobs if key not in old.blobs and key[0] not in incomplete]
+    removed = [key for key in old.blobs if key not in new.blobs and key[0] not in incomplete]
+    common = [key for key in new.blobs if key in old.blobs and key[0] not in incomplete]
+    failed = set()
+
+    def guarded(read):
+        def call(key):
+            try:
+                return read(key)
+            except READ_ERRORS as e:
+                logging.error(f"Cannot read {'/'.join(key)}: {e}")
+                failed.add(key)
+                return None
+        return call
+
+    workers = max(1, jobs or os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="diff") as pool:
+        reasons = list(pool.map(guarded(lambda key: _compare(old, new, key)), common))
+        modified = [(key, reason) for key, reason in zip(common, reasons) if reason]
+        old_elf = dict(zip(removed, pool.map(guarded(old.elf), removed)))
+        new_elf = dict(zip(added, pool.map(guarded(new.elf), added)))
+        changed = [key for key, _ in modified]
+        modified_elf = list(
+            zip(changed, pool.map(guarded(old.elf), changed), pool.map(guarded(new.elf), changed))
+        )
+
+    added = [key for key in added if key not in failed]
+    removed = [key for key in removed if key not in failed]
+    common = [key for key in common if key not in failed]
+    modified_elf = [item for item in modified_elf if item[0] not in failed]
+    modified = [item for item in modified if item[0] not in failed]
+
+    soname_changes = []
+    modified_entries = []
+    for (key, reason), (_, before, after) in zip(modified, modified_elf):
+        path = "/".join(key)
+        modified_entries.append({
+            "path": path,
+            "reason": reason,
+            "old_size": old.size(key),
+            "new_size": new.size(key),
+        })
+        old_soname = before.soname if before else None
+        new_soname = after.soname if after else None
+        if old_soname != new_soname:
+            soname_changes.append({"path": path, "old": old_soname, "new": new_soname})
+
+    return {
+        "old": old.label,
+        "new": new.label,
+        "summary": {
+            "added": len(added),
+            "removed": len(removed),
+            "modified": len(modified),
+            "unchanged": len(common) - len(modified),
+        },
+        "added": [
+            {"path": "/".join(key), "size": new.size(key), **_elf_fields(new_elf[key])}
+            for key in sorted(added)
+        ],
+        "removed": [
+            {"path": "/".join(key), "size": old.size(key), **_elf_fields(old_elf[key])}
+            for key in sorted(removed)
+        ],
+        "modified": sorted(modified_entries, key=lambda entry: entry["path"]),
+        "soname_changes": sorted(soname_changes, key=lambda entry: entry["path"]),
+        "incomplete": incomplete,
+        "unreadable": sorted("/".join(key) for key in failed),
+    }
+
+
+def render_proprietary_files(source):
+    """Yield ``proprietary-files.txt`` lines for the blobs of ``source``.
+
+    Entries are pinned as ``path|sha1`` where the source recorded a pin.
+    """
+    for key in source.blobs:
+        path = "/".join(key)
+        sha1 = source.sha1(key)
+        yield f"{path}|{sha1}\n" if sha1 else path + "\n"
@@ -1,68 +1,625 @@
 #!/usr/bin/env python3
 
 import os
+import json
+import filecmp
 import shutil
+import stat
 import logging
 import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+import profiling
+from blobstore import BlobStore, hash_files, sha1_file
+from catalog import KIND_SYMLINK, BlobCatalog
+from compression import DecompressionError
+from elfindex import ElfIndex
+from filesystem import FilesystemError, make_parent_dirs, open_filesystem
+from image import RawImage, image_exists, image_size, open_image
+from manifest import Manifest, ManifestEntry, link_digest, stamp_of
+from materialize import Materializer
+from patterns import PatternMatcher
+from scanner import scan_partitions
+from templates import VendorTreeTemplates, install_path
+from tools import find_tool, run_tool
+
+STATE_DIR = ".vendor_tree"
+
+PARTITION_IMAGES = [
+    "vendor.img",
+    "system.img",
+    "product.img",
+    "odm.img",
+    "system_ext.img",
+    "vendor_dlkm.img",
+]
+
+
+def find_partition_images(image_dir) -> list:
+    """Partition images from ``PARTITION_IMAGES`` present in ``image_dir``.
+
+    An image that only exists as ``<name>.img.part_*`` files, compressed
+    (``<name>.img.gz``, ``.xz``, ``.lz4``, ``.zst``) or inside a ``.tar.md5``
+    bundle is returned under its plain name; ``open_image`` reads it in place.
+    """
+    image_dir = Path(image_dir)
+    return [image_dir / img for img in PARTITION_IMAGES if image_exists(image_dir / img)]
+
+
+def write_if_changed(path: Path, chunks) -> bool:
+    """Stream ``chunks`` (a string or iterable of strings) to ``path``.
+
+    Output goes to a buffered temporary file in the same directory which
+    is atomically renamed over ``path``, so readers never see a partial
+    file. If the result is identical to what ``path`` already holds the
+    old file is kept with its timestamp, so downstream builds do not see
+    spurious changes. Returns True if the file was replaced.
+    """
+    if isinstance(chunks, str):
+        chunks = (chunks,)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with open(fd, "w", encoding="utf-8", buffering=1 << 16) as f:
+            f.writelines(chunks)
+        if path.exists() and filecmp.cmp(tmp_path, path, shallow=False):
+            return False
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+        return True
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _same_contents(fs, entry, path) -> bool:
+    """Whether ``path`` already holds exactly the bytes of image file ``entry``."""
+    with open(path, "rb") as f:
+        for chunk in fs.iter_content(entry):
+            if f.read(len(chunk)) != chunk:
+                return False
+        return not f.read(1)
+
 
 class VendorTreeGenerator:
-    def __init__(self, vendor_name, device_name, android_version="13", verbose=False):
+    def __init__(
+        self,
+        vendor_name,
+        device_name,
+        android_version="13",
+        verbose=False,
+        patterns_path=None,
+        jobs=None,
+        materialize="auto",
+        blob_store=None,
+        blob_store_max_bytes=None,
+        pin_sha1=False,
+        work_dir="extracted",
+        dedup=False,
+    ):
         self.vendor = vendor_name
         self.device = device_name
         self.android_version = android_version
         self.verbose = verbose
-        self.extract_dir = Path("extracted")
-        self.proprietary_files = []
+        self.jobs = jobs
+        self.materializer = Materializer(materialize, jobs)
+        if isinstance(blob_store, BlobStore) or blob_store is None:
+            self.blob_store = blob_store
+        else:
+            self.blob_store = BlobStore(blob_store, blob_store_max_bytes)
+        self.pin_sha1 = pin_sha1
+        self.dedup = dedup
+        self.extract_dir = Path(work_dir)
+        self.source_roots = {}
+        self.dedup_links = {}
+        self.catalog = BlobCatalog()
+        self.elf_index = None
+        self.matcher = PatternMatcher.from_file(patterns_path)
 
     def extract_image(self, image_path: Path):
         name = image_path.stem
         out_dir = self.extract_dir / name
         out_dir.mkdir(parents=True, exist_ok=True)
 
-        simg2img_path = shutil.which("simg2img") or "/usr/bin/simg2img"
-        debugfs_path = shutil.which("debugfs") or "/usr/bin/debugfs"
-        use_raw_img = out_dir / f"{name}.raw.img"
-
         logging.info(f"Extracting image: {image_path.name}")
+        with profiling.stage("extract", partition=name) as span:
+            if profiling.get_profiler() is not None:
+                # Sizing split or bundled images globs parts or scans a tar.
+                span.count(size=image_size(image_path))
+            success = self._extract_in_process(image_path, out_dir) or self._extract_with_tools(
+                image_path, out_dir
+            )
+
+        logging.debug(f"Extracted contents to: {out_dir}")
+        return success
+
+    def extract_images(self, image_paths, jobs=None):
+        """Extract several partition images concurrently.
+
+        Each image runs in its own worker so one failing partition does not
+        abort the others. Returns ``{partition: success}`` in the order of
+        ``image_paths`` regardless of completion order.
+        """
+        image_paths = [Path(p) for p in image_paths]
+        if not image_paths:
+            return {}
+        jobs = max(1, min(jobs or self.jobs or os.cpu_count() or 1, len(image_paths)))
+
+        results = {}
+        with profiling.stage("extract_images", images=len(image_paths)), ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="extract"
+        ) as pool:
+            futures = {path.stem: pool.submit(self.extract_image, path) for path in image_paths}
+            for name, future in futures.items():
+                try:
+                    results[name] = bool(future.result())
+                except Exception as e:
+                    logging.error(f"Extraction of {name} failed: {e}")
+                    results[name] = False
+        return results
+
+    def _extract_in_process(self, image_path: Path, out_dir: Path) -> bool:
+        """Read the selected files straight out of an ext4/EROFS image."""
+        name = image_path.stem
         try:
-            subprocess.run([simg2img_path, str(image_path), str(use_raw_img)], check=True)
-            subprocess.run(["sudo", debugfs_path, "-R", f"rdump / {out_dir}", str(use_raw_img)], check=True)
-            logging.info(f"Extracted {name} using simg2img and debugfs")
+            with profiling.stage("extract.read", partition=name) as span:
+                with open_image(image_path) as image:
+                    fs = open_filesystem(image)
+                    count = fs.extract_tree(
+                        str(out_dir),
+                        select=lambda path: self.is_proprietary_file(path, name),
+                        prune=lambda path: not self.matcher.should_descend(path, name),
+                    )
+                span.count(files=count)
+            logging.info(f"Extracted {count} files from {image_path.stem} ({fs.fs_type})")
+            return True
+        except (FilesystemError, DecompressionError) as e:
+            logging.warning(f"In-process reader failed for {image_path.name}: {e}")
+            return False
+
+    def _extract_with_tools(self, image_path: Path, out_dir: Path) -> bool:
+        name = image_path.stem
+        debugfs_path = find_tool("debugfs") or "/usr/bin/debugfs"
+        raw_img = image_path
+
+        try:
+            with open_image(image_path) as image:
+                if not isinstance(image, RawImage):
+                    # debugfs and 7z need a single raw image file.
+                    raw_img = out_dir / f"{name}.raw.img"
+                    with profiling.stage("sparse_decode", partition=name):
+                        image.copy_to(raw_img)
+            with profiling.stage("extract.debugfs", partition=name):
+                listing = run_tool(
+                    ["sudo", debugfs_path, "-R", "ls -p /", raw_img], check=True
+                ).stdout
+                script = "".join(
+                    f'rdump "/{entry}" "{out_dir}"\n'
+                    for entry in self._debugfs_selection(listing, name)
+                )
+                run_tool(["sudo", debugfs_path, "-f", "-", raw_img], input=script, check=True)
+            logging.info(f"Extracted {name} using debugfs")
+            return True
         except Exception as e:
-            logging.warning(f"simg2img or debugfs failed for {image_path.name}: {e}")
+            logging.warning(f"Sparse decode or debugfs failed for {image_path.name}: {e}")
             try:
-                subprocess.run(["7z", "x", str(image_path), f"-o{out_dir}"], check=True)
+                with profiling.stage("extract.7z", partition=name):
+                    run_tool(
+                        ["7z", "x", "-bsp2", raw_img, f"-o{out_dir}"],
+                        capture_output=False,
+                        check=True,
+                    )
                 logging.info(f"Extracted to {out_dir}")
-            except subprocess.CalledProcessError as e:
+                return True
+            except (OSError, subprocess.CalledProcessError) as e:
                 logging.error(f"[7z] Failed to extract {image_path.name}: {e}")
+                return False
+        finally:
+            if raw_img != image_path and raw_img.exists():
+                raw_img.unlink()
 
-        logging.debug(f"Extracted contents to: {out_dir}")
+    def _debugfs_selection(self, listing: str, partition: str):
+        """Top-level names from ``debugfs ls -p`` worth dumping.
+
+        Directories the patterns cannot reach and non-matching files are
+        left in the image instead of being dumped and thrown away later.
+        """
+        for line in listing.splitlines():
+            fields = line.split("/")
+            if len(fields) < 7 or fields[5] in (".", ".."):
+                continue
+            mode, entry = int(fields[2], 8), fields[5]
+            if stat.S_ISDIR(mode):
+                if self.matcher.should_descend(entry, partition):
+                    yield entry
+            elif self.is_proprietary_file(entry, partition):
+                yield entry
+
+    def stream_image(self, image_path: Path, dest_dir: Path):
+        """Walk an image once, writing only matching files to ``dest_dir``.
+
+        Returns ``(partition, rel_path, size, mode)`` per match, sorted by
+        path. Files already in ``dest_dir`` with the same size, mtime and
+        contents are left untouched (images are built with fixed timestamps,
+        so size and mtime alone do not show a change); links left by
+        ``--dedup`` are replaced by the file again.
+        Raises ``FilesystemError`` or ``DecompressionError`` when the image
+        cannot be read in process.
+        """
+        name = image_path.stem
+        found = []
+        written = 0
+        with profiling.stage("extract.stream", partition=name) as span:
+            with open_image(image_path) as image:
+                fs = open_filesystem(image)
+                prune = lambda path: not self.matcher.should_descend(path, name)  # noqa: E731
+                for entry in fs.walk(prune=prune):
+                    if entry.is_dir or not (entry.is_file or entry.is_symlink):
+                        continue
+                    if not self.is_proprietary_file(entry.path, name):
+                        continue
+                    found.append((name, entry.path, entry.size, entry.mode))
+                    make_parent_dirs(str(dest_dir), entry.path)
+                    dst = dest_dir / entry.path
+                    try:
+                        st = os.lstat(dst)
+                    except FileNotFoundError:
+                        st = None
+                    if (
+                        st is not None
+                        and entry.is_file
+                        and stat.S_ISREG(st.st_mode)
+                        and st.st_size == entry.size
+                        and int(st.st_mtime) == int(entry.mtime)
+                        and _same_contents(fs, entry, dst)
+                    ):
+                        continue
+                    if st is not None:
+                        # Never write through a link shared with a store or staging copy.
+                        os.unlink(dst)
+                    fs.extract(entry, str(dst))
+                    written += 1
+            span.count(files=len(found), written=written)
+        logging.info(
+            f"Streamed {name} ({fs.fs_type}): {len(found)} matching files, {written} written"
+        )
+        # Same order as scan_partitions, whatever order the image lists directories in.
+        found.sort(key=lambda match: match[1])
+        return found
+
+    def stream_images(self, image_paths, output_dir: Path, jobs=None):
+        """Select blobs straight from the images into ``output/proprietary/<partition>``.
+
+        Images the in-process reader cannot handle are extracted into the
+        work directory with the external tools and scanned as before.
+        Fills ``catalog`` and returns ``{partition: success}``.
+        """
+        image_paths = [Path(p) for p in image_paths]
+        proprietary_dir = output_dir / "proprietary"
+        self.catalog = BlobCatalog()
+        self.source_roots = {}
+        if not image_paths:
+            return {}
+        jobs = max(1, min(jobs or self.jobs or os.cpu_count() or 1, len(image_paths)))
+
+        def stream(image_path):
+            try:
+                return self.stream_image(image_path, proprietary_dir / image_path.stem)
+            except (FilesystemError, DecompressionError) as e:
+                logging.warning(f"In-process reader failed for {image_path.name}: {e}")
+            out_dir = self.extract_dir / image_path.stem
+            shutil.rmtree(out_dir, ignore_errors=True)
+            out_dir.mkdir(parents=True)
+            return None if self._extract_with_tools(image_path, out_dir) else False
+
+        results, found, staged = {}, {}, []
+        with profiling.stage("extract_images", images=len(image_paths)), ThreadPoolExecutor(
+            max_workers=jobs, thread_name_prefix="extract"
+        ) as pool:
+            futures = {path.stem: pool.submit(stream, path) for path in image_paths}
+            for name, future in futures.items():
+                try:
+                    files = future.result()
+                except Exception as e:
+                    logging.error(f"Extraction of {name} failed: {e}")
+                    files = False
+                results[name] = files is not False
+                if files is None:
+                    staged.append(name)
+                elif files:
+                    found[name] = files
+                    self.source_roots[name] = proprietary_dir / name
+
+        if staged:
+            with profiling.stage("scan") as span:
+                for entry in scan_partitions(
+                    self.extract_dir, self.matcher, jobs=self.jobs, partitions=staged
+                ):
+                    found.setdefault(entry.partition, []).append(
+                        (entry.partition, entry.rel_path, entry.size, 0)
+                    )
+                span.count(partitions=len(staged))
+        for name in sorted(found):
+            for match in found[name]:
+                self.catalog.add(*match)
+        return results
 
     def scan_proprietary_files(self):
-        for partition in self.extract_dir.iterdir():
-            for root, _, files in os.walk(partition):
-                for file in files:
-                    rel_path = os.path.relpath(os.path.join(root, file), partition)
-                    if self.is_proprietary_file(rel_path):
-                        self.proprietary_files.append((partition.name, rel_path))
-                        logging.debug(f"Found proprietary file: {partition.name}/{rel_path}")
-
-    def is_proprietary_file(self, rel_path):
-        skip_paths = ["META-INF", "resources.arsc", "AndroidManifest.xml", "NOTICE.html.gz"]
-        return not any(part in rel_path for part in skip_paths)
+        self.catalog = BlobCatalog()
+        with profiling.stage("scan") as span:
+            for entry in scan_partitions(self.extract_dir, self.matcher, jobs=self.jobs):
+                self.catalog.add(entry.partition, entry.rel_path, entry.size)
+                logging.debug(f"Found proprietary file: {entry.partition}/{entry.rel_path}")
+            span.count(files=len(self.catalog))
+
+    def is_proprietary_file(self, rel_path, partition=None):
+        return self.matcher.matches(rel_path, partition)
+
+    def source_path(self, partition: str, rel_path: str) -> Path:
+        """Where a selected blob is read from: staged or already in the output.
+
+        Duplicates linked by ``--dedup`` are read from their canonical copy.
+        """
+        canonical = self.dedup_links.get((partition, rel_path))
+        if canonical is not None:
+            return self.source_path(*canonical)
+        root = self.source_roots.get(partition)
+        if root is None:
+            return self.extract_dir / partition / rel_path
+        return root / rel_path
+
+    def _manifest_entries(self, previous):
+        """Stamp and digest the selected sources.
+
+        Files whose stamp matches ``previous`` keep their recorded digest;
+        the rest are hashed (or ingested into the blob store) in parallel.
+        """
+        entries = {}
+        stale = []
+        for row, key in enumerate(self.catalog):
+            partition, rel_path = key
+            src = self.source_path(partition, rel_path)
+            try:
+                st = os.lstat(src)
+            except OSError as e:
+                logging.warning(f"Cannot stat {src}: {e}")
+                continue
+            self.catalog.set_stat(row, st.st_size, st.st_mode)
+            digest = None
+            if stat.S_ISLNK(st.st_mode):
+                self.catalog.set_kind(row, KIND_SYMLINK)
+                digest = link_digest(os.readlink(src))
+            elif key in previous and tuple(previous[key][2:6]) == stamp_of(st):
+                digest = previous[key].digest
+            else:
+                stale.append((key, str(src)))
+            entries[key] = ManifestEntry(partition, rel_path, *stamp_of(st), digest)
+
+        with profiling.stage("hash", blob_store=self.blob_store is not None) as span:
+            if self.blob_store is not None:
+                stored = self.blob_store.add_many(
+                    [(partition, rel_path, src) for (partition, rel_path), src in stale],
+                    jobs=self.jobs,
+                )
+                digests = [result[0] if result else None for result in stored]
+            else:
+                digests = hash_files([src for _, src in stale], jobs=self.jobs)
+            span.count(files=len(stale), reused=len(entries) - len(stale))
+
+        for (key, _), digest in zip(stale, digests):
+            if digest is None:
+                del entries[key]
+            else:
+                entries[key] = entries[key]._replace(digest=digest)
+        return entries
+
+    def _pin_entries(self, previous, current):
+        """Fill in SHA-1 pins, reusing ones recorded for identical content."""
+        stale = []
+        for key, entry in current.items():
+            if entry.digest.startswith("link:"):
+                continue
+            old = previous.get(key)
+            if old is not None and old.sha1 and old.digest == entry.digest:
+                current[key] = entry._replace(sha1=old.sha1)
+            else:
+                stale.append(key)
+
+        paths = [str(self.source_path(partition, rel_path)) for partition, rel_path in stale]
+        with profiling.stage("pin") as span:
+            for key, sha1 in zip(stale, hash_files(paths, jobs=self.jobs, hasher=sha1_file)):
+                current[key] = current[key]._replace(sha1=sha1)
+            span.count(files=len(stale))
+        logging.info(f"Pinned {len(stale)} blobs, {len(current) - len(stale)} reused or unpinned")
+
+    def _remove_output(self, path: Path, root: Path):
+        path.unlink()
+        parent = path.parent
+        while parent != root and parent.is_dir() and not any(parent.iterdir()):
+            parent.rmdir()
+            parent = parent.parent
+
+    def _migrate_layout(self, proprietary_dir: Path, previous, current):
+        """Remove blobs a tree written before the per-partition layout left behind.
+
+        Older runs flattened every partition into ``proprietary/<rel_path>``.
+        Paths that are also a current ``<partition>/<rel_path>`` are kept.
+        """
+        wanted = {os.path.join(partition, rel_path) for partition, rel_path in current}
+        removed = 0
+        for _, rel_path in previous:
+            dst = proprietary_dir / rel_path
+            if rel_path not in wanted and os.path.lexists(dst) and not dst.is_dir():
+                self._remove_output(dst, proprietary_dir)
+                removed += 1
+        if removed:
+            logging.info(f"Removed {removed} blobs of the old flat proprietary/ layout")
+
+    def _duplicate_groups(self, current):
+        """Group regular blobs by digest; returns ``{digest: [key, ...]}``.
+
+        Only digests shared by two or more non-empty files are kept. Keys
+        are sorted, so the first one (the canonical copy) is stable across
+        runs.
+        """
+        groups = {}
+        for key in sorted(current):
+            entry = current[key]
+            if entry.size and not entry.digest.startswith("link:"):
+                groups.setdefault(entry.digest, []).append(key)
+        return {digest: keys for digest, keys in groups.items() if len(keys) > 1}
+
+    def _write_dedup_report(self, output_dir: Path, groups, current):
+        """Write ``dedup-report.json`` and log how much linking saves."""
+        duplicates, by_partition = [], {}
+        for digest, keys in groups.items():
+            size = current[keys[0]].size
+            for partition, _ in keys[1:]:
+                by_partition[partition] = by_partition.get(partition, 0) + size
+            duplicates.append({
+                "digest": digest,
+                "size": size,
+                "path": "/".join(keys[0]),
+                "copies": ["/".join(key) for key in keys[1:]],
+            })
+        duplicates.sort(key=lambda group: (-group["size"] * len(group["copies"]), group["path"]))
+        blobs = [entry for entry in current.values() if not entry.digest.startswith("link:")]
+        saved = sum(by_partition.values())
+        report = {
+            "linked": self.dedup,
+            "blobs": len(blobs),
+            "bytes": sum(entry.size for entry in blobs),
+            "duplicates": sum(len(group["copies"]) for group in duplicates),
+            "bytes_saved": saved,
+            "bytes_saved_by_partition": by_partition,
+            "groups": duplicates,
+        }
+        report_path = self.state_path(output_dir, "dedup-report.json")
+        write_if_changed(report_path, json.dumps(report, indent=2, sort_keys=True))
+        if not duplicates:
+            return
+        if self.dedup:
+            logging.info(
+                f"Linked {report['duplicates']} duplicate blobs to identical copies, "
+                f"saving {saved} bytes (see {report_path})"
+            )
+        else:
+            logging.info(
+                f"{report['duplicates']} blobs duplicate others ({saved} bytes); "
+                f"--dedup would link them (see {report_path})"
+            )
+
+    def _link_duplicates(self, links):
+        """Point each ``(target, dst)`` symlink at its canonical copy."""
+        for parent in sorted({os.path.dirname(dst) for _, dst in links}):
+            os.makedirs(parent, exist_ok=True)
+        for target, dst in links:
+            if os.path.lexists(dst):
+                # Never write through a link shared with a store or staging copy.
+                os.unlink(dst)
+            os.symlink(target, dst)
 
     def copy_proprietary_files(self, output_dir: Path):
-        for partition, rel_path in self.proprietary_files:
-            src = self.extract_dir / partition / rel_path
-            dst = output_dir / "proprietary" / rel_path
-            dst.parent.mkdir(parents=True, exist_ok=True)
-            shutil.copy2(src, dst)
+        """Bring ``output/proprietary`` in line with the selected blobs.
+
+        Blobs are placed at ``proprietary/<partition>/<rel_path>``, so
+        same-named files of different partitions no longer overwrite each
+        other. The previous run's manifest is diffed against the current
+        sources, so only added or changed blobs (and ones missing from the
+        output) are materialized and only removed ones are deleted.
+
+        Blobs with identical content are listed in ``dedup-report.json``;
+        with ``dedup`` only the first copy is stored and the others become
+        relative symlinks to it.
+        """
+        self.dedup_links = {}
+        manifest = Manifest(self.state_path(output_dir, "manifest.sqlite"))
+        previous = manifest.load()
+        current = self._manifest_entries(previous)
+        if self.pin_sha1:
+            self._pin_entries(previous, current)
+        diff = Manifest.diff(previous, current)
+        logging.info(
+            f"Blobs: {len(diff.added)} added, {len(diff.removed)} removed, "
+            f"{len(diff.changed)} changed, {len(diff.unchanged)} unchanged"
+        )
+
+        proprietary_dir = output_dir / "proprietary"
+        layout = self.state_path(output_dir, "layout")
+        if previous and not layout.exists():
+            self._migrate_layout(proprietary_dir, previous, current)
+        write_if_changed(layout, "partition\n")
+        for partition, rel_path in diff.removed:
+            dst = proprietary_dir / partition / rel_path
+            if os.path.lexists(dst):
+                self._remove_output(dst, proprietary_dir)
+
+        groups = self._duplicate_groups(current)
+        if self.dedup:
+            for keys in groups.values():
+                for key in keys[1:]:
+                    self.dedup_links[key] = keys[0]
+
+        def is_current(key):
+            dst = proprietary_dir / key[0] / key[1]
+            if not os.path.lexists(dst):
+                return False
+            # A link left by an earlier --dedup run where a file belongs now.
+            return dst.is_symlink() == current[key].digest.startswith("link:")
+
+        todo = diff.added + diff.changed + [key for key in diff.unchanged if not is_current(key)]
+        # Streamed partitions were written straight into the output.
+        todo = [
+            key for key in todo
+            if key[0] not in self.source_roots and key not in self.dedup_links
+        ]
+        pairs = []
+        for key in todo:
+            partition, rel_path = key
+            src = str(self.source_path(partition, rel_path))
+            if self.blob_store is not None and not current[key].digest.startswith("link:"):
+                # Link out of the store so identical files share one object.
+                obj = self.blob_store.object_path(current[key].digest)
+                if os.path.exists(obj):
+                    src = obj
+            pairs.append((src, str(proprietary_dir / partition / rel_path)))
+
+        links = []
+        for key, canonical in sorted(self.dedup_links.items()):
+            dst = proprietary_dir / key[0] / key[1]
+            target = os.path.relpath(proprietary_dir / canonical[0] / canonical[1], dst.parent)
+            if not (dst.is_symlink() and os.readlink(dst) == target):
+                links.append((target, str(dst)))
+
+        with profiling.stage("materialize", mode=self.materializer.mode) as span:
+            used = self.materializer.materialize_many(pairs)
+            self._link_duplicates(links)
+            if links:
+                used["dedup"] = len(links)
+            span.count(
+                files=len(pairs) + len(links),
+                bytes=sum(current[key].size for key in todo),
+                **used,
+            )
+        summary = ", ".join(f"{count} {mode}" for mode, count in sorted(used.items()))
+        logging.info(f"Materialized {len(pairs) + len(links)} files ({summary or 'none'})")
+        self._write_dedup_report(output_dir, groups, current)
+
+        for row, key in enumerate(self.catalog):
+            entry = current.get(key)
+            if entry is not None:
+                self.catalog.set_digest(row, entry.digest, entry.sha1)
+        manifest.save(current)
+        if self.blob_store is not None:
+            self.blob_store.touch(
+                {entry.digest for entry in current.values() if not entry.digest.startswith("link:")}
+            )
+            self.blob_store.evict()
 
     def write_android_mk(self, output_dir: Path):
         mk_path = output_dir / "Android.mk"
-        mk_path.write_text(f"""
+        return write_if_changed(mk_path, f"""
 LOCAL_PATH := $(call my-dir)
 
 include $(CLEAR_VARS)
@@ -72,68 +629,149 @@ LOCAL_SRC_FILES := proprietary-files.txt
 include $(BUILD_PREBUILT)
 """.strip())
 
-    def write_android_bp(self, output_dir: Path):
-        bp_path = output_dir / "Android.bp"
-        bp_path.write_text(f"""
+    def state_path(self, output_dir: Path, name: str) -> Path:
+        """Path of a generator state file kept next to the output tree."""
+        state_dir = output_dir / STATE_DIR
+        if not state_dir.exists():
+            state_dir.mkdir(parents=True, exist_ok=True)
+            (state_dir / ".gitignore").write_text("*\n")
+        return state_dir / name
+
+    def build_elf_index(self, output_dir: Path):
+        files, digests = {}, {}
+        for row, (partition, rel_path) in enumerate(self.catalog):
+            src = self.source_path(partition, rel_path)
+            if src.is_symlink():
+                self.catalog.set_kind(row, KIND_SYMLINK)
+            else:
+                key = self.catalog.key(row)
+                files[key] = str(src)
+                if self.catalog.digest[row]:
+                    digests[key] = self.catalog.digest[row]
+
+        self.elf_index = ElfIndex(str(self.state_path(output_dir, "elf-index.json")))
+        with profiling.stage("classify") as span:
+            self.elf_index.build(files, jobs=self.jobs, digests=digests)
+            span.count(files=len(files), elf=len(self.elf_index.blobs))
+        for row in range(len(self.catalog)):
+            key = self.catalog.key(row)
+            if key in files:
+                info = self.elf_index.blobs.get(key)
+                shared_libs = self.elf_index.shared_libs(key) if info is not None else ()
+                self.catalog.set_elf(row, info, shared_libs)
+
+        missing = self.elf_index.missing_report()
+        report_path = self.state_path(output_dir, "missing-dependencies.json")
+        write_if_changed(report_path, json.dumps(missing, indent=2, sort_keys=True))
+        if missing:
+            logging.warning(
+                f"{len(missing)} blobs have unresolved dependencies, see {report_path}"
+            )
+
+    def render_android_bp(self):
+        templates = VendorTreeTemplates(self.vendor, self.device, self.android_version)
+
+        yield f"""
 prebuilt_etc {{
     name: "{self.device}-vendor",
     src: "proprietary-files.txt",
     sub_dir: "vendor/{self.vendor}/{self.device}",
     installable: false,
 }}
-""".strip())
+""".strip()
+        if self.elf_index is not None and self.elf_index.blobs:
+            yield "\n"
+            yield from templates.render_prebuilt_modules(self.catalog)
+
+    def write_android_bp(self, output_dir: Path):
+        return write_if_changed(output_dir / "Android.bp", self.render_android_bp())
 
     def write_boardconfig(self, output_dir: Path):
         path = output_dir / "BoardConfig.mk"
-        path.write_text(f"# BoardConfig for {self.vendor}/{self.device}")
+        return write_if_changed(path, f"# BoardConfig for {self.vendor}/{self.device}")
 
-    def write_device_mk(self, output_dir: Path):
-        path = output_dir / f"{self.device}-vendor.mk"
-        content = f"""
-# Auto-generated vendor makefile
+    def render_device_mk(self):
+        yield "# Auto-generated vendor makefile\n\nPRODUCT_COPY_FILES += \\"
+        for partition, rel_path in self.catalog:
+            yield (
+                f"\n    vendor/{self.vendor}/{self.device}/proprietary/{partition}/{rel_path}"
+                f":{install_path(partition, rel_path)} \\"
+            )
 
-PRODUCT_COPY_FILES += \\
-"""
-        for _, rel_path in self.proprietary_files:
-            line = f"    vendor/{self.vendor}/{self.device}/proprietary/{rel_path}:{rel_path} \\\n"
-            content += line
+    def write_device_mk(self, output_dir: Path):
+        return write_if_changed(output_dir / f"{self.device}-vendor.mk", self.render_device_mk())
 
-        path.write_text(content.strip())
+    def render_proprietary_files_txt(self):
+        catalog = self.catalog
+        for row in range(len(catalog)):
+            path = catalog.key(row)
+            sha1 = catalog.sha1[row] if self.pin_sha1 else None
+            yield f"{path}|{sha1}\n" if sha1 else path + "\n"
 
     def write_proprietary_files_txt(self, output_dir: Path):
         path = output_dir / "proprietary-files.txt"
-        with path.open("w") as f:
-            for _, rel_path in self.proprietary_files:
-                f.write(rel_path + "\n")
+        return write_if_changed(path, self.render_proprietary_files_txt())
 
     def generate_tree(self, extracted_path: str, output_path: str):
-        self.extract_dir = Path(extracted_path)
-        output_dir = Path(output_path)
+        with profiling.stage("generate_tree", device=self.device):
+            self.extract_dir = Path(extracted_path)
+            output_dir = Path(output_path)
 
-        logging.info(f"Created directory structure in {output_dir}")
-        output_dir.mkdir(parents=True, exist_ok=True)
+            logging.info(f"Created directory structure in {output_dir}")
+            output_dir.mkdir(parents=True, exist_ok=True)
 
-        logging.info("Scanning for proprietary files...")
-        self.scan_proprietary_files()
-        logging.info(f"Found {len(self.proprietary_files)} proprietary files")
+            logging.info("Scanning for proprietary files...")
+            self.source_roots = {}
+            self.scan_proprietary_files()
+            logging.info(f"Found {len(self.catalog)} proprietary files")
 
-        logging.info("Copying proprietary files...")
-        self.copy_proprietary_files(output_dir)
+            return self._write_tree(output_dir)
 
-        self.write_android_mk(output_dir)
-        logging.info("Generated Android.mk")
+    def generate_tree_from_images(self, image_paths, output_path: str):
+        """Generate the tree in one pass over the images, without staging.
 
-        self.write_android_bp(output_dir)
-        logging.info("Generated Android.bp")
+        Matching files are streamed from each image into
+        ``output/proprietary/<partition>`` while the image is walked; only images the
+        in-process reader cannot handle are extracted into the work
+        directory.
+        """
+        with profiling.stage("generate_tree", device=self.device):
+            output_dir = Path(output_path)
+            output_dir.mkdir(parents=True, exist_ok=True)
 
-        self.write_boardconfig(output_dir)
-        logging.info("Generated BoardConfig.mk")
+            logging.info("Streaming proprietary files from images...")
+            results = self.stream_images(image_paths, output_dir)
+            failed = [name for name, ok in results.items() if not ok]
+            if failed:
+                logging.warning(f"Failed to extract: {', '.join(failed)}")
+            logging.info(f"Found {len(self.catalog)} proprietary files")
+
+            return self._write_tree(output_dir)
+
+    def _write_tree(self, output_dir: Path):
+        logging.info("Copying proprietary files...")
+        self.copy_proprietary_files(output_dir)
 
-        self.write_device_mk(output_dir)
-        logging.info(f"Generated {self.device}-vendor.mk")
+        logging.info("Indexing ELF dependencies...")
+        self.build_elf_index(output_dir)
+        logging.info(f"Indexed {len(self.elf_index.blobs)} ELF files")
 
-        self.write_proprietary_files_txt(output_dir)
-        logging.info(f"Generated proprietary-files.txt with {len(self.proprietary_files)} files")
+        outputs = [
+            ("Android.mk", self.write_android_mk),
+            ("Android.bp", self.write_android_bp),
+            ("BoardConfig.mk", self.write_boardconfig),
+            (f"{self.device}-vendor.mk", self.write_device_mk),
+            ("proprietary-files.txt", self.write_proprietary_files_txt),
+        ]
+        for name, writer in outputs:
+            with profiling.stage("render", file=name):
+                written = writer(output_dir)
+            if written:
+                logging.info(f"Generated {name}")
+            else:
+                logging.info(f"{name} unchanged")
 
-        logging.info(f"Generated vendor tree with {len(self.proprietary_files)} proprietary files")
+        logging.info(
+            f"Generated vendor tree with {len(self.catalog)} proprietary files"
+        )
         return True
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+
+import bisect
+import errno
+import functools
+import glob
+import io
+import os
+import tarfile
+from typing import Dict, List, Optional, Tuple
+
+from compression import detect_codec
+
+# Compressed copies of ``<name>.img`` that are opened in place, and bundles
+# (Samsung ``AP_*.tar.md5`` and plain tars) searched for ``<name>.img`` members.
+COMPRESSED_SUFFIXES = (".gz", ".xz", ".lz4", ".zst")
+BUNDLE_PATTERNS = ("*.tar.md5", "*.tar")
+
+
+class ImageFile(io.RawIOBase):
+    """Read-only, seekable view over a partition image.
+
+    Subclasses provide ``size`` and ``pread``; sequential ``read``/``seek``
+    are built on top so image objects can be handed to anything that expects
+    a binary file, while filesystem readers can issue positional reads that
+    are safe to share between threads.
+
+    ``cache_key`` names the stored bytes (path and size/mtime stamp) for
+    indexes kept in ``warmcache``; it is None when they cannot be named.
+    """
+
+    size = 0
+    cache_key = None
+
+    def __init__(self):
+        super().__init__()
+        self._pos = 0
+
+    def pread(self, offset: int, length: int) -> bytes:
+        raise NotImplementedError
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._pos
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError(f"Negative seek position: {pos}")
+        self._pos = pos
+        return pos
+
+    def readinto(self, buffer) -> int:
+        data = self.pread(self._pos, len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        return n
+
+    def readall(self) -> bytes:
+        data = self.pread(self._pos, max(self.size - self._pos, 0))
+        self._pos += len(data)
+        return data
+
+    def copy_to(self, dest_path: str, buffer_size: int = 4 << 20):
+        """Write the full decoded image to ``dest_path``."""
+        with open(dest_path, "wb") as out:
+            offset = 0
+            while offset < self.size:
+                data = self.pread(offset, min(buffer_size, self.size - offset))
+                if not data:
+                    break
+                out.write(data)
+                offset += len(data)
+
+
+class RawImage(ImageFile):
+    """Plain (non-sparse) image file read with ``os.pread``."""
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = str(path)
+        self._fd = os.open(self.path, os.O_RDONLY)
+        self.size = os.fstat(self._fd).st_size
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+        chunks = []
+        while length > 0:
+            data = os.pread(self._fd, length, offset)
+            if not data:
+                break
+            chunks.append(data)
+            offset += len(data)
+            length -= len(data)
+        return b"".join(chunks)
+
+    def close(self):
+        if getattr(self, "_fd", -1) >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        super().close()
+
+
+class SplitImage(ImageFile):
+    """Several part files read back to back as one image.
+
+    Large images are often uploaded as ``system.img.part_aa``,
+    ``system.img.part_ab``, ...; this presents them as the original image
+    without concatenating them on disk. Reads are mapped to parts through a
+    sorted index of part start offsets.
+    """
+
+    def __init__(self, parts: List[str], path: str = None):
+        super().__init__()
+        self.path = str(path or parts[0])
+        self._parts = []
+        self._starts = []
+        try:
+            for part in parts:
+                image = RawImage(part)
+                self._starts.append(self.size)
+                self._parts.append(image)
+                self.size += image.size
+        except Exception:
+            self.close()
+            raise
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+        chunks = []
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while length > 0 and index < len(self._parts):
+            data = self._parts[index].pread(offset - self._starts[index], length)
+            chunks.append(data)
+            offset += len(data)
+            length -= len(data)
+            index += 1
+        return b"".join(chunks)
+
+    def close(self):
+        for part in getattr(self, "_parts", ()):
+            part.close()
+        self._parts = []
+        super().close()
+
+
+class SliceImage(ImageFile):
+    """A byte range of another image, such as a member of an uncompressed tar."""
+
+    def __init__(self, source: ImageFile, offset: int, size: int, path: str = None):
+        super().__init__()
+        self.path = str(path or source.path)
+        self.size = size
+        self._source = source
+        self._offset = offset
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+        return self._source.pread(self._offset + offset, length)
+
+    def close(self):
+        if getattr(self, "_source", None) is not None:
+            self._source.close()
+            self._source = None
+        super().close()
+
+
+def split_parts(path) -> List[str]:
+    """The ``<path>.part_*`` files of an image that only exists split, in order."""
+    path = os.fspath(path)
+    if os.path.exists(path):
+        return []
+    return sorted(glob.glob(glob.escape(path) + ".part_*"))
+
+
+def image_partition_name(path) -> str:
+    """Partition held by an image file: ``vendor.img.lz4`` gives ``vendor``."""
+    name = os.path.basename(os.fspath(path))
+    for suffix in COMPRESSED_SUFFIXES + (".ext4", ".img"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def _stamp(paths: List[str]) -> List[int]:
+    stats = [os.stat(path) for path in paths]
+    return [sum(st.st_size for st in stats), max(st.st_mtime_ns for st in stats)]
+
+
+@functools.lru_cache(maxsize=16)
+def _bundle_members(bundle: str, stamp: Tuple[int, int]) -> Dict[str, Tuple[int, int]]:
+    """``{basename: (offset, size)}`` of the regular files in a tar bundle."""
+    try:
+        with tarfile.open(bundle, "r:") as tar:
+            return {
+                os.path.basename(member.name): (member.offset_data, member.size)
+                for member in tar
+                if member.isfile()
+            }
+    except (OSError, tarfile.TarError):
+        return {}
+
+
+def _locate(path) -> Optional[tuple]:
+    """Where an image is stored, as ``(kind, location)``, or None if nowhere.
+
+    ``kind`` is ``file`` (a path, possibly a compressed sibling such as
+    ``vendor.img.lz4``), ``split`` (the part paths) or ``member``
+    (``(bundle, member, offset, size)`` inside a tar bundle).
+    """
+    path = os.fspath(path)
+    if os.path.exists(path):
+        return "file", path
+    parts = split_parts(path)
+    if parts:
+        return "split", parts
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(path + suffix):
+            return "file", path + suffix
+
+    directory, name = os.path.split(path)
+    stem = image_partition_name(name)
+    wanted = [
+        base + suffix
+        for base in (name, f"{stem}.img.ext4")
+        for suffix in ("",) + COMPRESSED_SUFFIXES
+    ]
+    for pattern in BUNDLE_PATTERNS:
+        for bundle in sorted(glob.glob(os.path.join(glob.escape(directory or "."), pattern))):
+            members = _bundle_members(bundle, tuple(_stamp([bundle])))
+            for member in wanted:
+                if member in members:
+                    return "member", (bundle, member) + members[member]
+    return None
+
+
+def image_exists(path) -> bool:
+    return _locate(path) is not None
+
+
+def image_size(path) -> int:
+    """Stored size of an image: its parts added up, or its compressed size."""
+    kind, location = _locate(path) or ("file", path)
+    if kind == "split":
+        return sum(os.path.getsize(part) for part in location)
+    if kind == "member":
+        return location[3]
+    return os.path.getsize(location)
+
+
+def open_raw_image(path) -> ImageFile:
+    """Open an image as it is before sparse decoding.
+
+    Split parts are joined, and a compressed image (the file itself, a
+    ``<path>.gz``/``.xz``/``.lz4``/``.zst`` sibling or a member of a tar
+    bundle next to it) is decompressed through a cached seek index.
+    """
+    location = _locate(path)
+    if location is None:
+        raise FileNotFoundError(errno.ENOENT, "No such image", os.fspath(path))
+    kind, where = location
+    if kind == "split":
+        source, stamp, name = SplitImage(where, path), _stamp(where), os.fspath(path)
+    elif kind == "member":
+        bundle, member, offset, size = where
+        source = SliceImage(RawImage(bundle), offset, size, f"{bundle}/{member}")
+        stamp, name = _stamp([bundle]) + [offset], f"{bundle}.{member}"
+    else:
+        source, stamp, name = RawImage(where), _stamp([where]), where
+    try:
+        codec = detect_codec(source.pread(0, 8))
+        if codec is not None:
+            from compressed import CompressedImage
+
+            source = CompressedImage(source, codec, stamp, name)
+    except Exception:
+        source.close()
+        raise
+    source.cache_key = (os.path.abspath(name), tuple(stamp))
+    return source
+
+
+def open_image(path) -> ImageFile:
+    """Open a partition image, decoding Android sparse images lazily.
+
+    Split images (``<path>.part_*``) and compressed images are read in place
+    as one image.
+    """
+    from sparse import SPARSE_MAGIC_BYTES, SparseImage
+
+    raw = open_raw_image(path)
+    try:
+        if raw.pread(0, 4) == SPARSE_MAGIC_BYTES:
+            return SparseImage(raw)
+    except Exception:
+        raw.close()
+        raise
+    return raw
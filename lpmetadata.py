@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+
+import bisect
+import hashlib
+import mmap
+import struct
+from collections import namedtuple
+
+from image import ImageFile, RawImage, open_image
+
+LP_PARTITION_RESERVED_BYTES = 4096
+LP_METADATA_GEOMETRY_SIZE = 4096
+LP_METADATA_GEOMETRY_MAGIC = 0x616C4467
+LP_METADATA_HEADER_MAGIC = 0x414C5030
+LP_SECTOR_SIZE = 512
+
+LP_TARGET_TYPE_LINEAR = 0
+LP_TARGET_TYPE_ZERO = 1
+
+LP_PARTITION_ATTR_READONLY = 0x1
+LP_PARTITION_ATTR_SLOT_SUFFIXED = 0x2
+LP_PARTITION_ATTR_UPDATED = 0x4
+LP_PARTITION_ATTR_DISABLED = 0x8
+
+_GEOMETRY = struct.Struct("<II32sIII")
+_HEADER_V1_0 = struct.Struct("<IHHI32sI32s12s12s12s12s")
+_TABLE_DESCRIPTOR = struct.Struct("<III")
+_PARTITION = struct.Struct("<36sIIII")
+_EXTENT = struct.Struct("<QIQI")
+_GROUP = struct.Struct("<36sIQ")
+
+SLOT_SUFFIXES = ("_a", "_b")
+
+LpExtent = namedtuple("LpExtent", ["num_sectors", "target_type", "target_data", "target_source"])
+LpPartition = namedtuple("LpPartition", ["name", "attributes", "group", "extents", "size"])
+
+
+class LpMetadataError(ValueError):
+    """Raised when super.img geometry or metadata cannot be parsed."""
+
+
+def _cstring(raw: bytes) -> str:
+    return raw.split(b"\0", 1)[0].decode("ascii", "replace")
+
+
+def base_partition_name(name: str) -> str:
+    """Strip an A/B slot suffix (``system_a`` -> ``system``)."""
+    for suffix in SLOT_SUFFIXES:
+        if name.endswith(suffix):
+            return name[: -len(suffix)]
+    return name
+
+
+class PartitionView(ImageFile):
+    """Offset-bounded view of one logical partition inside super.img.
+
+    Reads are translated through the partition's extent list; LINEAR
+    extents come from the shared super.img mapping and ZERO extents read
+    back as zeroes. Nothing is copied out of super.img up front.
+    """
+
+    def __init__(self, super_image: "SuperImage", partition: LpPartition):
+        super().__init__()
+        self.name = partition.name
+        self.size = partition.size
+        self._super = super_image
+        self._extents = []
+        offset = 0
+        for extent in partition.extents:
+            length = extent.num_sectors * LP_SECTOR_SIZE
+            if extent.target_type == LP_TARGET_TYPE_LINEAR:
+                physical = extent.target_data * LP_SECTOR_SIZE
+            else:
+                physical = None
+            self._extents.append((offset, length, physical))
+            offset += length
+        self._starts = [start for start, _, _ in self._extents]
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+
+        out = []
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while length > 0 and index < len(self._extents):
+            start, extent_len, physical = self._extents[index]
+            skip = offset - start
+            n = min(extent_len - skip, length)
+            if physical is None:
+                out.append(bytes(n))
+            else:
+                out.append(self._super.pread(physical + skip, n))
+            offset += n
+            length -= n
+            index += 1
+        return b"".join(out)
+
+
+class SuperImage:
+    """Parser for the liblp geometry and metadata of a (sparse or raw) super.img."""
+
+    def __init__(self, path, slot: int = 0):
+        self.path = str(path)
+        self._image = open_image(self.path)
+        self._mmap = None
+        try:
+            if isinstance(self._image, RawImage) and self._image.size:
+                self._mmap = mmap.mmap(self._image.fileno(), 0, access=mmap.ACCESS_READ)
+            self._parse(slot)
+        except Exception:
+            self.close()
+            raise
+
+    def pread(self, offset: int, length: int) -> bytes:
+        if self._mmap is not None:
+            return self._mmap[offset:offset + length]
+        return self._image.pread(offset, length)
+
+    def _read_geometry(self):
+        for offset in (
+            LP_PARTITION_RESERVED_BYTES,
+            LP_PARTITION_RESERVED_BYTES + LP_METADATA_GEOMETRY_SIZE,
+        ):
+            raw = self.pread(offset, _GEOMETRY.size)
+            if len(raw) < _GEOMETRY.size:
+                continue
+            magic, struct_size, checksum, max_size, slot_count, block_size = _GEOMETRY.unpack(raw)
+            if magic != LP_METADATA_GEOMETRY_MAGIC or struct_size != _GEOMETRY.size:
+                continue
+            blank = raw[:8] + bytes(32) + raw[40:]
+            if hashlib.sha256(blank).digest() != checksum:
+                continue
+            return max_size, slot_count, block_size
+        raise LpMetadataError(f"{self.path}: no valid LP metadata geometry")
+
+    def _read_metadata(self, offset: int):
+        raw = self.pread(offset, _HEADER_V1_0.size)
+        if len(raw) < _HEADER_V1_0.size:
+            return None
+        (
+            magic,
+            major,
+            _minor,
+            header_size,
+            header_checksum,
+            tables_size,
+            tables_checksum,
+            partitions,
+            extents,
+            groups,
+            _block_devices,
+        ) = _HEADER_V1_0.unpack(raw)
+        if magic != LP_METADATA_HEADER_MAGIC or major != 10:
+            return None
+
+        header = self.pread(offset, header_size)
+        blank = header[:12] + bytes(32) + header[44:]
+        if hashlib.sha256(blank).digest() != header_checksum:
+            return None
+        tables = self.pread(offset + header_size, tables_size)
+        if hashlib.sha256(tables).digest() != tables_checksum:
+            return None
+
+        def table(descriptor, entry):
+            table_offset, count, entry_size = _TABLE_DESCRIPTOR.unpack(descriptor)
+            if entry_size < entry.size:
+                raise LpMetadataError(f"{self.path}: LP table entries too small")
+            return [
+                entry.unpack_from(tables, table_offset + i * entry_size)
+                for i in range(count)
+            ]
+
+        return table(partitions, _PARTITION), table(extents, _EXTENT), table(groups, _GROUP)
+
+    def _parse(self, slot: int):
+        max_size, slot_count, self.logical_block_size = self._read_geometry()
+        if slot >= slot_count:
+            raise LpMetadataError(f"{self.path}: metadata slot {slot} out of range")
+
+        primary = (
+            LP_PARTITION_RESERVED_BYTES + 2 * LP_METADATA_GEOMETRY_SIZE + slot * max_size
+        )
+        backup = primary + slot_count * max_size
+        metadata = self._read_metadata(primary) or self._read_metadata(backup)
+        if metadata is None:
+            raise LpMetadataError(f"{self.path}: no valid LP metadata in slot {slot}")
+
+        partition_rows, extent_rows, group_rows = metadata
+        extents = [LpExtent(*row) for row in extent_rows]
+        group_names = [_cstring(row[0]) for row in group_rows]
+
+        self.partitions = []
+        for name, attributes, first_extent, num_extents, group_index in partition_rows:
+            part_extents = extents[first_extent:first_extent + num_extents]
+            for extent in part_extents:
+                if extent.target_type == LP_TARGET_TYPE_LINEAR and extent.target_source != 0:
+                    raise LpMetadataError(
+                        f"{self.path}: partitions spanning multiple block devices "
+                        "are not supported"
+                    )
+            self.partitions.append(
+                LpPartition(
+                    _cstring(name),
+                    attributes,
+                    group_names[group_index] if group_index < len(group_names) else "",
+                    part_extents,
+                    sum(extent.num_sectors for extent in part_extents) * LP_SECTOR_SIZE,
+                )
+            )
+
+    def partition(self, name: str) -> LpPartition:
+        for partition in self.partitions:
+            if partition.name == name:
+                return partition
+        raise KeyError(name)
+
+    def open_partition(self, name: str) -> PartitionView:
+        return PartitionView(self, self.partition(name))
+
+    def select_slot(self, suffix: str = "_a"):
+        """Return one non-empty partition per base name, preferring ``suffix``.
+
+        Unsuffixed partitions are always included; for A/B pairs the
+        requested slot wins and the other slot is used only when the
+        requested one has no extents.
+        """
+        chosen = {}
+        for partition in self.partitions:
+            if not partition.size:
+                continue
+            base = base_partition_name(partition.name)
+            current = chosen.get(base)
+            if current is None or (
+                partition.name.endswith(suffix) and not current.name.endswith(suffix)
+            ):
+                chosen[base] = partition
+        return chosen
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._image.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def is_super_image(path) -> bool:
+    """Check for the LP geometry magic behind the reserved area."""
+    try:
+        with open_image(path) as image:
+            raw = image.pread(LP_PARTITION_RESERVED_BYTES, 4)
+    except (OSError, ValueError):
+        return False
+    return len(raw) == 4 and struct.unpack("<I", raw)[0] == LP_METADATA_GEOMETRY_MAGIC
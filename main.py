@@ -1,6 +1,19 @@
 #!/usr/bin/env python3
 
-from cli import run_cli
+import os
+import sys
 
 if __name__ == "__main__":
+    # With a service running, hand the command to it instead of importing
+    # everything here; fall back to running in process if it is not up.
+    if os.environ.get("VENDOR_TREE_SOCKET") and sys.argv[1:2] != ["serve"]:
+        from client import ServiceUnavailable, run_client
+
+        try:
+            sys.exit(run_client(sys.argv[1:]))
+        except ServiceUnavailable as e:
+            sys.stderr.write(f"[WARNING] {e}; running in process\n")
+
+    from cli import run_cli
+
     run_cli()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import sqlite3
+from collections import namedtuple
+from typing import Dict, Tuple
+
+ManifestEntry = namedtuple(
+    "ManifestEntry",
+    ["partition", "rel_path", "size", "mtime_ns", "ctime_ns", "inode", "digest", "sha1"],
+    defaults=[None],
+)
+
+ManifestDiff = namedtuple("ManifestDiff", ["added", "removed", "changed", "unchanged"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    partition TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    ctime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL,
+    sha1 TEXT,
+    PRIMARY KEY (partition, path)
+);
+"""
+
+Key = Tuple[str, str]
+
+
+def stamp_of(st: os.stat_result) -> Tuple[int, int, int, int]:
+    """The (size, mtime_ns, ctime_ns, inode) tuple used to detect changes."""
+    return st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino
+
+
+def link_digest(target: str) -> str:
+    """Digest recorded for a symlink: its target, which is all it contains."""
+    return f"link:{target}"
+
+
+class Manifest:
+    """Per-blob record of the last generated tree, stored in SQLite.
+
+    Each row holds the source file's stamp, content digest and, once
+    computed, its SHA-1 pin, keyed by ``(partition, rel_path)``. Comparing
+    a fresh scan against it tells a rerun which blobs were added, removed
+    or changed.
+    """
+
+    def __init__(self, path):
+        self.path = os.fspath(path)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path)
+        db.executescript(_SCHEMA)
+        columns = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+        if "sha1" not in columns:
+            db.execute("ALTER TABLE entries ADD COLUMN sha1 TEXT")
+        return db
+
+    def load(self) -> Dict[Key, ManifestEntry]:
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            db = self._connect()
+            try:
+                rows = db.execute("SELECT * FROM entries").fetchall()
+            finally:
+                db.close()
+        except sqlite3.DatabaseError as e:
+            logging.warning(f"Ignoring unreadable manifest {self.path}: {e}")
+            return {}
+        return {(row[0], row[1]): ManifestEntry(*row) for row in rows}
+
+    def save(self, entries: Dict[Key, ManifestEntry]):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM entries")
+                db.executemany(
+                    "INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)", entries.values()
+                )
+        finally:
+            db.close()
+
+    @staticmethod
+    def diff(old: Dict[Key, ManifestEntry], new: Dict[Key, ManifestEntry]) -> ManifestDiff:
+        """Compare two manifests by content digest; each field is a sorted key list."""
+        added, changed, unchanged = [], [], []
+        for key, entry in new.items():
+            previous = old.get(key)
+            if previous is None:
+                added.append(key)
+            elif previous.digest != entry.digest:
+                changed.append(key)
+            else:
+                unchanged.append(key)
+        removed = [key for key in old if key not in new]
+        return ManifestDiff(sorted(added), sorted(removed), sorted(changed), sorted(unchanged))
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+import errno
+import fcntl
+import logging
+import os
+import shutil
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional, Tuple
+
+# ioctl(dest_fd, FICLONE, src_fd) from <linux/fs.h>
+FICLONE = 0x40049409
+
+MATERIALIZE_MODES = ("auto", "hardlink", "reflink", "copy_file_range", "copy")
+
+# Each mode falls back to the ones after it when the filesystem refuses.
+_FALLBACK_CHAIN = ("hardlink", "reflink", "copy_file_range", "copy")
+_AUTO_CHAIN = ("reflink", "copy_file_range", "copy")
+
+# Errors meaning "this mode does not work here", as opposed to a real I/O
+# failure that should be reported.
+_UNSUPPORTED_ERRNOS = frozenset(
+    [errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.ENOSYS,
+     errno.EPERM, errno.EMLINK, errno.EBADF]
+)
+
+
+def _hardlink(src: str, dst: str):
+    os.link(src, dst)
+
+
+def _reflink(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, dst)
+
+
+def _copy_file_range(src: str, dst: str):
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        remaining = os.fstat(fsrc.fileno()).st_size
+        while remaining > 0:
+            n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), remaining)
+            if n == 0:
+                break
+            remaining -= n
+    shutil.copystat(src, dst)
+
+
+def _copy(src: str, dst: str):
+    shutil.copy2(src, dst)
+
+
+_OPERATIONS = {
+    "hardlink": _hardlink,
+    "reflink": _reflink,
+    "copy_file_range": _copy_file_range,
+    "copy": _copy,
+}
+
+
+def default_jobs() -> int:
+    """Worker count for metadata-bound file operations."""
+    return min(32, (os.cpu_count() or 1) * 4)
+
+
+class Materializer:
+    """Places files into the output tree by linking, cloning or copying.
+
+    ``mode`` picks the first strategy to try. When the filesystem rejects
+    it (cross-device link, no reflink support, ...) the next strategy in
+    the chain is used and the rejected one is skipped for the rest of the
+    run. ``auto`` starts at reflink and never hardlinks.
+    """
+
+    def __init__(self, mode: str = "auto", jobs: Optional[int] = None):
+        if mode not in MATERIALIZE_MODES:
+            raise ValueError(f"Unknown materialize mode: {mode}")
+        self.mode = mode
+        self.jobs = jobs or default_jobs()
+        if mode == "auto":
+            self._chain = _AUTO_CHAIN
+        else:
+            self._chain = _FALLBACK_CHAIN[_FALLBACK_CHAIN.index(mode):]
+        self._disabled = set()
+        self._lock = threading.Lock()
+
+    def materialize(self, src: str, dst: str) -> str:
+        """Create ``dst`` from ``src`` and return the strategy that worked."""
+        if os.path.lexists(dst):
+            os.unlink(dst)
+
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            return "symlink"
+
+        for mode in self._chain:
+            if mode in self._disabled and mode != "copy":
+                continue
+            try:
+                _OPERATIONS[mode](src, dst)
+                return mode
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS or mode == "copy":
+                    raise
+                with self._lock:
+                    if mode not in self._disabled:
+                        logging.info(f"{mode} not available ({e.strerror}), falling back")
+                        self._disabled.add(mode)
+                if os.path.lexists(dst):
+                    os.unlink(dst)
+        raise OSError(f"Could not materialize {src}")
+
+    def materialize_many(self, pairs: Iterable[Tuple[str, str]]) -> Counter:
+        """Materialize ``(src, dst)`` pairs on a thread pool.
+
+        Parent directories are created up front so workers only perform the
+        per-file link/clone/copy. Returns a count of strategies used.
+        """
+        pairs = list(pairs)
+        for parent in sorted({os.path.dirname(dst) for _, dst in pairs}):
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+
+        used = Counter()
+        if not pairs:
+            return used
+        workers = max(1, min(self.jobs, len(pairs)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="materialize") as pool:
+            for mode in pool.map(lambda pair: self.materialize(*pair), pairs):
+                used[mode] += 1
+        return used
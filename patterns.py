@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import json
+import os
+from pathlib import Path
+from typing import Iterable, Optional
+
+import warmcache
+
+DEFAULT_PATTERNS_PATH = Path(__file__).resolve().parent / "config" / "proprietary_patterns.json"
+
+_TERMINAL = ""
+
+
+def _components(path: str):
+    return [part for part in path.split("/") if part]
+
+
+class PatternMatcher:
+    """Include/exclude rules compiled from ``proprietary_patterns.json``.
+
+    Include paths are stored in a trie keyed by path component, so matching
+    a path costs one dict lookup per component. Exclude entries are split by
+    shape: ``.ext`` entries go into an extension set, ``name/`` entries into
+    a directory-name set and anything else into a basename set.
+
+    Paths are checked both as given (relative to the partition root) and
+    qualified with the partition name, so ``vendor/lib64/`` matches
+    ``lib64/libfoo.so`` from the vendor image as well as
+    ``vendor/lib64/libfoo.so`` from a system-as-root layout.
+    """
+
+    def __init__(
+        self,
+        include_prefixes: Iterable[str] = (),
+        exclude_extensions: Iterable[str] = (),
+        exclude_names: Iterable[str] = (),
+        exclude_dirs: Iterable[str] = (),
+    ):
+        self._trie = {}
+        for prefix in include_prefixes:
+            node = self._trie
+            for part in _components(prefix):
+                node = node.setdefault(part, {})
+            node[_TERMINAL] = True
+        self._include_all = not self._trie
+        self.exclude_extensions = frozenset(ext.lower() for ext in exclude_extensions)
+        self.exclude_names = frozenset(exclude_names)
+        self.exclude_dirs = frozenset(exclude_dirs)
+
+    @classmethod
+    def from_config(cls, config: dict) -> "PatternMatcher":
+        includes, extensions, names, dirs = [], [], [], []
+        for group in config.get("include_patterns", []):
+            includes.extend(group.get("paths", []))
+        for group in config.get("exclude_patterns", []):
+            for entry in group.get("paths", []):
+                if entry.startswith("."):
+                    extensions.append(entry)
+                elif entry.endswith("/"):
+                    dirs.append(entry.strip("/"))
+                else:
+                    names.append(entry)
+        return cls(includes, extensions, names, dirs)
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "PatternMatcher":
+        """Compile a patterns file; reused from the warm cache while it is unchanged."""
+        path = os.path.abspath(path or DEFAULT_PATTERNS_PATH)
+        cache = warmcache.get_cache("matcher")
+        if cache is not None:
+            st = os.stat(path)
+            stamp = (st.st_size, st.st_mtime_ns, st.st_ino)
+            matcher = cache.get_current(path, stamp)
+            if matcher is not None:
+                return matcher
+        with open(path, "r", encoding="utf-8") as f:
+            matcher = cls.from_config(json.load(f))
+        if cache is not None:
+            cache.put_current(path, stamp, matcher, st.st_size * warmcache.JSON_EXPANSION)
+        return matcher
+
+    def _candidates(self, path: str, partition: Optional[str]):
+        parts = _components(path)
+        yield parts
+        if partition:
+            yield [partition] + parts
+
+    def _included(self, parts) -> bool:
+        node = self._trie
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return False
+
+    def _viable(self, parts) -> bool:
+        """True if some include prefix can still match below ``parts``."""
+        node = self._trie
+        for part in parts:
+            node = node.get(part)
+            if node is None:
+                return False
+            if _TERMINAL in node:
+                return True
+        return True
+
+    def is_excluded(self, path: str) -> bool:
+        parts = _components(path)
+        if not parts:
+            return False
+        name = parts[-1]
+        if name in self.exclude_names:
+            return True
+        dot = name.rfind(".")
+        if dot > 0 and name[dot:].lower() in self.exclude_extensions:
+            return True
+        return any(part in self.exclude_dirs for part in parts[:-1])
+
+    def matches(self, path: str, partition: Optional[str] = None) -> bool:
+        """Classify a file path relative to its partition root."""
+        if self.is_excluded(path):
+            return False
+        if self._include_all:
+            return True
+        return any(self._included(parts) for parts in self._candidates(path, partition))
+
+    def should_descend(self, dir_path: str, partition: Optional[str] = None) -> bool:
+        """Return False when nothing below ``dir_path`` can ever match."""
+        parts = _components(dir_path)
+        if parts and parts[-1] in self.exclude_dirs:
+            return False
+        if self._include_all:
+            return True
+        return any(self._viable(parts) for parts in self._candidates(dir_path, partition))
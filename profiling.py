@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import threading
+import time
+from typing import Optional
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_PROC_IO = "/proc/self/io"
+
+
+def _read_io():
+    """Process-wide (bytes read, bytes written) through read/write syscalls."""
+    try:
+        with open(_PROC_IO, "rb") as f:
+            fields = dict(line.split(b":", 1) for line in f.read().splitlines())
+        return int(fields[b"rchar"]), int(fields[b"wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+def _peak_rss_kb() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class _NullSpan:
+    """Span handed out while profiling is off; every method is a no-op."""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def count(self, **counters):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """One timed stage: wall and CPU time, I/O, counters and peak RSS.
+
+    CPU time and I/O bytes are process-wide deltas, so they include work
+    done by pool threads the stage started, and overlapping spans share
+    them.
+    """
+
+    __slots__ = ("profiler", "name", "args", "counters", "_start", "_cpu", "_io", "_tid")
+
+    def __init__(self, profiler: "Profiler", name: str, args: dict):
+        self.profiler = profiler
+        self.name = name
+        self.args = args
+        self.counters = {}
+
+    def __enter__(self):
+        self._tid = threading.get_ident()
+        self._io = _read_io()
+        self._cpu = time.process_time_ns()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter_ns()
+        cpu = time.process_time_ns() - self._cpu
+        read, written = _read_io()
+        self.profiler._record({
+            "name": self.name,
+            "ts": (self._start - self.profiler.origin) // 1000,
+            "dur": (end - self._start) // 1000,
+            "tid": self._tid,
+            "args": {
+                **self.args,
+                **self.counters,
+                "cpu_ms": round(cpu / 1e6, 3),
+                "bytes_read": read - self._io[0],
+                "bytes_written": written - self._io[1],
+                "peak_rss_kb": _peak_rss_kb(),
+                **({"error": exc_type.__name__} if exc_type else {}),
+            },
+        })
+        return False
+
+    def count(self, **counters):
+        """Add to named counters (``files``, ``bytes``, ...) of this span."""
+        for key, value in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+class Profiler:
+    """Collects spans and writes them as a Chrome trace (``chrome://tracing``)."""
+
+    def __init__(self):
+        self.origin = time.perf_counter_ns()
+        self.events = []
+        self._threads = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name: str, **args) -> Span:
+        return Span(self, name, args)
+
+    def _record(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+            self._threads.setdefault(event["tid"], threading.current_thread().name)
+
+    def summary(self) -> dict:
+        """Totals per stage name: calls, wall/CPU time and counters."""
+        totals = {}
+        with self._lock:
+            events = list(self.events)
+        for event in events:
+            total = totals.setdefault(event["name"], {"calls": 0, "wall_ms": 0.0})
+            total["calls"] += 1
+            total["wall_ms"] = round(total["wall_ms"] + event["dur"] / 1000, 3)
+            for key, value in event["args"].items():
+                if key == "peak_rss_kb":
+                    total[key] = max(total.get(key, 0), value)
+                elif isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = round(total.get(key, 0) + value, 3)
+        return totals
+
+    def write(self, path):
+        """Write the trace plus a per-stage summary as JSON."""
+        pid = os.getpid()
+        with self._lock:
+            events = [
+                {"ph": "X", "cat": "stage", "pid": pid, **event} for event in self.events
+            ]
+            events += [
+                {"ph": "M", "name": "thread_name", "pid": pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self._threads.items()
+            ]
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"traceEvents": events, "displayTimeUnit": "ms", "summary": self.summary()},
+                f,
+                indent=1,
+            )
+
+
+_profiler: Optional[Profiler] = None
+
+
+def enable() -> Profiler:
+    """Start recording spans process-wide and return the profiler."""
+    global _profiler
+    _profiler = Profiler()
+    return _profiler
+
+
+def disable():
+    global _profiler
+    _profiler = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _profiler
+
+
+def stage(name: str, **args):
+    """Context manager timing a stage; a shared no-op when profiling is off.
+
+    Usage::
+
+        with profiling.stage("scan", partition="vendor") as span:
+            ...
+            span.count(files=n)
+    """
+    if _profiler is None:
+        return _NULL_SPAN
+    return _profiler.stage(name, **args)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import logging
+import os
+import queue
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional
+
+ScanEntry = namedtuple("ScanEntry", ["partition", "rel_path", "size", "mtime", "inode"])
+
+_DONE = object()
+_BATCH_SIZE = 256
+
+
+def _make_entry(partition: str, rel_path: str, dir_entry: os.DirEntry) -> ScanEntry:
+    st = dir_entry.stat(follow_symlinks=False)
+    return ScanEntry(partition, rel_path, st.st_size, st.st_mtime, st.st_ino)
+
+
+class _Unit:
+    """A subtree scanned by one worker; results are queued in batches."""
+
+    __slots__ = ("partition", "path", "rel_path", "results")
+
+    def __init__(self, partition: str, path: str, rel_path: str):
+        self.partition = partition
+        self.path = path
+        self.rel_path = rel_path
+        self.results = queue.Queue()
+
+
+def _walk_unit(unit: _Unit, matcher):
+    found = []
+    stack = [(unit.path, unit.rel_path)]
+    try:
+        while stack:
+            path, rel_dir = stack.pop()
+            try:
+                it = os.scandir(path)
+            except OSError as e:
+                logging.warning(f"Cannot scan {path}: {e}")
+                continue
+            with it:
+                for dir_entry in it:
+                    rel_path = f"{rel_dir}/{dir_entry.name}"
+                    if dir_entry.is_dir(follow_symlinks=False):
+                        if matcher.should_descend(rel_path, unit.partition):
+                            stack.append((dir_entry.path, rel_path))
+                    elif matcher.matches(rel_path, unit.partition):
+                        found.append(_make_entry(unit.partition, rel_path, dir_entry))
+        # scandir order depends on the filesystem; sort so output is stable.
+        found.sort(key=lambda entry: entry.rel_path)
+        for start in range(0, len(found), _BATCH_SIZE):
+            unit.results.put(found[start:start + _BATCH_SIZE])
+    finally:
+        unit.results.put(_DONE)
+
+
+def scan_partitions(
+    root, matcher, jobs: Optional[int] = None, partitions: Optional[Iterable[str]] = None
+) -> Iterator[ScanEntry]:
+    """Yield files and symlinks under ``root/<partition>/`` that ``matcher`` selects.
+
+    Each partition's top-level directories are walked concurrently with
+    ``os.scandir``, skipping subtrees the matcher rules out. Entries come
+    out sorted by ``(partition, rel_path)`` whatever order the filesystem
+    lists them in; each subtree is streamed as soon as its worker is done.
+    ``partitions`` limits the scan to those subdirectories of ``root``.
+    Symlinks are never followed; one pointing at a directory is yielded
+    like any other symlink, as the streamed path records it.
+    """
+    root = os.fspath(root)
+    plan = []
+    names = os.listdir(root) if partitions is None else partitions
+    for partition in sorted(names):
+        partition_path = os.path.join(root, partition)
+        if not os.path.isdir(partition_path):
+            continue
+        # A subtree sorts as "name/", so it lands exactly where its paths would.
+        items = []
+        with os.scandir(partition_path) as it:
+            for dir_entry in it:
+                if dir_entry.is_dir(follow_symlinks=False):
+                    if matcher.should_descend(dir_entry.name, partition):
+                        unit = _Unit(partition, dir_entry.path, dir_entry.name)
+                        items.append((dir_entry.name + "/", unit))
+                elif matcher.matches(dir_entry.name, partition):
+                    entry = _make_entry(partition, dir_entry.name, dir_entry)
+                    items.append((dir_entry.name, entry))
+        items.sort(key=lambda item: item[0])
+        plan.append([item for _, item in items])
+
+    all_units = [item for items in plan for item in items if isinstance(item, _Unit)]
+    jobs = max(1, min(jobs or os.cpu_count() or 1, len(all_units) or 1))
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="scan") as pool:
+        futures = [pool.submit(_walk_unit, unit, matcher) for unit in all_units]
+        for items in plan:
+            for item in items:
+                if not isinstance(item, _Unit):
+                    yield item
+                    continue
+                while True:
+                    batch = item.results.get()
+                    if batch is _DONE:
+                        break
+                    yield from batch
+        for future in futures:
+            future.result()
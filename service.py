@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import signal
+import socket
+import threading
+import time
+from typing import Optional
+
+import tools
+import warmcache
+from cli import run_command
+from client import ServiceUnavailable, connect, peer_uid, send_message
+
+
+class ServiceError(ValueError):
+    pass
+
+
+class _Shutdown(BaseException):
+    """Raised in the serving thread by SIGINT/SIGTERM to stop the service."""
+
+
+class _Client:
+    """One connected client; sends are serialised and dropped once it has gone."""
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        self.gone = threading.Event()
+        self._lock = threading.Lock()
+
+    def send(self, message: dict):
+        if self.gone.is_set():
+            return
+        try:
+            with self._lock:
+                send_message(self.sock, message)
+        except OSError:
+            self.gone.set()
+
+
+class _Relay(io.TextIOBase):
+    """Text stream whose writes go to the client as ``stdout``/``stderr`` messages."""
+
+    def __init__(self, client: _Client, name: str):
+        super().__init__()
+        self._client = client
+        self._name = name
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            self._client.send({self._name: text})
+        return len(text)
+
+
+class _RelayHandler(logging.Handler):
+    def __init__(self, client: _Client):
+        super().__init__()
+        self._client = client
+
+    def emit(self, record):
+        try:
+            self._client.send({"stderr": self.format(record) + "\n"})
+        except Exception:
+            self.handleError(record)
+
+
+class VendorTreeService:
+    """Runs command lines sent by ``client.run_client`` in one long-lived process.
+
+    Imports and tool lookups are paid once, and ``warmcache`` keeps image
+    indexes, decoded blocks, parsed ELF indexes, compiled pattern matchers
+    and blob digests in memory between requests, within ``cache_bytes``.
+    Requests run one at a time, in the client's working directory, and
+    their log and output are relayed to the client as they are written.
+    A client that disconnects has its tools stopped.
+
+    The socket is only accessible to the user running the service, and
+    connections from other users are refused.
+    """
+
+    def __init__(self, socket_path: str, cache_bytes: int, idle_timeout: Optional[float] = None):
+        self.socket_path = socket_path
+        self.cache_bytes = cache_bytes
+        self.idle_timeout = idle_timeout
+        self.started = time.time()
+        self.requests = 0
+        self._stopping = False
+
+    def _bind(self) -> socket.socket:
+        try:
+            connect(self.socket_path).close()
+        except ServiceUnavailable:
+            pass
+        else:
+            raise ServiceError(f"A service is already listening on {self.socket_path}")
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o177)
+        try:
+            server.bind(self.socket_path)
+        except OSError:
+            server.close()
+            raise
+        finally:
+            os.umask(umask)
+        server.listen(16)
+        return server
+
+    def serve(self):
+        """Accept requests until ``stop``, a signal or the idle timeout."""
+        server = self._bind()
+        warmcache.enable(self.cache_bytes)
+        handlers = {
+            signum: signal.signal(signum, self._on_signal)
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        server.settimeout(self.idle_timeout)
+        logging.info(
+            f"Serving on {self.socket_path} (pid {os.getpid()}, "
+            f"{self.cache_bytes} bytes of warm caches)"
+        )
+        try:
+            while not self._stopping:
+                try:
+                    conn, _ = server.accept()
+                except socket.timeout:
+                    logging.info(f"No request for {self.idle_timeout:g}s, exiting")
+                    break
+                with conn:
+                    uid = peer_uid(conn)
+                    if uid is not None and uid != os.getuid():
+                        logging.warning(f"Refusing a connection from uid {uid}")
+                        continue
+                    self._handle(conn)
+        except _Shutdown:
+            logging.info("Stopping on signal")
+        finally:
+            server.close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            warmcache.disable()
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+
+    def _on_signal(self, signum, frame):
+        self._stopping = True
+        tools.get_runner().interrupt()
+        raise _Shutdown
+
+    def _handle(self, conn: socket.socket):
+        client = _Client(conn)
+        try:
+            with conn.makefile("rb") as stream:
+                line = stream.readline()
+            request = json.loads(line) if line else None
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring malformed request: {e}")
+            return
+        try:
+            if not isinstance(request, dict):
+                return
+            if request.get("control") == "status":
+                client.send(self.status())
+            elif request.get("control") == "stop":
+                self._stopping = True
+                client.send({"stopping": True})
+                logging.info("Stopping on request")
+            elif isinstance(request.get("argv"), list):
+                client.send({"exit": self._run(client, request)})
+            else:
+                client.send({"stderr": "[ERROR] Unknown request\n"})
+                client.send({"exit": 2})
+        finally:
+            # Wakes the disconnect watcher blocked in recv().
+            with contextlib.suppress(OSError):
+                conn.shutdown(socket.SHUT_RDWR)
+
+    def _run(self, client: _Client, request: dict) -> int:
+        argv = [str(arg) for arg in request["argv"]]
+        if argv[:1] == ["serve"]:
+            client.send({"stderr": "[ERROR] Already running as a service\n"})
+            return 2
+        self.requests += 1
+        runner = tools.get_runner()
+        done = threading.Event()
+
+        def watch():
+            # Nothing follows the request, so end of input means the client left.
+            with contextlib.suppress(OSError):
+                while client.sock.recv(4096):
+                    pass
+            if not done.is_set():
+                client.gone.set()
+                logging.warning("Client disconnected, stopping its tools")
+                runner.interrupt()
+
+        threading.Thread(target=watch, name="service-watch", daemon=True).start()
+
+        root = logging.getLogger()
+        level = root.level
+        handler = _RelayHandler(client)
+        handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+        root.addHandler(handler)
+        cwd = os.getcwd()
+        start = time.monotonic()
+        try:
+            os.chdir(request.get("cwd") or cwd)
+            with contextlib.redirect_stdout(_Relay(client, "stdout")):
+                with contextlib.redirect_stderr(_Relay(client, "stderr")):
+                    run_command(argv)
+            status = 0
+        except SystemExit as e:
+            if isinstance(e.code, str):
+                client.send({"stderr": e.code + "\n"})
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+        except Exception:
+            logging.exception("Command failed")
+            status = 1
+        finally:
+            done.set()
+            os.chdir(cwd)
+            root.removeHandler(handler)
+            root.setLevel(level)
+            runner.resume()
+        logging.info(
+            f"Request {self.requests} exited with {status} after "
+            f"{time.monotonic() - start:.2f}s: {' '.join(argv)}"
+        )
+        return status
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "uptime_s": round(time.time() - self.started, 1),
+            "requests": self.requests,
+            "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            "caches": warmcache.stats(),
+        }
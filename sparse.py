@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+
+import bisect
+import struct
+from collections import namedtuple
+
+import warmcache
+from image import ImageFile, open_raw_image
+
+SPARSE_HEADER_MAGIC = 0xED26FF3A
+SPARSE_MAGIC_BYTES = b"\x3a\xff\x26\xed"
+
+CHUNK_TYPE_RAW = 0xCAC1
+CHUNK_TYPE_FILL = 0xCAC2
+CHUNK_TYPE_DONT_CARE = 0xCAC3
+CHUNK_TYPE_CRC32 = 0xCAC4
+
+_FILE_HEADER = struct.Struct("<IHHHHIIII")
+_CHUNK_HEADER = struct.Struct("<HHII")
+
+# One entry per output-producing chunk. ``offset`` and ``length`` are in the
+# decoded (raw) image; ``data`` is the file offset for RAW chunks and the
+# 4-byte pattern for FILL chunks.
+SparseChunk = namedtuple("SparseChunk", ["offset", "length", "type", "data"])
+
+
+class SparseImageError(ValueError):
+    """Raised when a sparse image header or chunk table is malformed."""
+
+
+def is_sparse_image(path) -> bool:
+    """Check the sparse header magic of an image file (or its first part)."""
+    try:
+        with open_raw_image(path) as image:
+            return image.pread(0, 4) == SPARSE_MAGIC_BYTES
+    except OSError:
+        return False
+
+
+class SparseImage(ImageFile):
+    """Seekable, lazily decoded view of an Android sparse image.
+
+    Only the chunk headers are read when the image is opened. RAW chunks are
+    served straight from the sparse file, FILL chunks are synthesised from
+    their pattern and DONT_CARE chunks read back as zeroes, so nothing is
+    materialised until a caller actually asks for those bytes.
+
+    ``source`` is a path or an already opened ``ImageFile`` holding the
+    sparse data (for example a ``SplitImage``); the image takes ownership
+    of it and closes it on ``close``.
+    """
+
+    def __init__(self, source):
+        super().__init__()
+        if isinstance(source, ImageFile):
+            self.path = getattr(source, "path", "<image>")
+            self._source = source
+        else:
+            self.path = str(source)
+            self._source = open_raw_image(self.path)
+        try:
+            self._load_chunk_table()
+        except Exception:
+            self.close()
+            raise
+
+    def _load_chunk_table(self):
+        """Parse the chunk table, or take it from the warm cache."""
+        cache = warmcache.get_cache("image-index")
+        if cache is None or self._source.cache_key is None:
+            self._parse_header()
+            return
+        name, stamp = self._source.cache_key
+        table = cache.get_current(("sparse", name), stamp)
+        if table is None:
+            self._parse_header()
+            table = (self.block_size, self.total_blocks, self.chunks, self._starts)
+            cache.put_current(("sparse", name), stamp, table, 120 * len(self.chunks))
+        self.block_size, self.total_blocks, self.chunks, self._starts = table
+        self.size = self.block_size * self.total_blocks
+
+    def _parse_header(self):
+        header = self._source.pread(0, _FILE_HEADER.size)
+        if len(header) < _FILE_HEADER.size:
+            raise SparseImageError(f"{self.path}: truncated sparse header")
+
+        (
+            magic,
+            major,
+            _minor,
+            file_hdr_sz,
+            chunk_hdr_sz,
+            blk_sz,
+            total_blks,
+            total_chunks,
+            _checksum,
+        ) = _FILE_HEADER.unpack(header)
+
+        if magic != SPARSE_HEADER_MAGIC:
+            raise SparseImageError(f"{self.path}: not a sparse image")
+        if major != 1:
+            raise SparseImageError(f"{self.path}: unsupported sparse version {major}")
+        if blk_sz == 0 or blk_sz % 4:
+            raise SparseImageError(f"{self.path}: invalid block size {blk_sz}")
+
+        self.block_size = blk_sz
+        self.total_blocks = total_blks
+        self.size = blk_sz * total_blks
+
+        chunks = []
+        pos = file_hdr_sz
+        out_offset = 0
+        for _ in range(total_chunks):
+            raw = self._source.pread(pos, _CHUNK_HEADER.size)
+            if len(raw) < _CHUNK_HEADER.size:
+                raise SparseImageError(f"{self.path}: truncated chunk table")
+            chunk_type, _reserved, chunk_sz, total_sz = _CHUNK_HEADER.unpack(raw)
+            data_pos = pos + chunk_hdr_sz
+            length = chunk_sz * blk_sz
+
+            if chunk_type == CHUNK_TYPE_RAW:
+                if total_sz - chunk_hdr_sz != length:
+                    raise SparseImageError(f"{self.path}: bad RAW chunk at {pos}")
+                chunks.append(SparseChunk(out_offset, length, chunk_type, data_pos))
+            elif chunk_type == CHUNK_TYPE_FILL:
+                pattern = self._source.pread(data_pos, 4)
+                chunks.append(SparseChunk(out_offset, length, chunk_type, pattern))
+            elif chunk_type == CHUNK_TYPE_DONT_CARE:
+                chunks.append(SparseChunk(out_offset, length, chunk_type, None))
+            elif chunk_type == CHUNK_TYPE_CRC32:
+                length = 0
+            else:
+                raise SparseImageError(
+                    f"{self.path}: unknown chunk type {chunk_type:#x} at {pos}"
+                )
+
+            out_offset += length
+            pos += total_sz
+
+        if out_offset != self.size:
+            raise SparseImageError(
+                f"{self.path}: chunks cover {out_offset} bytes, header says {self.size}"
+            )
+
+        self.chunks = chunks
+        self._starts = [chunk.offset for chunk in chunks]
+
+    def fileno(self) -> int:
+        return self._source.fileno()
+
+    def chunk_at(self, offset: int) -> SparseChunk:
+        """Return the chunk covering a decoded image offset."""
+        return self.chunks[bisect.bisect_right(self._starts, offset) - 1]
+
+    def pread(self, offset: int, length: int) -> bytes:
+        length = min(length, self.size - offset)
+        if length <= 0:
+            return b""
+
+        out = []
+        index = bisect.bisect_right(self._starts, offset) - 1
+        while length > 0:
+            chunk = self.chunks[index]
+            skip = offset - chunk.offset
+            n = min(chunk.length - skip, length)
+
+            if chunk.type == CHUNK_TYPE_RAW:
+                out.append(self._source.pread(chunk.data + skip, n))
+            elif chunk.type == CHUNK_TYPE_FILL:
+                shift = skip % 4
+                pattern = chunk.data[shift:] + chunk.data[:shift]
+                out.append((pattern * (n // 4 + 1))[:n])
+            else:
+                out.append(bytes(n))
+
+            offset += n
+            length -= n
+            index += 1
+
+        return b"".join(out)
+
+    def read_blocks(self, block: int, count: int = 1) -> bytes:
+        """Read ``count`` decoded blocks starting at block index ``block``."""
+        return self.pread(block * self.block_size, count * self.block_size)
+
+    def copy_to(self, dest_path: str, buffer_size: int = 4 << 20):
+        """Write the decoded image to ``dest_path``.
+
+        DONT_CARE chunks and all-zero FILL chunks are skipped with a seek, so
+        the output is a sparse file on filesystems that support holes.
+        """
+        with open(dest_path, "wb") as out:
+            for chunk in self.chunks:
+                if chunk.type == CHUNK_TYPE_DONT_CARE or (
+                    chunk.type == CHUNK_TYPE_FILL and chunk.data == b"\0\0\0\0"
+                ):
+                    continue
+                out.seek(chunk.offset)
+                done = 0
+                while done < chunk.length:
+                    n = min(buffer_size, chunk.length - done)
+                    out.write(self.pread(chunk.offset + done, n))
+                    done += n
+            out.truncate(self.size)
+
+    def close(self):
+        source = getattr(self, "_source", None)
+        if source is not None:
+            source.close()
+        super().close()
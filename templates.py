@@ -1,11 +1,59 @@
 #!/usr/bin/env python3
 
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, Iterator, Optional, Tuple
+
+from catalog import KIND_EXECUTABLE, KIND_SHARED_LIBRARY, KIND_UNCLASSIFIED, BlobCatalog
+
+SOONG_ARCHES = {
+    "arm": "android_arm",
+    "aarch64": "android_arm64",
+    "x86": "android_x86",
+    "x86_64": "android_x86_64",
+}
+
+ARCH_BITS = {
+    "android_arm": 32,
+    "android_arm64": 64,
+    "android_x86": 32,
+    "android_x86_64": 64,
+}
+
+
+# Soong property installing a module to a partition other than system.
+PARTITION_PROPERTIES = {
+    "vendor": "vendor",
+    "odm": "device_specific",
+    "product": "product_specific",
+    "system_ext": "system_ext_specific",
+    "vendor_dlkm": "vendor_dlkm_specific",
+}
+
+
+def copy_out_dir(partition: str) -> str:
+    """Make variable of the directory a partition's files are installed to."""
+    return f"$(TARGET_COPY_OUT_{partition.upper()})"
+
+
+def install_path(partition: str, rel_path: str) -> str:
+    """PRODUCT_COPY_FILES destination of a blob.
+
+    A system-as-root image holds its files under ``system/``, which
+    ``$(TARGET_COPY_OUT_SYSTEM)`` already names, so that prefix is dropped.
+    """
+    prefix = f"{partition}/"
+    if rel_path.startswith(prefix):
+        rel_path = rel_path[len(prefix):]
+    return f"{copy_out_dir(partition)}/{rel_path}"
 
 
 class VendorTreeTemplates:
-    """Templates for generating vendor tree files."""
+    """Templates for generating vendor tree files.
+
+    Each ``render_*`` method is a generator yielding the file in chunks, so
+    callers can stream very large makefiles straight to disk; the matching
+    ``generate_*`` method joins them into a string.
+    """
 
     def __init__(self, vendor_name: str, device_name: str, android_version: str):
         self.vendor_name = vendor_name
@@ -13,9 +61,12 @@ class VendorTreeTemplates:
         self.android_version = android_version
         self.timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    def generate_android_mk(self, proprietary_files: List[Dict]) -> str:
+    def generate_android_mk(self, catalog: BlobCatalog) -> str:
         """Generate Android.mk content."""
-        return f"""# Copyright (C) {datetime.now().year} The LineageOS Project
+        return "".join(self.render_android_mk(catalog))
+
+    def render_android_mk(self, catalog: BlobCatalog) -> Iterator[str]:
+        yield f"""# Copyright (C) {datetime.now().year} The LineageOS Project
 #
 # This file is generated by vendor_tree_generator - {self.timestamp}
 
@@ -37,75 +88,152 @@ $(call inherit-product, vendor/{self.vendor_name}/{self.device_name}/{self.devic
 endif
 """
 
-    def generate_android_bp(self, proprietary_files: List[Dict]) -> str:
-        """Generate Android.bp content."""
-        binaries = []
-        libraries = []
+    def _collect_modules(self, catalog: BlobCatalog):
+        """Group binaries and libraries by ``(partition, name)`` and Soong arch.
 
-        for file_info in proprietary_files:
-            rel_path = file_info["relative_path"]
-            if "/bin/" in rel_path:
-                binaries.append(rel_path.split("/")[-1])
-            elif "/lib" in rel_path and rel_path.endswith(".so"):
-                libraries.append(rel_path.split("/")[-1])
+        Rows classified as ELF (see ``BlobCatalog.set_elf``) are placed by
+        their real machine and class; unclassified rows fall back to
+        guessing from the ``bin/`` and ``lib``/``lib64`` path components.
+        ``shared_libs`` of every variant of a module are merged.
+        """
+        binaries: Dict[Tuple[str, str], Dict[str, str]] = {}
+        libraries: Dict[Tuple[str, str], Dict[str, str]] = {}
+        shared_libs: Dict[Tuple[str, str], set] = {}
 
-        content = f"""// Copyright (C) {datetime.now().year} The LineageOS Project
-//
-// This file is generated by vendor_tree_generator - {self.timestamp}
+        for name in catalog.names():
+            for row in catalog.rows_named(name):
+                kind = catalog.kind[row]
+                module = (catalog.partition_of(row), name)
+                src = f"proprietary/{catalog.key(row)}"
+                if kind == KIND_SHARED_LIBRARY or kind == KIND_EXECUTABLE:
+                    arch = SOONG_ARCHES.get(catalog.arch(row))
+                    if arch is None:
+                        continue
+                    modules = libraries if kind == KIND_SHARED_LIBRARY else binaries
+                    modules.setdefault(module, {})[arch] = src
+                    shared_libs.setdefault(module, set()).update(catalog.shared_libs[row] or ())
+                    continue
+                if kind != KIND_UNCLASSIFIED:
+                    continue
+                path = f"/{catalog.rel_path(row)}"
+                if "/bin/" in path:
+                    binaries[module] = {"android_arm": src, "android_arm64": src}
+                elif "/lib" in path and name.endswith(".so"):
+                    arch = "android_arm64" if "/lib64/" in path else "android_arm"
+                    libraries.setdefault(module, {})[arch] = src
 
-soong_namespace {{
-}}
-"""
+        return binaries, libraries, shared_libs
 
-        for binary in sorted(set(binaries)):
-            content += f"""
-cc_prebuilt_binary {{
-    name: "{binary}",
-    owner: "{self.vendor_name}",
-    strip: {{
-        none: true,
-    }},
-    target: {{
-        android_arm: {{
-            srcs: ["proprietary/vendor/bin/{binary}"],
-        }},
-        android_arm64: {{
-            srcs: ["proprietary/vendor/bin/{binary}"],
+    @staticmethod
+    def _module_names(*groups) -> Dict[Tuple[str, str], str]:
+        """Soong name of each ``(partition, name)`` module.
+
+        A name found in one partition is used as is; same-named modules of
+        several partitions are prefixed with their partition so they do not
+        replace each other.
+        """
+        partitions: Dict[str, set] = {}
+        for modules in groups:
+            for partition, name in modules:
+                partitions.setdefault(name, set()).add(partition)
+        return {
+            (partition, name): name if len(partitions[name]) == 1 else f"{partition}_{name}"
+            for modules in groups
+            for partition, name in modules
+        }
+
+    @staticmethod
+    def _compile_multilib(targets: Dict[str, str], default: str) -> str:
+        bits = {ARCH_BITS[arch] for arch in targets}
+        if bits == {32}:
+            return "32"
+        if bits == {64}:
+            return "64"
+        return default
+
+    def _render_module(self, module_type: str, name: str, targets: Dict[str, str],
+                       compile_multilib: str, shared_libs=(), partition: str = "vendor",
+                       stem: Optional[str] = None) -> str:
+        target_lines = "".join(
+            f"""        {arch}: {{
+            srcs: ["{src}"],
         }},
-    }},
-    compile_multilib: "prefer32",
-    check_elf_files: false,
-    vendor: true,
-}}
 """
-
-        for library in sorted(set(libraries)):
-            content += f"""
-cc_prebuilt_library_shared {{
-    name: "{library}",
-    owner: "{self.vendor_name}",
+            for arch, src in sorted(targets.items())
+        )
+        shared_libs_line = ""
+        deps = sorted(lib for lib in shared_libs if lib != name)
+        if deps:
+            shared_libs_line = (
+                "    shared_libs: [" + ", ".join(f'"{lib}"' for lib in deps) + "],\n"
+            )
+        stem_line = f'    stem: "{stem}",\n' if stem and stem != name else ""
+        partition_line = ""
+        if partition in PARTITION_PROPERTIES:
+            partition_line = f"    {PARTITION_PROPERTIES[partition]}: true,\n"
+        return f"""
+{module_type} {{
+    name: "{name}",
+{stem_line}    owner: "{self.vendor_name}",
     strip: {{
         none: true,
     }},
     target: {{
-        android_arm: {{
-            srcs: ["proprietary/vendor/lib/{library}"],
-        }},
-        android_arm64: {{
-            srcs: ["proprietary/vendor/lib64/{library}"],
-        }},
-    }},
-    compile_multilib: "both",
-    check_elf_files: false,
-    vendor: true,
-}}
+{target_lines}    }},
+    compile_multilib: "{compile_multilib}",
+{shared_libs_line}    check_elf_files: false,
+{partition_line}}}
 """
 
-        return content
+    def render_prebuilt_modules(self, catalog: BlobCatalog) -> Iterator[str]:
+        """Yield the cc_prebuilt_* stanzas for binaries and libraries."""
+        binaries, libraries, shared_libs = self._collect_modules(catalog)
+        names = self._module_names(binaries, libraries)
+
+        def deps(module):
+            # A dependency shared by several partitions resolves to the
+            # dependent's own partition (see ``ElfIndex.resolve``).
+            partition = module[0]
+            return [
+                names.get((partition, lib), lib) for lib in shared_libs.get(module, ())
+            ]
+
+        for module_type, modules, multilib in (
+            ("cc_prebuilt_binary", binaries, "prefer32"),
+            ("cc_prebuilt_library_shared", libraries, "both"),
+        ):
+            for module in sorted(modules, key=lambda module: (names[module], module)):
+                targets = modules[module]
+                yield self._render_module(
+                    module_type, names[module], targets,
+                    self._compile_multilib(targets, multilib),
+                    deps(module), partition=module[0], stem=module[1],
+                )
+
+    def generate_prebuilt_modules(self, catalog: BlobCatalog) -> str:
+        """Generate the cc_prebuilt_* stanzas for binaries and libraries."""
+        return "".join(self.render_prebuilt_modules(catalog))
+
+    def generate_android_bp(self, catalog: BlobCatalog) -> str:
+        """Generate Android.bp content."""
+        return "".join(self.render_android_bp(catalog))
+
+    def render_android_bp(self, catalog: BlobCatalog) -> Iterator[str]:
+        yield f"""// Copyright (C) {datetime.now().year} The LineageOS Project
+//
+// This file is generated by vendor_tree_generator - {self.timestamp}
+
+soong_namespace {{
+}}
+"""
+        yield from self.render_prebuilt_modules(catalog)
 
     def generate_board_config(self) -> str:
         """Generate BoardConfig.mk content."""
-        return f"""# Copyright (C) {datetime.now().year} The LineageOS Project
+        return "".join(self.render_board_config())
+
+    def render_board_config(self) -> Iterator[str]:
+        yield f"""# Copyright (C) {datetime.now().year} The LineageOS Project
 #
 # This file is generated by vendor_tree_generator - {self.timestamp}
 
@@ -115,9 +243,12 @@ VENDOR_PATH := vendor/{self.vendor_name}/{self.device_name}
 VENDOR_SECURITY_PATCH := 2023-12-01
 """
 
-    def generate_device_vendor_mk(self, proprietary_files: List[Dict]) -> str:
+    def generate_device_vendor_mk(self, catalog: BlobCatalog) -> str:
         """Generate device-vendor.mk content."""
-        content = f"""# Copyright (C) {datetime.now().year} The LineageOS Project
+        return "".join(self.render_device_vendor_mk(catalog))
+
+    def render_device_vendor_mk(self, catalog: BlobCatalog) -> Iterator[str]:
+        yield f"""# Copyright (C) {datetime.now().year} The LineageOS Project
 #
 # This file is generated by vendor_tree_generator - {self.timestamp}
 
@@ -126,15 +257,11 @@ PRODUCT_SOONG_NAMESPACES += \\
 
 PRODUCT_COPY_FILES += \\
 """
-
-        copy_files = []
-        for file_info in proprietary_files:
-            rel_path = file_info["relative_path"]
-            copy_files.append(
-                f"    vendor/{self.vendor_name}/{self.device_name}/proprietary/{rel_path}"
-                f":$(TARGET_COPY_OUT_VENDOR)/{rel_path}"
+        separator = ""
+        for partition, rel_path in catalog:
+            yield (
+                f"{separator}    vendor/{self.vendor_name}/{self.device_name}"
+                f"/proprietary/{partition}/{rel_path}"
+                f":{install_path(partition, rel_path)}"
             )
-
-        content += " \\\n".join(copy_files)
-
-        return content
+            separator = " \\\n"
@@ -0,0 +1,74 @@
+import os
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+DAEMON_MTIME = 1262304000
+
+
+def _noise(rng, n):
+    return rng.getrandbits(8 * n).to_bytes(n, "little")
+
+
+@pytest.fixture
+def source_tree(tmp_path):
+    """A small partition tree covering the layouts the readers decode.
+
+    Empty, tiny (inline), block-aligned, multi-block and sparse files,
+    a 300 KiB file (double indirect blocks at 1 KiB), fast and slow
+    symlinks, an executable with a fixed mtime and a directory with
+    enough entries to span several directory blocks.
+    """
+    rng = random.Random(7)
+    root = tmp_path / "src"
+    for directory in ("lib64/hw", "bin", "etc/many"):
+        (root / directory).mkdir(parents=True)
+    (root / "lib64/libfoo.so").write_bytes((_noise(rng, 700) * 60)[:40000])
+    (root / "lib64/hw/tiny.so").write_bytes(b"tiny")
+    (root / "lib64/aligned.bin").write_bytes(_noise(rng, 8192))
+    (root / "lib64/big.bin").write_bytes(_noise(rng, 300 << 10))
+    (root / "etc/empty.conf").write_bytes(b"")
+    with open(root / "etc/sparse.bin", "wb") as f:
+        f.write(b"head")
+        f.seek(200 << 10)
+        f.write(b"tail")
+    (root / "bin/daemon").write_bytes(b"#!/bin/sh\necho hi\n")
+    os.chmod(root / "bin/daemon", 0o755)
+    os.utime(root / "bin/daemon", (DAEMON_MTIME, DAEMON_MTIME))
+    os.symlink("/vendor/lib64/hw/tiny.so", root / "lib64/fast_link.so")
+    os.symlink("../" + "x" * 90, root / "lib64/slow_link.so")
+    for i in range(300):
+        (root / f"etc/many/entry_with_a_fairly_long_name_{i:03d}.rc").write_bytes(b"%d" % i)
+    return root
+
+
+def read_tree(fs):
+    """``{path: (kind, payload)}`` of a filesystem reader's files and symlinks."""
+    tree = {}
+    for entry in fs.walk():
+        if entry.is_symlink:
+            tree[entry.path] = ("link", fs.readlink(entry))
+        elif entry.is_file:
+            tree[entry.path] = ("file", fs.read_file(entry))
+    return tree
+
+
+def host_tree(root):
+    """The same mapping for a directory on the host."""
+    tree = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            path = os.path.join(dirpath, name)
+            rel = os.path.relpath(path, root).replace(os.sep, "/")
+            if os.path.islink(path):
+                tree[rel] = ("link", os.readlink(path))
+            elif os.path.isfile(path):
+                with open(path, "rb") as f:
+                    tree[rel] = ("file", f.read())
+    return tree
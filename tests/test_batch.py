@@ -0,0 +1,50 @@
+import shutil
+
+import fixtures
+from batch import BatchJob, BatchRunner
+
+
+def job(tmp_path, name, images):
+    return BatchJob(
+        name=name, vendor="acme", device=name, images=images, output=tmp_path / "out" / name,
+        android_version="13", patterns=None, pin=False, dedup=False,
+    )
+
+
+def split_copy(image, directory, parts=3):
+    """Store ``image`` as ``directory/vendor.img.part_*``."""
+    directory.mkdir()
+    data = image.read_bytes()
+    step = -(-len(data) // parts)
+    for index in range(parts):
+        part = directory / f"vendor.img.part_{index:02d}"
+        part.write_bytes(data[index * step:(index + 1) * step])
+
+
+def test_shared_split_image(source_tree, tmp_path):
+    image = tmp_path / "vendor.raw"
+    fixtures.write_erofs(str(source_tree), str(image))
+    split_copy(image, tmp_path / "a")
+    split_copy(image, tmp_path / "b")
+    (tmp_path / "c").mkdir()
+    shutil.copy(image, tmp_path / "c" / "vendor.img")
+    jobs = [job(tmp_path, name, tmp_path / name) for name in ("a", "b", "c")]
+
+    groups = BatchRunner(jobs, tmp_path / "work", budget=2)._group_images()
+    assert [[user.name for user, _ in users] for users in groups.values()] == [["a", "b", "c"]]
+
+
+def test_failed_extraction_fails_job(tmp_path, monkeypatch):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+        (tmp_path / name / "vendor.img").write_bytes(name.encode() * 1000)
+        (tmp_path / name / "odm.img").write_bytes(b"odm" * 1000)
+    jobs = [job(tmp_path, name, tmp_path / name) for name in ("a", "b")]
+    runner = BatchRunner(jobs, tmp_path / "work", budget=2)
+
+    def extract(index, users):
+        return users[0][1].name != "odm.img"
+
+    monkeypatch.setattr(runner, "_extract", extract)
+    monkeypatch.setattr(runner, "_generate", lambda job, jobs: True)
+    assert runner.run() == {"a": False, "b": False}
@@ -0,0 +1,46 @@
+import os
+
+import blobstore
+from blobstore import BlobStore
+
+
+def test_shared_store_reuses_digests(tmp_path, monkeypatch):
+    trees = []
+    for name in ("device_a", "device_b"):
+        lib = tmp_path / name / "vendor/lib64"
+        lib.mkdir(parents=True)
+        (lib / "libfoo.so").write_bytes(name.encode() * 1000)
+        (lib / "libbar.so").write_bytes(b"shared" * 1000)
+        trees.append(tmp_path / name / "vendor")
+
+    hashed = []
+    hash_file = blobstore.hash_file
+
+    def counting_hash_file(path):
+        hashed.append(path)
+        return hash_file(path)
+
+    monkeypatch.setattr(blobstore, "hash_file", counting_hash_file)
+
+    def add(tree):
+        with BlobStore(tmp_path / "store") as store:
+            files = [("vendor", f"lib64/{name}", str(tree / "lib64" / name))
+                     for name in ("libfoo.so", "libbar.so")]
+            return store.add_many(files)
+
+    first = [add(tree) for tree in trees]
+    assert len(hashed) == 4
+    assert first[0][1][0] == first[1][1][0]
+    assert first[0][0][0] != first[1][0][0]
+    # Alternating runs over the same paths reuse every digest.
+    for tree in trees + trees:
+        add(tree)
+    assert len(hashed) == 4
+
+    changed = trees[0] / "lib64/libfoo.so"
+    changed.write_bytes(b"rebuilt" * 1000)
+    os.utime(changed, ns=(0, 10 ** 9))
+    _, obj = add(trees[0])[0]
+    assert hashed[4:] == [str(changed)]
+    with open(obj, "rb") as f:
+        assert f.read() == b"rebuilt" * 1000
@@ -0,0 +1,38 @@
+from catalog import KIND_OTHER, KIND_SHARED_LIBRARY, BlobCatalog
+from elf import ElfInfo
+
+
+def library(soname):
+    return ElfInfo("lib64/libfoo.so", "DYN", 2, "aarch64", soname, False, ())
+
+
+def test_rows():
+    catalog = BlobCatalog()
+    first = catalog.add("vendor", "lib64/libfoo.so", 10)
+    second = catalog.add("odm", "lib64/libfoo.so", 20)
+    third = catalog.add("vendor", "etc/init.rc", 30)
+    assert list(catalog) == [
+        ("vendor", "lib64/libfoo.so"), ("odm", "lib64/libfoo.so"), ("vendor", "etc/init.rc")
+    ]
+    assert catalog.rows_named("libfoo.so") == [first, second]
+    assert catalog.rows_named("init.rc") == [third]
+    assert catalog.rows_named("missing") == []
+    assert sorted(catalog.names()) == ["init.rc", "libfoo.so"]
+    assert catalog.key(second) == "odm/lib64/libfoo.so"
+
+
+def test_reclassify():
+    catalog = BlobCatalog()
+    row = catalog.add("vendor", "lib64/libfoo.so")
+    catalog.set_elf(row, library("libfoo.so"), ["libbar"])
+    assert catalog.kind[row] == KIND_SHARED_LIBRARY
+    assert (catalog.soname_of(row), catalog.arch(row)) == ("libfoo.so", "aarch64")
+    assert catalog.shared_libs[row] == ("libbar",)
+
+    catalog.set_elf(row, library("libfoo_v2.so"))
+    assert catalog.soname_of(row) == "libfoo_v2.so"
+    assert catalog.shared_libs[row] is None
+
+    catalog.set_elf(row, None)
+    assert catalog.kind[row] == KIND_OTHER
+    assert (catalog.soname_of(row), catalog.arch(row)) == (None, None)
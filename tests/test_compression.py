@@ -0,0 +1,140 @@
+import gzip
+import lzma
+import os
+import random
+import shutil
+import subprocess
+import zlib
+
+import pytest
+
+import compressed
+import fixtures
+from compression import DecompressionError, deflate_decompress, lz4_block_decompress
+from image import open_image
+
+needs_lz4 = pytest.mark.skipif(shutil.which("lz4") is None, reason="lz4 not installed")
+
+
+def sample(rng, size):
+    """Random bytes, short repeats (overlapping matches) and text."""
+    pieces = []
+    while sum(map(len, pieces)) < size:
+        kind = rng.randrange(3)
+        if kind == 0:
+            n = rng.randint(1, 300)
+            pieces.append(rng.getrandbits(8 * n).to_bytes(n, "little"))
+        elif kind == 1:
+            pieces.append(bytes([rng.randrange(256)]) * rng.randint(1, 70000))
+        else:
+            pieces.append(b"ro.vendor.build.prop=%d\n" % rng.randrange(10 ** 6) * 40)
+    return b"".join(pieces)[:size]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_lz4_block(seed):
+    data = sample(random.Random(seed), 200000)
+    block = fixtures.lz4_compress_block(data)
+    assert len(block) < len(data)
+    assert lz4_block_decompress(block, len(data)) == data
+    # Only as much as asked for, as EROFS decodes partial pclusters.
+    assert lz4_block_decompress(block, 1000) == data[:1000]
+    with pytest.raises(DecompressionError):
+        lz4_block_decompress(block[: len(block) // 2], len(data))
+
+
+def test_lz4_block_corrupt():
+    block = fixtures.lz4_compress_block(b"abcd" * 100)
+    # A match reaching back before the start of the output.
+    with pytest.raises(DecompressionError):
+        lz4_block_decompress(block[:5] + b"\xff\xff" + block[7:], 400)
+    assert lz4_block_decompress(b"\x50hello", 5) == b"hello"
+
+
+def test_deflate():
+    data = sample(random.Random(9), 100000)
+    stream = zlib.compressobj(9, zlib.DEFLATED, -15)
+    raw = stream.compress(data) + stream.flush()
+    assert deflate_decompress(raw, len(data)) == data
+    with pytest.raises(DecompressionError):
+        deflate_decompress(raw[:100], len(data))
+    with pytest.raises(DecompressionError):
+        deflate_decompress(b"\xff" * 16, 10)
+
+
+@pytest.fixture
+def raw_image(tmp_path):
+    """3 MiB of mixed data around a 2 MiB run of zeroes."""
+    rng = random.Random(21)
+    data = sample(rng, 2 << 20) + bytes(2 << 20) + sample(rng, 1 << 20)
+    path = tmp_path / "raw.img"
+    path.write_bytes(data)
+    return path
+
+
+def gzip_members(data):
+    """bgzip-style: independently decodable members of 64 KiB each."""
+    return b"".join(gzip.compress(data[i:i + 65536]) for i in range(0, len(data), 65536))
+
+
+def check_reads(path, data):
+    rng = random.Random(4)
+    with open_image(str(path)) as image:
+        assert image.size == len(data)
+        for _ in range(200):
+            offset = rng.randrange(len(data))
+            length = rng.randint(1, 1 << 18)
+            assert image.pread(offset, length) == data[offset:offset + length]
+        assert image.pread(len(data) - 5, 50) == data[-5:]
+        image.copy_to(str(path) + ".out")
+    with open(str(path) + ".out", "rb") as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize(
+    "suffix,compress",
+    [
+        (".gz", gzip.compress),
+        (".gz", gzip_members),
+        (".xz", lzma.compress),
+    ],
+    ids=["gzip", "bgzip", "xz"],
+)
+def test_compressed_image(raw_image, tmp_path, suffix, compress):
+    data = raw_image.read_bytes()
+    (tmp_path / f"vendor.img{suffix}").write_bytes(compress(data))
+    check_reads(tmp_path / "vendor.img", data)
+
+
+@needs_lz4
+@pytest.mark.parametrize(
+    "options", [["-B4"], ["-B4", "-BD"], ["-B5", "-BX", "--content-size"]]
+)
+def test_lz4_frame(raw_image, tmp_path, options):
+    subprocess.run(
+        ["lz4", "-q", "-f", *options, str(raw_image), str(tmp_path / "vendor.img.lz4")],
+        check=True,
+    )
+    check_reads(tmp_path / "vendor.img", raw_image.read_bytes())
+
+
+def test_seek_index_reuse(raw_image, tmp_path, monkeypatch):
+    data = raw_image.read_bytes()
+    packed = tmp_path / "vendor.img.gz"
+    packed.write_bytes(gzip.compress(data))
+    check_reads(tmp_path / "vendor.img", data)
+    assert os.path.exists(str(packed) + compressed.INDEX_SUFFIX)
+
+    def rebuild(self):
+        raise AssertionError("seek index rebuilt")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(compressed.CompressedImage, "_build_index", rebuild)
+        check_reads(tmp_path / "vendor.img", data)
+
+    # A replaced input invalidates the index.
+    changed = data[::-1]
+    packed.write_bytes(gzip.compress(changed))
+    st = packed.stat()
+    os.utime(packed, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+    check_reads(tmp_path / "vendor.img", changed)
@@ -0,0 +1,126 @@
+import os
+import stat
+
+import pytest
+
+import fixtures
+from conftest import DAEMON_MTIME, host_tree, read_tree
+from filesystem import FilesystemError, open_filesystem
+from image import open_image
+
+needs_mke2fs = pytest.mark.skipif(not fixtures.have_mke2fs(), reason="mke2fs not installed")
+needs_mkfs_erofs = pytest.mark.skipif(
+    not fixtures.have_mkfs_erofs(), reason="mkfs.erofs not installed"
+)
+
+
+def ext4_image(src, path, block_size=4096, features=None):
+    fixtures.build_ext4(str(src), str(path), 1 << 20, block_size, features)
+    return path
+
+
+def check_reader(src, image_path, fs_type, daemon_mtime=DAEMON_MTIME):
+    with open_image(str(image_path)) as image:
+        fs = open_filesystem(image)
+        assert fs.fs_type == fs_type
+        assert read_tree(fs) == host_tree(src)
+        daemon = fs.lookup("bin/daemon")
+        assert stat.S_IMODE(daemon.mode) == 0o755
+        assert daemon.mtime == daemon_mtime
+        chunks = list(fs.iter_content(fs.lookup("lib64/big.bin"), chunk_size=5000))
+        assert max(map(len, chunks)) <= 5000
+        assert b"".join(chunks) == (src / "lib64/big.bin").read_bytes()
+        with pytest.raises(FileNotFoundError):
+            fs.lookup("lib64/missing.so")
+
+
+@needs_mke2fs
+@pytest.mark.parametrize(
+    "block_size,features",
+    [
+        (4096, None),
+        (1024, None),
+        (4096, "^extent,^64bit"),
+        (1024, "^extent,^64bit"),
+        (4096, "inline_data"),
+    ],
+)
+def test_ext4(source_tree, tmp_path, block_size, features):
+    image = ext4_image(source_tree, tmp_path / "vendor.img", block_size, features)
+    check_reader(source_tree, image, "ext4")
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_erofs(source_tree, tmp_path, compress):
+    image = tmp_path / "vendor.img"
+    fixtures.write_erofs(str(source_tree), str(image), compress=compress)
+    # Compact inodes carry no timestamp of their own, only the build time.
+    check_reader(source_tree, image, "erofs", daemon_mtime=1230768000)
+
+
+@needs_mkfs_erofs
+@pytest.mark.parametrize("compression", [None, "lz4", "lz4hc"])
+def test_erofs_mkfs(source_tree, tmp_path, compression):
+    image = tmp_path / "vendor.img"
+    fixtures.build_erofs(str(source_tree), str(image), compression)
+    check_reader(source_tree, image, "erofs", daemon_mtime=1230768000)
+
+
+@needs_mke2fs
+def test_sparse_ext4(source_tree, tmp_path):
+    raw = ext4_image(source_tree, tmp_path / "raw.img")
+    fixtures.write_sparse(str(raw), str(tmp_path / "vendor.img"))
+    check_reader(source_tree, tmp_path / "vendor.img", "ext4")
+
+
+def test_not_a_filesystem(tmp_path):
+    (tmp_path / "junk.img").write_bytes(bytes(64 << 10))
+    with open_image(str(tmp_path / "junk.img")) as image:
+        with pytest.raises(FilesystemError):
+            open_filesystem(image)
+
+
+@needs_mke2fs
+def test_extract_tree(source_tree, tmp_path):
+    image = ext4_image(source_tree, tmp_path / "vendor.img")
+    dest = tmp_path / "out"
+    with open_image(str(image)) as raw:
+        fs = open_filesystem(raw)
+        count = fs.extract_tree(str(dest), select=lambda path: not path.startswith("etc/many"))
+    expected = {
+        path: value for path, value in host_tree(source_tree).items()
+        if not path.startswith("etc/many")
+    }
+    assert host_tree(dest) == expected
+    assert count == len(expected)
+    assert os.stat(dest / "bin/daemon").st_mode & 0o777 == 0o755
+    assert os.stat(dest / "bin/daemon").st_mtime == DAEMON_MTIME
+
+
+@needs_mke2fs
+def test_extract_rerun_replaces_links(tmp_path):
+    """A rerun over links left by an earlier image never writes through them."""
+    outside = tmp_path / "outside"
+    (outside / "dir").mkdir(parents=True)
+    (outside / "victim").write_bytes(b"keep")
+
+    first = tmp_path / "first"
+    (first / "lib64").mkdir(parents=True)
+    os.symlink(str(outside / "victim"), first / "lib64/libfoo.so")
+    os.symlink(str(outside / "dir"), first / "etc")
+
+    second = tmp_path / "second"
+    (second / "lib64").mkdir(parents=True)
+    (second / "etc").mkdir()
+    (second / "lib64/libfoo.so").write_bytes(b"new library")
+    (second / "etc/init.rc").write_bytes(b"service foo")
+
+    dest = tmp_path / "out"
+    for src in (first, second, second):
+        image = ext4_image(src, tmp_path / f"{src.name}.img")
+        with open_image(str(image)) as raw:
+            open_filesystem(raw).extract_tree(str(dest))
+
+    assert (outside / "victim").read_bytes() == b"keep"
+    assert os.listdir(outside / "dir") == []
+    assert host_tree(dest) == host_tree(second)
@@ -0,0 +1,89 @@
+import struct
+
+import fixtures
+from filesystem import open_filesystem
+from fwdiff import diff_sources, open_source
+from image import open_image
+from patterns import PatternMatcher
+
+_EROFS_BLOCK = 4096
+_Z_EROFS_ADVISE_FRAGMENT_PCLUSTER = 0x20
+
+
+def erofs_images(tmp_path, side, files):
+    src = tmp_path / f"{side}-src"
+    for path, data in files.items():
+        (src / path).parent.mkdir(parents=True, exist_ok=True)
+        (src / path).write_bytes(data)
+    (tmp_path / side).mkdir()
+    image = tmp_path / side / "vendor.img"
+    fixtures.write_erofs(str(src), str(image), compress=True)
+    return image
+
+
+def mark_packed_fragment(image_path, path):
+    """Flag ``path`` as stored in the packed inode, as ``mkfs.erofs -Efragments`` does."""
+    with open_image(str(image_path)) as image:
+        nid = open_filesystem(image).lookup(path).inode
+    # Metadata starts at block 1; the map header follows the 32-byte compact inode.
+    advise = (_EROFS_BLOCK + nid * 32 + 32 + 7) // 8 * 8 + 4
+    with open(image_path, "r+b") as f:
+        f.seek(advise)
+        f.write(struct.pack("<H", _Z_EROFS_ADVISE_FRAGMENT_PCLUSTER))
+
+
+def test_undecodable_blob(tmp_path):
+    old_files = {
+        "lib64/libsame.so": b"same" * 3000,
+        "lib64/libpacked.so": b"old" * 3000,
+        "lib64/libchanged.so": b"before" * 3000,
+        "lib64/libgone.so": b"gone" * 3000,
+    }
+    new_files = dict(old_files)
+    new_files["lib64/libpacked.so"] = b"new" * 3000
+    new_files["lib64/libchanged.so"] = b"after!" * 3000
+    new_files["lib64/libadded.so"] = b"added" * 3000
+    new_files["lib64/libadded_packed.so"] = b"packed" * 3000
+    del new_files["lib64/libgone.so"]
+    erofs_images(tmp_path, "old", old_files)
+    new_image = erofs_images(tmp_path, "new", new_files)
+    mark_packed_fragment(new_image, "lib64/libpacked.so")
+    mark_packed_fragment(new_image, "lib64/libadded_packed.so")
+
+    matcher = PatternMatcher.from_file(None)
+    old = open_source(tmp_path / "old", matcher)
+    new = open_source(tmp_path / "new", matcher)
+    try:
+        changelog = diff_sources(old, new, jobs=2)
+    finally:
+        old.close()
+        new.close()
+
+    assert changelog["incomplete"] == []
+    assert changelog["unreadable"] == [
+        "vendor/lib64/libadded_packed.so",
+        "vendor/lib64/libpacked.so",
+    ]
+    assert [entry["path"] for entry in changelog["added"]] == ["vendor/lib64/libadded.so"]
+    assert [entry["path"] for entry in changelog["removed"]] == ["vendor/lib64/libgone.so"]
+    assert [entry["path"] for entry in changelog["modified"]] == ["vendor/lib64/libchanged.so"]
+    assert changelog["summary"]["unchanged"] == 1
+
+
+def test_unreadable_partition(tmp_path):
+    erofs_images(tmp_path, "old", {"lib64/libfoo.so": b"foo" * 3000})
+    (tmp_path / "new").mkdir()
+    (tmp_path / "new" / "vendor.img").write_bytes(bytes(64 << 10))
+
+    matcher = PatternMatcher.from_file(None)
+    old = open_source(tmp_path / "old", matcher)
+    new = open_source(tmp_path / "new", matcher)
+    try:
+        changelog = diff_sources(old, new)
+    finally:
+        old.close()
+        new.close()
+
+    assert new.unreadable == ["vendor"]
+    assert changelog["incomplete"] == ["vendor"]
+    assert changelog["removed"] == []
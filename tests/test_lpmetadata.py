@@ -0,0 +1,99 @@
+import random
+
+import pytest
+
+import fixtures
+from lpmetadata import LpMetadataError, SuperImage, is_super_image
+
+METADATA_MAX_SIZE = 65536
+METADATA_BASE = 4096 + 2 * 4096
+
+
+@pytest.fixture
+def images(tmp_path):
+    rng = random.Random(11)
+    sizes = {"system_a": 3 << 20, "system_b": 0, "vendor": (1 << 20) + 1234}
+    paths = {}
+    for name, size in sizes.items():
+        paths[name] = tmp_path / f"{name}.img"
+        data = rng.getrandbits(8 * size).to_bytes(size, "little") if size else b""
+        paths[name].write_bytes(data)
+    return paths
+
+
+def build(images, path):
+    fixtures.build_super([(name, str(image)) for name, image in images.items()], str(path))
+    return path
+
+
+def check_partitions(super_path, images):
+    with SuperImage(str(super_path)) as super_image:
+        assert [p.name for p in super_image.partitions] == list(images)
+        for name, image in images.items():
+            data = image.read_bytes()
+            partition = super_image.partition(name)
+            # Extents are whole sectors; the tail past the image is padding.
+            assert partition.size == -(-len(data) // 512) * 512
+            assert partition.group == "default"
+            with super_image.open_partition(name) as view:
+                assert view.pread(0, len(data)) == data
+                if data:
+                    assert view.pread(len(data) - 100, 50) == data[-100:-50]
+
+
+def test_partitions(images, tmp_path):
+    super_path = build(images, tmp_path / "super.img")
+    assert is_super_image(str(super_path))
+    assert not is_super_image(str(images["vendor"]))
+    check_partitions(super_path, images)
+
+    with SuperImage(str(super_path)) as super_image:
+        chosen = super_image.select_slot("_b")
+        # system_b has no extents, so the other slot is used.
+        assert {base: p.name for base, p in chosen.items()} == {
+            "system": "system_a",
+            "vendor": "vendor",
+        }
+        with pytest.raises(KeyError):
+            super_image.partition("odm")
+
+
+def test_sparse_super(images, tmp_path):
+    raw = build(images, tmp_path / "super.raw")
+    fixtures.write_sparse(str(raw), str(tmp_path / "super.img"))
+    assert is_super_image(str(tmp_path / "super.img"))
+    check_partitions(tmp_path / "super.img", images)
+
+
+def corrupt(path, offset):
+    """Flip a byte covered by the checksum of the geometry or metadata at ``offset``."""
+    with open(path, "r+b") as f:
+        f.seek(offset + 48)
+        byte = f.read(1)
+        f.seek(offset + 48)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+
+def test_backup_copies(images, tmp_path):
+    super_path = build(images, tmp_path / "super.img")
+    corrupt(super_path, 4096)
+    corrupt(super_path, METADATA_BASE)
+    check_partitions(super_path, images)
+
+    # Slot 0's backup copy follows the primary copies of both slots.
+    corrupt(super_path, METADATA_BASE + 2 * METADATA_MAX_SIZE)
+    with pytest.raises(LpMetadataError):
+        SuperImage(str(super_path))
+    # Slot 1 is untouched.
+    with SuperImage(str(super_path), slot=1) as super_image:
+        assert len(super_image.partitions) == 3
+
+
+def test_bad_geometry(images, tmp_path):
+    super_path = build(images, tmp_path / "super.img")
+    corrupt(super_path, 4096)
+    corrupt(super_path, 8192)
+    with pytest.raises(LpMetadataError):
+        SuperImage(str(super_path))
+    with pytest.raises(LpMetadataError):
+        SuperImage(str(build(images, tmp_path / "other.img")), slot=2)
@@ -0,0 +1,30 @@
+import fixtures
+import generator
+import profiling
+from generator import VendorTreeGenerator
+
+
+def test_extract_sizes_image_only_when_profiling(source_tree, tmp_path, monkeypatch):
+    (tmp_path / "images").mkdir()
+    image = tmp_path / "images" / "vendor.img"
+    fixtures.write_erofs(str(source_tree), str(image))
+    sized = []
+    image_size = generator.image_size
+
+    def counting_image_size(path):
+        sized.append(path)
+        return image_size(path)
+
+    monkeypatch.setattr(generator, "image_size", counting_image_size)
+    tree = VendorTreeGenerator("acme", "widget", work_dir=tmp_path / "work")
+
+    assert tree.extract_image(image)
+    assert sized == []
+
+    profiler = profiling.enable()
+    try:
+        assert tree.extract_image(image)
+    finally:
+        profiling.disable()
+    assert sized == [image]
+    assert profiler.summary()["extract"]["size"] == image.stat().st_size
@@ -0,0 +1,28 @@
+import os
+
+from patterns import PatternMatcher
+from scanner import scan_partitions
+
+
+def test_sorted_by_partition_and_path(tmp_path):
+    paths = [
+        "vendor/lib64/libz.so",
+        "vendor/lib64/hw/camera.so",
+        "vendor/lib64/libA.so",
+        "vendor/lib64.so",
+        "vendor/etc/init/b.rc",
+        "vendor/etc/a.xml",
+        "vendor/etc/init.rc",
+        "odm/lib64/libodm.so",
+        "odm/etc/odm.xml",
+    ]
+    for path in paths:
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_bytes(path.encode())
+    os.symlink("hw", tmp_path / "vendor/lib64/hw_link")
+
+    matcher = PatternMatcher()
+    found = [(entry.partition, entry.rel_path) for entry in scan_partitions(tmp_path, matcher)]
+    expected = sorted(tuple(path.split("/", 1)) for path in paths)
+    expected.append(("vendor", "lib64/hw_link"))
+    assert found == sorted(expected)
@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+import fixtures
+from image import open_image
+from sparse import (
+    CHUNK_TYPE_DONT_CARE,
+    CHUNK_TYPE_FILL,
+    CHUNK_TYPE_RAW,
+    SparseImage,
+    SparseImageError,
+    is_sparse_image,
+)
+
+BLOCK = 4096
+
+
+@pytest.fixture
+def raw_image(tmp_path):
+    """Random, zero and pattern-filled blocks in runs of varying length."""
+    rng = random.Random(3)
+    blocks = []
+    for run in range(40):
+        kind, count = run % 3, rng.randint(1, 5)
+        if kind == 0:
+            blocks.append(rng.getrandbits(8 * BLOCK * count).to_bytes(BLOCK * count, "little"))
+        elif kind == 1:
+            blocks.append(bytes(BLOCK * count))
+        else:
+            blocks.append(bytes([run, 0xAB, 0xCD, 0xEF]) * (BLOCK // 4 * count))
+    path = tmp_path / "raw.img"
+    path.write_bytes(b"".join(blocks))
+    return path
+
+
+def test_round_trip(raw_image, tmp_path):
+    sparse_path = tmp_path / "vendor.img"
+    fixtures.write_sparse(str(raw_image), str(sparse_path))
+    data = raw_image.read_bytes()
+    assert is_sparse_image(str(sparse_path))
+    assert not is_sparse_image(str(raw_image))
+
+    with SparseImage(str(sparse_path)) as image:
+        assert image.size == len(data)
+        types = {chunk.type for chunk in image.chunks}
+        assert types == {CHUNK_TYPE_RAW, CHUNK_TYPE_FILL, CHUNK_TYPE_DONT_CARE}
+        rng = random.Random(5)
+        for _ in range(300):
+            offset = rng.randrange(len(data))
+            length = rng.randint(1, 3 * BLOCK)
+            assert image.pread(offset, length) == data[offset:offset + length]
+        assert image.pread(len(data) - 10, 100) == data[-10:]
+        assert image.pread(len(data), 10) == b""
+        image.copy_to(str(tmp_path / "copy.img"))
+    assert (tmp_path / "copy.img").read_bytes() == data
+
+    with open_image(str(sparse_path)) as image:
+        assert isinstance(image, SparseImage)
+        image.seek(BLOCK + 3)
+        assert image.read(BLOCK) == data[BLOCK + 3:2 * BLOCK + 3]
+
+
+def test_split_parts(raw_image, tmp_path):
+    sparse_path = tmp_path / "vendor.img"
+    fixtures.write_sparse(str(raw_image), str(sparse_path))
+    blob = sparse_path.read_bytes()
+    sparse_path.unlink()
+    third = len(blob) // 3
+    for index, start in enumerate((0, third, 2 * third)):
+        end = start + third if index < 2 else len(blob)
+        (tmp_path / f"vendor.img.part_{index:02d}").write_bytes(blob[start:end])
+    with open_image(str(sparse_path)) as image:
+        assert image.pread(0, image.size) == raw_image.read_bytes()
+
+
+def test_malformed(raw_image, tmp_path):
+    sparse_path = tmp_path / "vendor.img"
+    fixtures.write_sparse(str(raw_image), str(sparse_path))
+    blob = bytearray(sparse_path.read_bytes())
+
+    bad_magic = tmp_path / "magic.img"
+    bad_magic.write_bytes(b"\0" * 4 + blob[4:])
+    with pytest.raises(SparseImageError):
+        SparseImage(str(bad_magic))
+
+    truncated = tmp_path / "truncated.img"
+    truncated.write_bytes(blob[:40])
+    with pytest.raises(SparseImageError):
+        SparseImage(str(truncated))
+
+    # One block more in the header than the chunks describe.
+    blob[16:20] = (int.from_bytes(blob[16:20], "little") + 1).to_bytes(4, "little")
+    bad_total = tmp_path / "total.img"
+    bad_total.write_bytes(bytes(blob))
+    with pytest.raises(SparseImageError):
+        SparseImage(str(bad_total))
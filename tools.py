@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+
+import asyncio
+import atexit
+import concurrent.futures
+import functools
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import threading
+import weakref
+from collections import deque
+from typing import Callable, List, Optional, Sequence
+
+import profiling
+
+# Seconds a tool may run before its process group is killed, by executable.
+TOOL_TIMEOUTS = {
+    "mount": 120,
+    "umount": 60,
+    "lpunpack": 3600,
+    "simg2img": 3600,
+    "debugfs": 3600,
+    "cp": 3600,
+    "7z": 3600,
+}
+DEFAULT_TIMEOUT = 1800
+
+# Seconds between SIGTERM and SIGKILL when a tool is stopped.
+_KILL_GRACE = 5
+# stderr lines kept for the error message of a failed tool.
+_STDERR_TAIL = 20
+_READ_SIZE = 1 << 16
+
+
+class ToolError(subprocess.CalledProcessError):
+    """A tool exited non-zero, timed out or was cancelled.
+
+    ``stderr`` holds the last lines the tool wrote to its error output.
+    """
+
+    def __init__(self, returncode, cmd, output=None, stderr=None, reason=None):
+        super().__init__(returncode, cmd, output, stderr)
+        self.reason = reason
+
+    def __str__(self):
+        message = self.reason or super().__str__()
+        last = (self.stderr or "").strip().splitlines()[-1:]
+        return f"{message}: {last[0]}" if last else message
+
+
+@functools.lru_cache(maxsize=None)
+def find_tool(name: str) -> Optional[str]:
+    """``shutil.which(name)``, looked up once per process."""
+    return shutil.which(name)
+
+
+def tool_name(args: Sequence[str]) -> str:
+    """Executable a command runs, looking through ``sudo``."""
+    args = list(args)
+    while args and os.path.basename(args[0]) == "sudo":
+        args = args[1:]
+    return os.path.basename(args[0]) if args else ""
+
+
+class ToolRunner:
+    """Runs external tools as asyncio subprocesses on one background loop.
+
+    ``run`` may be called from any thread, so the extraction pools overlap
+    their tools instead of queueing behind blocking ``subprocess.run``
+    calls, and ``run_many`` starts several independent commands at once.
+    stderr is streamed line by line to the log as it arrives, keeping only
+    a short tail for error messages; stdout is captured or streamed too.
+    Each command has a timeout (``TOOL_TIMEOUTS``), after which its whole
+    process group gets SIGTERM and then SIGKILL. A caller interrupted while
+    waiting kills its tool before the exception propagates.
+
+    ``defer`` registers reclaim actions (unmounts, temporary files) that
+    ``close`` runs if their owner has not already done so; the shared
+    runner closes at interpreter exit.
+    """
+
+    def __init__(self, logger: Optional[logging.Logger] = None):
+        self.logger = logger or logging.getLogger("tools")
+        self._loop = None
+        self._lock = threading.Lock()
+        self._active = set()
+        self._interrupted = False
+        self._deferred = {}
+        self._next_token = 0
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="tools", daemon=True
+                ).start()
+            return self._loop
+
+    def run(
+        self,
+        args: Sequence,
+        *,
+        input: Optional[str] = None,
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        capture_output: bool = True,
+        check: bool = False,
+        cleanup: bool = False,
+    ) -> subprocess.CompletedProcess:
+        """Run one command and wait for it.
+
+        Returns a ``CompletedProcess`` with text ``stdout`` (empty unless
+        ``capture_output``) and the ``stderr`` tail. ``check`` raises
+        ``ToolError`` on a non-zero exit; timeouts and cancellation always
+        raise it. ``cleanup`` commands (unmounts) still run after
+        ``interrupt``.
+        """
+        return self.run_many(
+            [args], input=input, cwd=cwd, timeout=timeout,
+            capture_output=capture_output, check=check, cleanup=cleanup,
+        )[0]
+
+    def run_many(
+        self,
+        commands: List[Sequence],
+        *,
+        input: Optional[str] = None,
+        cwd: Optional[str] = None,
+        timeout: Optional[float] = None,
+        capture_output: bool = True,
+        check: bool = False,
+        cleanup: bool = False,
+    ) -> List[subprocess.CompletedProcess]:
+        """Run independent commands concurrently; results keep their order."""
+        commands = [[str(arg) for arg in args] for args in commands]
+        if not commands:
+            return []
+        loop = self._ensure_loop()
+        names = ",".join(sorted({tool_name(args) for args in commands}))
+        if self._interrupted and not cleanup:
+            raise ToolError(-signal.SIGINT, commands[0], reason=f"{names}: interrupted")
+        with profiling.stage("tool", tool=names, commands=len(commands)) as span:
+            futures = []
+            for args in commands:
+                limit = timeout if timeout is not None else TOOL_TIMEOUTS.get(
+                    tool_name(args), DEFAULT_TIMEOUT
+                )
+                coroutine = self._run(args, input, cwd, limit, capture_output)
+                futures.append(asyncio.run_coroutine_threadsafe(coroutine, loop))
+            try:
+                results = [future.result() for future in futures]
+            except BaseException:
+                for future in futures:
+                    future.cancel()
+                concurrent.futures.wait(futures, timeout=3 * _KILL_GRACE)
+                raise
+            span.count(
+                stdout_bytes=sum(len(result.stdout) for result in results),
+                failed=sum(1 for result in results if result.returncode),
+            )
+        if check:
+            for result in results:
+                if result.returncode:
+                    raise ToolError(result.returncode, result.args, result.stdout, result.stderr)
+        return results
+
+    async def _run(self, args, input, cwd, timeout, capture_output):
+        tool = tool_name(args)
+        self.logger.debug(f"[{tool}] {' '.join(args)}")
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            cwd=cwd,
+            start_new_session=True,
+        )
+        self._active.add(proc)
+        stdout = []
+        stderr = deque(maxlen=_STDERR_TAIL)
+
+        async def feed():
+            if input is not None:
+                try:
+                    proc.stdin.write(input.encode())
+                    await proc.stdin.drain()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass
+                proc.stdin.close()
+
+        async def pump(stream, capture, tail):
+            pending = b""
+            while True:
+                data = await stream.read(_READ_SIZE)
+                if capture is not None:
+                    if not data:
+                        return
+                    capture.append(data)
+                    continue
+                lines = (pending + data).replace(b"\r", b"\n").split(b"\n")
+                pending = lines.pop() if data else b""
+                for line in lines:
+                    text = line.decode(errors="replace").rstrip()
+                    if text:
+                        if tail is not None:
+                            tail.append(text)
+                        self.logger.debug(f"[{tool}] {text}")
+                if not data:
+                    return
+
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    feed(),
+                    pump(proc.stdout, stdout if capture_output else None, None),
+                    pump(proc.stderr, None, stderr),
+                    proc.wait(),
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            await self._kill(proc)
+            raise ToolError(
+                proc.returncode, args, stderr="\n".join(stderr),
+                reason=f"{tool} timed out after {timeout:g}s",
+            ) from None
+        except BaseException:
+            await asyncio.shield(self._kill(proc))
+            raise
+        finally:
+            self._active.discard(proc)
+        if proc.returncode < 0:
+            raise ToolError(
+                proc.returncode, args, stderr="\n".join(stderr),
+                reason=f"{tool} killed by signal {-proc.returncode}",
+            )
+        output = b"".join(stdout).decode(errors="replace")
+        return subprocess.CompletedProcess(args, proc.returncode, output, "\n".join(stderr))
+
+    async def _kill(self, proc):
+        """Stop a tool and everything it started (its session's process group)."""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            if proc.returncode is not None:
+                return
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            except PermissionError:
+                proc.send_signal(sig)
+            try:
+                await asyncio.wait_for(proc.wait(), _KILL_GRACE)
+            except asyncio.TimeoutError:
+                continue
+
+    def interrupt(self):
+        """Kill running tools and refuse new ones, except ``cleanup`` commands.
+
+        Safe to call from a signal handler.
+        """
+        self._interrupted = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._kill_active)
+
+    def resume(self):
+        """Accept new tools again after ``interrupt`` (the next service request)."""
+        self._interrupted = False
+
+    def _kill_active(self):
+        for proc in list(self._active):
+            asyncio.ensure_future(self._kill(proc))
+
+    def defer(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """Register a reclaim action for ``close``; returns a function running it now.
+
+        Bound methods are held weakly, so registering an object's cleanup
+        does not keep the object alive; entries of objects that have since
+        been collected are dropped here, so a long-lived runner does not
+        accumulate them.
+        """
+        if hasattr(callback, "__self__"):
+            ref = weakref.WeakMethod(callback)
+        else:
+            def ref():
+                return callback
+        with self._lock:
+            for dead in [token for token, other in self._deferred.items() if other() is None]:
+                del self._deferred[dead]
+            token = self._next_token
+            self._next_token += 1
+            self._deferred[token] = ref
+
+        def release():
+            with self._lock:
+                ref = self._deferred.pop(token, None)
+            func = ref() if ref is not None else None
+            if func is not None:
+                func()
+
+        return release
+
+    def close(self):
+        """Kill running tools and run every deferred reclaim action, newest first."""
+        if self._active:
+            self.interrupt()
+        while True:
+            with self._lock:
+                if not self._deferred:
+                    break
+                token = max(self._deferred)
+                ref = self._deferred.pop(token)
+            func = ref()
+            if func is None:
+                continue
+            try:
+                func()
+            except Exception as e:
+                self.logger.warning(f"Cleanup failed: {e}")
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> ToolRunner:
+    """The process-wide runner, closed at interpreter exit."""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ToolRunner()
+            atexit.register(_runner.close)
+        return _runner
+
+
+def run_tool(args: Sequence, **kwargs) -> subprocess.CompletedProcess:
+    """``get_runner().run(args, ...)``."""
+    return get_runner().run(args, **kwargs)
@@ -1,26 +1,34 @@
 import os
-import subprocess
+import threading
+
 import magic
 
+from elf import read_elf_info
+
+_magic = None
+_magic_lock = threading.Lock()
+
 
 def is_elf_file(filepath: str) -> bool:
     """
-    Check if a file is an ELF binary.
+    Check if a file is an ELF executable or shared library.
     """
-    try:
-        output = subprocess.check_output(["file", "--mime-type", "-b", filepath])
-        return b"application/x-executable" in output or b"application/x-sharedlib" in output
-    except Exception:
-        return False
+    info = read_elf_info(filepath)
+    return info is not None and info.elf_type in ("EXEC", "DYN")
 
 
 def get_file_info(filepath: str) -> dict:
     """
     Retrieve basic metadata about a file.
     """
+    global _magic
     try:
-        mime = magic.Magic(mime=True)
-        mime_type = mime.from_file(filepath)
+        # libmagic handles are expensive to open and not thread-safe, so
+        # share a single one behind a lock.
+        with _magic_lock:
+            if _magic is None:
+                _magic = magic.Magic(mime=True)
+            mime_type = _magic.from_file(filepath)
 
         size = os.path.getsize(filepath)
 
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, Optional
+
+# Share of the total budget given to each cache.
+CACHE_SHARES = {
+    "image-blocks": 0.5,
+    "image-index": 0.2,
+    "elf-index": 0.15,
+    "digests": 0.1,
+    "matcher": 0.05,
+}
+
+# Rough in-memory size of parsed JSON relative to its text, used to charge
+# cached indexes against their budget.
+JSON_EXPANSION = 6
+
+
+class SizedCache:
+    """Thread-safe LRU mapping bounded by the approximate size of its values.
+
+    ``put`` is told what a value costs; least recently used entries are
+    evicted once the total passes ``max_bytes``. A value larger than the
+    whole budget is not stored.
+    """
+
+    def __init__(self, name: str, max_bytes: int):
+        self.name = name
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: Hashable, value, size: int):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def get_current(self, key: Hashable, stamp):
+        """Value stored for ``key`` with this ``stamp``; a stale one is dropped."""
+        item = self.get(key)
+        if item is None:
+            return None
+        if item[0] != stamp:
+            self.discard(key)
+            return None
+        return item[1]
+
+    def put_current(self, key: Hashable, stamp, value, size: int):
+        """Store ``value`` for ``key`` as read when its source had ``stamp``."""
+        self.put(key, (stamp, value), size)
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None:
+                self._bytes -= item[1]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_caches: Dict[str, SizedCache] = {}
+
+
+def enable(max_bytes: int) -> Dict[str, SizedCache]:
+    """Keep indexes, digests and decoded blocks in memory across runs.
+
+    ``max_bytes`` is split between the caches by ``CACHE_SHARES``. Entries
+    derived from a file are stored with its stamp (size, mtime, inode) and
+    dropped once it no longer matches, so a changed file is never served
+    from memory.
+    """
+    global _caches
+    _caches = {
+        name: SizedCache(name, int(max_bytes * share)) for name, share in CACHE_SHARES.items()
+    }
+    return _caches
+
+
+def disable():
+    global _caches
+    _caches = {}
+
+
+def get_cache(name: str) -> Optional[SizedCache]:
+    """The named cache, or None when warm caching is off (one-shot runs)."""
+    return _caches.get(name)
+
+
+def stats() -> dict:
+    return {name: cache.stats() for name, cache in _caches.items()}